@@ -0,0 +1,129 @@
+import os
+import time
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows agents - files are copied there
+    fcntl = None
+
+from file_hashing import file_sha256
+from tracing import get_logger, traced
+
+logger = get_logger(__name__)
+
+# number of files staged at the same time
+STAGING_MAX_WORKERS = int(os.environ.get("STAGING_MAX_WORKERS", 8))
+# auto - reflink, then hardlink, then copy; reflink - reflink, then copy; copy
+STAGING_LINK_MODE = os.environ.get("STAGING_LINK_MODE", "auto")
+# ioctl creating a copy-on-write clone of a file (Linux: btrfs, XFS, overlayfs...)
+FICLONE = 0x40049409
+
+
+def is_unchanged(source: str, target: str) -> bool:
+    """
+    Check if the target is the same file as the source, or has the same size,
+    modification time and content.
+    """
+    try:
+        target_stat = os.stat(target)
+    except FileNotFoundError:
+        return False
+    source_stat = os.stat(source)
+    if os.path.samestat(source_stat, target_stat):
+        return True
+    return (
+        source_stat.st_size == target_stat.st_size
+        and int(source_stat.st_mtime) == int(target_stat.st_mtime)
+        and file_sha256(source) == file_sha256(target)
+    )
+
+
+def reflink(source: str, target: str) -> bool:
+    """
+    Clone the source into the target (copy-on-write - the data is not copied and
+    later changes of either file do not affect the other one).
+    Returns False if the filesystem does not support it.
+    """
+    if fcntl is None:
+        return False
+    try:
+        with open(source, "rb") as src, open(target, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        os.remove(target)
+        return False
+    shutil.copystat(source, target)
+    return True
+
+
+def stage_file(source: str, target: str, link_mode: str = STAGING_LINK_MODE) -> str:
+    """
+    Place a file at the target path, replacing the existing one atomically.
+    Depending on link_mode (see STAGING_LINK_MODE), the file is reflinked,
+    hardlinked (if the source and the target directory share a filesystem) or
+    copied, in this order.
+    CAVEAT: a hardlinked target is the same file as the source - it must not be
+    modified in place.
+    Returns the way the file was staged: unchanged, reflinked, hardlinked or copied.
+    """
+    if is_unchanged(source, target):
+        return "unchanged"
+    target_dir = os.path.dirname(target) or "."
+    os.makedirs(target_dir, exist_ok=True)
+    temporary_target = os.path.join(
+        target_dir,
+        f".{os.path.basename(target)}.{os.getpid()}.{threading.get_ident()}.staging",
+    )
+    if os.path.lexists(temporary_target):
+        os.remove(temporary_target)
+    method = "copied"
+    if link_mode in ("auto", "reflink") and reflink(source, temporary_target):
+        method = "reflinked"
+    elif link_mode == "auto" and os.stat(source).st_dev == os.stat(target_dir).st_dev:
+        try:
+            os.link(source, temporary_target)
+            method = "hardlinked"
+        except OSError:
+            pass
+    if method == "copied":
+        shutil.copy2(source, temporary_target)
+    os.replace(temporary_target, target)
+    return method
+
+
+@traced()
+def stage_files(
+    files: list,
+    max_workers: int = STAGING_MAX_WORKERS,
+    link_mode: str = STAGING_LINK_MODE,
+    label: str = "file(s)",
+) -> dict:
+    """
+    Stage many files ((source, target) pairs) concurrently (see stage_file) and
+    print a one-line summary of the batch.
+    Returns the number of files per way they were staged.
+    """
+    started = time.monotonic()
+
+    def stage(pair: tuple) -> str:
+        source, target = pair
+        method = stage_file(str(source), str(target), link_mode)
+        logger.debug(f"{method}: {source} -> {target}")
+        return method
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        methods = list(executor.map(stage, files))
+    summary = {
+        method: methods.count(method)
+        for method in ["reflinked", "hardlinked", "copied", "unchanged"]
+    }
+    size = sum(os.path.getsize(str(source)) for source, _ in files)
+    print(
+        f"Staged {len(files)} {label} ({round(size / 2**20, 2)} MB) in "
+        f"{round(time.monotonic() - started, 2)} s: "
+        + ", ".join(f"{count} {method}" for method, count in summary.items())
+    )
+    return summary
@@ -0,0 +1,35 @@
+import os
+
+from artifact_staging import stage_file
+
+
+def test_stage_file_copies_and_skips_unchanged_files(tmp_path):
+    source = tmp_path / "package-0.1-py3-none-any.whl"
+    source.write_bytes(b"wheel")
+    target = tmp_path / "staged" / "package-0.1-py3-none-any.whl"
+    assert stage_file(str(source), str(target), "copy") == "copied"
+    assert target.read_bytes() == b"wheel"
+    assert not os.path.samefile(source, target)
+    assert stage_file(str(source), str(target), "copy") == "unchanged"
+
+
+def test_stage_file_links_files_on_the_same_filesystem(tmp_path):
+    source = tmp_path / "notebook.py"
+    source.write_bytes(b"print(1)")
+    target = tmp_path / "staged" / "notebook.py"
+    assert stage_file(str(source), str(target), "auto") in ("reflinked", "hardlinked")
+    assert target.read_bytes() == b"print(1)"
+    assert stage_file(str(source), str(target), "auto") == "unchanged"
+
+
+def test_stage_file_replaces_modified_files(tmp_path):
+    source = tmp_path / "notebook.py"
+    source.write_bytes(b"print(1)")
+    target = tmp_path / "staged" / "notebook.py"
+    stage_file(str(source), str(target), "copy")
+    # a new file, as hardlinked targets must not be modified in place
+    os.remove(source)
+    source.write_bytes(b"print(2)")
+    assert stage_file(str(source), str(target), "copy") == "copied"
+    assert target.read_bytes() == b"print(2)"
+    assert os.listdir(target.parent) == ["notebook.py"]
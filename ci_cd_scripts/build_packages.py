@@ -1,5 +1,25 @@
-import subprocess
+import os
 import sys
+import shutil
+import hashlib
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union
+
+from tracing import traced
+
+
+# wheels built from a source tree with a given setup.py are kept in
+# <WHEEL_CACHE_DIR>/<hash>/ (see build_wheel_cached)
+WHEEL_CACHE_DIR = os.environ.get("WHEEL_CACHE_DIR", ".wheel_cache")
+# directories which are build outputs or caches, not package sources
+IGNORED_DIRS = {
+    "build", "dist", "__pycache__", ".git", ".eggs", ".pytest_cache", ".tox", ".venv"
+}
+# files which setup.py scripts read relative to the current directory (the builds
+# are run from the repository root)
+SETUP_INPUT_FILES = ("README.md", "setup.cfg", "pyproject.toml", "MANIFEST.in")
 
 
 def build_locally(setup_py: str) -> None:
@@ -9,15 +29,142 @@ def build_locally(setup_py: str) -> None:
     subprocess.check_call([sys.executable, setup_py, "bdist_wheel"])
 
 
+def update_hash(sha256, path: str, name: str) -> None:
+    sha256.update(name.encode())
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+
+
+def hash_source_tree(source_dir: str, ignored_dirs: set = IGNORED_DIRS) -> str:
+    """
+    Compute sha256 of all of the source files (paths and contents) in a directory.
+    """
+    sha256 = hashlib.sha256()
+    for root, dirs, files in os.walk(source_dir):
+        dirs[:] = sorted(
+            d for d in dirs if d not in ignored_dirs and not d.endswith(".egg-info")
+        )
+        for file in sorted(files):
+            if file.endswith((".pyc", ".pyo")):
+                continue
+            path = os.path.join(root, file)
+            update_hash(sha256, path, os.path.relpath(path, source_dir))
+    return sha256.hexdigest()
+
+
+def package_source_hash(setup_py: str, ignored_dirs: set = IGNORED_DIRS) -> str:
+    """
+    Compute sha256 of the sources of a single package - the directory of its
+    setup.py and SETUP_INPUT_FILES of the current directory. Packages are expected
+    to keep their sources next to their setup.py, so that a change in one package
+    does not invalidate wheels of the others.
+    """
+    package_dir = os.path.dirname(setup_py) or "."
+    sha256 = hashlib.sha256(hash_source_tree(package_dir, ignored_dirs).encode())
+    for file in SETUP_INPUT_FILES:
+        if os.path.isfile(file):
+            update_hash(sha256, file, file)
+    return sha256.hexdigest()
+
+
+def cached_wheel_dir(
+    setup_py: str, source_hash: str, cache_dir: str = WHEEL_CACHE_DIR
+) -> str:
+    key = hashlib.sha256(f"{source_hash}:{os.path.normpath(setup_py)}".encode())
+    return os.path.join(cache_dir, key.hexdigest())
+
+
+def prune_wheel_cache(used_dirs: set, cache_dir: str = WHEEL_CACHE_DIR) -> None:
+    """
+    Remove cached wheels which have not been used by the current build, so that the
+    cache (persisted between CI runs) does not grow with every change.
+    """
+    used_dirs = {os.path.normpath(used_dir) for used_dir in used_dirs}
+    for entry in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, entry)
+        if os.path.normpath(path) not in used_dirs:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def build_wheel_cached(
+    setup_py: str,
+    source_hash: str,
+    dist_dir: str = "dist",
+    cache_dir: str = WHEEL_CACHE_DIR,
+) -> list:
+    """
+    Build a wheel with `python {setup_py} bdist_wheel` and copy it to dist_dir.
+    The command is run from the current directory, as in the "setup.py" mode (the
+    setup.py files look for their packages and README.md relative to it), but
+    with its own build directories, so that packages can be built concurrently
+    without writing to the source tree.
+    Wheels are cached by source_hash (hash of the package sources, see
+    package_source_hash) and the path of setup_py - if the sources have not
+    changed, the cached wheel is reused instead of building it again.
+    Returns paths of the wheels copied to dist_dir.
+    """
+    cached_dir = cached_wheel_dir(setup_py, source_hash, cache_dir)
+    if os.path.isdir(cached_dir):
+        print(f"{setup_py} has not changed - using wheel from {cached_dir}")
+    else:
+        build_dir = cached_dir + ".partial"
+        shutil.rmtree(build_dir, ignore_errors=True)
+        with tempfile.TemporaryDirectory() as temporary_dir:
+            subprocess.check_call(
+                [
+                    sys.executable, setup_py,
+                    "egg_info", "--egg-base", temporary_dir,
+                    "build", "--build-base", os.path.join(temporary_dir, "build"),
+                    "bdist_wheel", "--bdist-dir", os.path.join(temporary_dir, "bdist"),
+                    "--dist-dir", build_dir,
+                ]
+            )
+        os.replace(build_dir, cached_dir)
+    os.makedirs(dist_dir, exist_ok=True)
+    wheels = []
+    for wheel in sorted(os.listdir(cached_dir)):
+        wheels.append(shutil.copy(os.path.join(cached_dir, wheel), dist_dir))
+    return wheels
+
+
+@traced()
 def process_setup_py(
     setup_py_variable: str,
+    build_mode: str = "parallel",
+    max_workers: Union[int, str] = None,
 ) -> None:
     """
-    Function for installing dependancies during CI step.
-    It processes bash variables that contains paths to requirements file and accordingly
-    to the specified paremater, install given given dependancies (either common.txt or
-    dev.txt).
+    Function for building wheels of all packages during CI step.
+    It processes bash variable that contains paths to setup.py files separated by
+    a comma.
+
+    build_mode:
+    - "parallel" - packages are built concurrently (at most max_workers at a time,
+    by default one per CPU); unchanged packages are taken from the wheel cache
+    (see build_wheel_cached)
+    - "setup.py" - legacy `python setup.py bdist_wheel` run for each package
+    one after another
     """
     setup_py_files = setup_py_variable.split(",")
-    for file in setup_py_files:
-        build_locally(file)
+    if build_mode == "setup.py":
+        for file in setup_py_files:
+            build_locally(file)
+        return
+    if build_mode != "parallel":
+        raise ValueError(f"Invalid build mode {build_mode}. Use parallel or setup.py")
+    max_workers = int(max_workers) if max_workers else os.cpu_count()
+    ignored_dirs = IGNORED_DIRS | {os.path.basename(os.path.normpath(WHEEL_CACHE_DIR))}
+    source_hashes = {}
+
+    def build(file: str) -> list:
+        source_hashes[file] = package_source_hash(file, ignored_dirs)
+        return build_wheel_cached(file, source_hashes[file])
+
+    # the builds are subprocesses, so threads are enough to run them concurrently
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for file, wheels in zip(setup_py_files, executor.map(build, setup_py_files)):
+            print(f"{file}: {wheels}")
+    prune_wheel_cache(
+        {cached_wheel_dir(file, source_hashes[file]) for file in setup_py_files}
+    )
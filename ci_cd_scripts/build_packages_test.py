@@ -0,0 +1,59 @@
+import os
+
+import build_packages
+from build_packages import package_source_hash, process_setup_py
+
+
+def make_packages(tmp_path) -> None:
+    for package in ["package1", "package2"]:
+        (tmp_path / package / package).mkdir(parents=True)
+        (tmp_path / package / "setup.py").write_text("")
+        (tmp_path / package / package / "__init__.py").write_text("")
+    (tmp_path / "README.md").write_text("readme")
+
+
+def test_package_source_hash_changes_only_with_own_sources(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    make_packages(tmp_path)
+    hashes = [package_source_hash(f"package{i}/setup.py") for i in [1, 2]]
+    (tmp_path / "package2" / "package2" / "module.py").write_text("x = 1")
+    (tmp_path / "notebooks").mkdir()
+    (tmp_path / "notebooks" / "nb.py").write_text("")
+    assert package_source_hash("package1/setup.py") == hashes[0]
+    assert package_source_hash("package2/setup.py") != hashes[1]
+    (tmp_path / "README.md").write_text("changed readme")
+    assert package_source_hash("package1/setup.py") != hashes[0]
+
+
+def test_process_setup_py_rebuilds_changed_packages_and_prunes_cache(
+    tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    make_packages(tmp_path)
+    builds = []
+
+    def fake_check_call(command: list) -> None:
+        builds.append(command[1])
+        dist_dir = command[command.index("--dist-dir") + 1]
+        os.makedirs(dist_dir)
+        package = os.path.basename(os.path.dirname(command[1]))
+        with open(os.path.join(dist_dir, f"{package}-0.1-py3-none-any.whl"), "w"):
+            pass
+
+    monkeypatch.setattr(build_packages.subprocess, "check_call", fake_check_call)
+    setup_files = "package1/setup.py,package2/setup.py"
+    process_setup_py(setup_files)
+    (tmp_path / "package2" / "package2" / "module.py").write_text("x = 1")
+    process_setup_py(setup_files)
+    # the first two builds run concurrently
+    assert sorted(builds[:2]) + builds[2:] == [
+        "package1/setup.py",
+        "package2/setup.py",
+        "package2/setup.py",
+    ]
+    # the wheel of the previous package2 sources has been removed from the cache
+    assert len(os.listdir(build_packages.WHEEL_CACHE_DIR)) == 2
+    assert sorted(os.listdir("dist")) == [
+        "package1-0.1-py3-none-any.whl",
+        "package2-0.1-py3-none-any.whl",
+    ]
@@ -1,40 +1,266 @@
 import sys
-from build_packages import process_setup_py
-from copy_files import copy_requirements, copy_files
-from read_config import read_env_cfg, read_flat_cfg
-from discover_and_copy_notebooks import discover_and_copy_notebooks_workflow
-from find_files import find_files_job, find_files_in_nested_dir_job
-from process_requirements_locally import process_requirements
-from create_init_script import create_init_script_workflow
-from databricks_api_workflows_internal import (
-    upload_notebooks_workflow,
-    process_all_packages,
-    upload_init_script_workflow,
-    process_dependencies
-)
-
-
-cli_args = sys.argv[1:]
-allowed_first_cli_args = [
-    "copy_files", "discover_and_copy_notebooks_workflow", "read_env_cfg", "read_flat_cfg",
-    "upload_notebooks_workflow", "find_files_job", "find_files_in_nested_dir_job",
-    "process_all_packages", "process_requirements", "process_setup_py",
-    "upload_init_script_workflow", "create_init_script_workflow",
-    "process_dependencies", "copy_requirements"
-]
-
-if cli_args[0] not in allowed_first_cli_args:
-    raise ValueError("Invalid CLI command. Use one of %s" % allowed_first_cli_args)
-
-if len(cli_args) == 1:
-    evaluation_string = f"{cli_args[0]}()"
-    print(f"evaluation_string: {evaluation_string}")
-    eval(evaluation_string)
-elif len(cli_args) == 2:
-    evaluation_string = f"{cli_args[0]}('{cli_args[1]}')"
-    print(f"evaluation_string: {evaluation_string}")
-    eval(evaluation_string)
-elif len(cli_args) > 2:
-    evaluation_string = f"{cli_args[0]}{*cli_args[1:],}"
-    print(f"evaluation_string: {evaluation_string}")
-    eval(evaluation_string)
+import asyncio
+import argparse
+import inspect
+import importlib
+from collections import namedtuple
+
+
+# an argument without a default is a required positional argument; optional
+# positional arguments fall back to the defaults of the called function; bool
+# arguments are flags which toggle their default value
+Argument = namedtuple("Argument", ["name", "type", "default"], defaults=[str, ...])
+OPTIONAL = None
+
+# allowed commands: name -> (module, arguments); modules are imported only when
+# their command is run
+COMMANDS = {
+    "copy_files": (
+        "copy_files",
+        [Argument("artifact_dir"), Argument("files_variable")],
+    ),
+    "copy_requirements": (
+        "copy_files",
+        [
+            Argument("artifact_dir"),
+            Argument("requirements_variable"),
+            Argument("requirements_type", default=OPTIONAL),
+            Argument("resolve", bool, default=False),
+        ],
+    ),
+    "discover_and_copy_notebooks_workflow": (
+        "discover_and_copy_notebooks",
+        [
+            Argument("working_dir"),
+            Argument("subdir"),
+            Argument("target_dir"),
+            Argument("pattern", default=OPTIONAL),
+        ],
+    ),
+    "read_env_cfg": (
+        "read_config",
+        [
+            Argument("env"),
+            Argument("cfg_file"),
+            Argument("output_file", default=OPTIONAL),
+            Argument("export_to_task_variables", bool, default=True),
+        ],
+    ),
+    "read_flat_cfg": (
+        "read_config",
+        [
+            Argument("cfg_file"),
+            Argument("export_to_task_variables", bool, default=True),
+        ],
+    ),
+    "find_files_job": (
+        "find_files",
+        [
+            Argument("working_dir"),
+            Argument("pattern"),
+            Argument("variable_name_prefix", default=OPTIONAL),
+            Argument("variable_name_suffix", default=OPTIONAL),
+        ],
+    ),
+    "find_files_in_nested_dir_job": (
+        "find_files",
+        [
+            Argument("working_dir"),
+            Argument("nested_dir_depth", int),
+            Argument("nested_dir"),
+            Argument("extension", default=OPTIONAL),
+            Argument("filename", default=OPTIONAL),
+            Argument("variable_name_suffix", default=OPTIONAL),
+        ],
+    ),
+    "process_requirements": (
+        "process_requirements_locally",
+        [
+            Argument("requirements_variable"),
+            Argument("requirements_type", default=OPTIONAL),
+        ],
+    ),
+    "build_wheelhouse": (
+        "process_requirements_locally",
+        [
+            Argument("requirements_variable"),
+            Argument("wheelhouse_dir"),
+            Argument("requirements_type", default=OPTIONAL),
+            Argument("python_version", default=OPTIONAL),
+            Argument("platform", default=OPTIONAL),
+        ],
+    ),
+    "process_setup_py": (
+        "build_packages",
+        [
+            Argument("setup_py_variable"),
+            Argument("build_mode", default=OPTIONAL),
+            Argument("max_workers", int, default=OPTIONAL),
+        ],
+    ),
+    "create_init_script_workflow": (
+        "create_init_script",
+        [
+            Argument("working_dir"),
+            Argument("init_script_local_path"),
+            Argument("package_dbfs_dir"),
+            Argument("whl_files_variable"),
+            Argument("requirements_variable"),
+            Argument("wheelhouse_dbfs_dir", default=OPTIONAL),
+        ],
+    ),
+    "upload_notebooks_workflow": (
+        "databricks_api_workflows_internal",
+        [
+            Argument("cfg_path"),
+            Argument("secret_path"),
+            Argument("notebooks_artifact_path"),
+            Argument("notebooks_target_dir", default=OPTIONAL),
+            Argument("max_parallel_imports", int, default=OPTIONAL),
+            Argument("force", bool, default=False),
+            Argument("import_mode", default=OPTIONAL),
+            Argument("replace_directories", bool, default=False),
+        ],
+    ),
+    "stage_artifacts_workflow": (
+        "databricks_api_workflows_internal",
+        [
+            Argument("cfg_path"),
+            Argument("secret_path"),
+            Argument("whl_files", default=OPTIONAL),
+            Argument("init_script_local_path", default=OPTIONAL),
+            Argument("wheelhouse_dir", default=OPTIONAL),
+            Argument("dbfs_target_dir", default=OPTIONAL),
+            Argument("init_script_dbfs_path", default=OPTIONAL),
+            Argument("wheelhouse_dbfs_dir", default=OPTIONAL),
+            Argument("force", bool, default=False),
+        ],
+    ),
+    "process_all_packages": (
+        "databricks_api_workflows_internal",
+        [
+            Argument("cfg_path"),
+            Argument("secret_path"),
+            Argument("whl_files"),
+            Argument("dbfs_target_dir", default=OPTIONAL),
+            Argument("max_parallel_clusters", int, default=OPTIONAL),
+            Argument("force", bool, default=False),
+        ],
+    ),
+    "upload_init_script_workflow": (
+        "databricks_api_workflows_internal",
+        [
+            Argument("cfg_path"),
+            Argument("secret_path"),
+            Argument("init_script_local_path"),
+            Argument("init_script_dbfs_path", default=OPTIONAL),
+            Argument("force", bool, default=False),
+        ],
+    ),
+    "process_dependencies": (
+        "databricks_api_workflows_internal",
+        [
+            Argument("cfg_path"),
+            Argument("secret_path"),
+            Argument("requirements_variable"),
+            Argument("wheelhouse_dir", default=OPTIONAL),
+            Argument("wheelhouse_dbfs_dir", default=OPTIONAL),
+        ],
+    ),
+    # asyncio versions of the workflows above - they require httpx
+    "upload_notebooks_workflow_async": (
+        "databricks_api_async",
+        [
+            Argument("cfg_path"),
+            Argument("secret_path"),
+            Argument("notebooks_artifact_path"),
+            Argument("notebooks_target_dir", default=OPTIONAL),
+            Argument("max_parallel_imports", int, default=OPTIONAL),
+            Argument("force", bool, default=False),
+            Argument("import_mode", default=OPTIONAL),
+            Argument("replace_directories", bool, default=False),
+        ],
+    ),
+    "process_all_packages_async": (
+        "databricks_api_async",
+        [
+            Argument("cfg_path"),
+            Argument("secret_path"),
+            Argument("whl_files"),
+            Argument("dbfs_target_dir", default=OPTIONAL),
+            Argument("max_parallel_clusters", int, default=OPTIONAL),
+            Argument("force", bool, default=False),
+        ],
+    ),
+    "process_dependencies_async": (
+        "databricks_api_async",
+        [
+            Argument("cfg_path"),
+            Argument("secret_path"),
+            Argument("requirements_variable"),
+            Argument("wheelhouse_dir", default=OPTIONAL),
+            Argument("wheelhouse_dbfs_dir", default=OPTIONAL),
+        ],
+    ),
+    "run_plan": (
+        "run_plan",
+        [Argument("plan_file"), Argument("max_parallel_steps", int, default=OPTIONAL)],
+    ),
+}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Build argument parser with a subparser for each of the allowed commands.
+    """
+    parser = argparse.ArgumentParser(description="Databricks CI/CD scripts")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command, (_, arguments) in COMMANDS.items():
+        subparser = subparsers.add_parser(command)
+        for argument in arguments:
+            if argument.type is bool:
+                flag = argument.name.replace("_", "-")
+                subparser.add_argument(
+                    f"--no-{flag}" if argument.default else f"--{flag}",
+                    dest=argument.name,
+                    action="store_false" if argument.default else "store_true",
+                )
+            elif argument.default is ...:
+                subparser.add_argument(argument.name, type=argument.type)
+            else:
+                subparser.add_argument(
+                    argument.name, type=argument.type, nargs="?", default=OPTIONAL
+                )
+    return parser
+
+
+def get_command_function(command: str):
+    """
+    Import the module of a given command and return the function to be called.
+    """
+    module_name, _ = COMMANDS[command]
+    return getattr(importlib.import_module(module_name), command)
+
+
+def call_command_function(function, *args, **kwargs):
+    """
+    Call a command function; coroutine functions are run in a new event loop.
+    """
+    if inspect.iscoroutinefunction(function):
+        return asyncio.run(function(*args, **kwargs))
+    return function(*args, **kwargs)
+
+
+def main(cli_args: list = None):
+    """
+    Parse CLI arguments and run the requested command.
+    """
+    arguments = vars(build_parser().parse_args(cli_args))
+    command = arguments.pop("command")
+    kwargs = {k: v for k, v in arguments.items() if v is not OPTIONAL}
+    print(f"command: {command}; arguments: {kwargs}")
+    return call_command_function(get_command_function(command), **kwargs)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
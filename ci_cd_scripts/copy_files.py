@@ -1,42 +1,33 @@
-from shutil import copy
+from artifact_staging import stage_files
+from requirements_lock import select_requirements_files, write_lock_file
 
 
 def copy_files(artifact_dir: str, files_variable: str) -> None:
     """
-    Copy all of the files provided in files_variable to the specified directory.
+    Copy all of the files provided in files_variable to the specified directory
+    (see artifact_staging.stage_files - files are linked where possible and
+    unchanged files are skipped).
     """
     files = files_variable.split(",")
-    for file in files:
-        target_path = artifact_dir + file.split("/")[-1]
-        copy(file, target_path)
-        # TODO: REMOVE - it's just for debugging purposes
-        print(f"file: {file}\ntarget: {target_path}")
-        with open(file, 'rb') as f:
-            print(f"Target path content:\n{f.read()}")
-        with open(target_path, 'rb') as f:
-            print(f"Target path content:\n{f.read()}")
-
-
+    stage_files([(file, artifact_dir + file.split("/")[-1]) for file in files])
 
 
 def copy_requirements(
-    artifact_dir: str, requirements_variable: str, requirements_type: str = "common"
+    artifact_dir: str,
+    requirements_variable: str,
+    requirements_type: str = "common",
+    resolve: bool = False,
 ) -> None:
     """
     Collect all requirement files with a specified requirement type.
-    Write a new file (requirements.txt) containing all of the requirements from the
-    collected files in artifact_dir.
+    Write a lock file (requirements.txt) in artifact_dir, containing all of the
+    requirements from the collected files merged and de-duplicated (see
+    requirements_lock.RequirementsLock). If resolve is True, the requirements are
+    pinned to exact versions.
     """
-    requirements = requirements_variable.split(",")
-    requirements_files = []
-    for req_file in requirements:
-        if req_file.split("/")[-1].split(".")[-2] == requirements_type:
-            requirements_files.append(req_file)
+    requirements_files = select_requirements_files(
+        requirements_variable.split(","), requirements_type
+    )
     if artifact_dir[-1] != "/":
         artifact_dir += "/"
-    artifact_requirement_file_content = ""
-    for req_file in requirements_files:
-        with open(req_file, "r") as f:
-            artifact_requirement_file_content += f.read()
-    with open(f"{artifact_dir}requirements.txt", "w") as file_to_write:
-        file_to_write.write(artifact_requirement_file_content)
+    write_lock_file(requirements_files, f"{artifact_dir}requirements.txt", resolve)
@@ -1,4 +1,12 @@
 import os
+import shlex
+
+from requirements_lock import (
+    lock_requirements,
+    pip_install_arguments,
+    select_requirements_files,
+    wheelhouse_requirements,
+)
 
 
 def build_script_content(
@@ -15,17 +23,58 @@ def build_script_content(
     package_dbfs_dir = package_dbfs_dir.replace(":", "")
     init_script_content = f"#!/bin/bash\n" f"pip install --upgrade pip\n"
     if requirements_files is not None:
-        for file in requirements_files:
-            with open(file, "r") as f:
-                for line in f.readlines():
-                    init_script_content += f"pip install {line}"
-            init_script_content += "\n"
+        # requirements from all of the files are installed with a single resolver run
+        lock = lock_requirements(requirements_files)
+        if lock.requirements:
+            init_script_content += f"pip install {pip_install_arguments(lock)}\n"
     for arg in args:
         arg = arg.split("/")[-1]
         init_script_content += f"pip install {package_dbfs_dir}/{arg}\n"
     return init_script_content
 
 
+def dbfs_fuse_path(dbfs_path: str) -> str:
+    """
+    Convert a DBFS path (dbfs:/dir or /dbfs/dir) to the path under which it is
+    mounted on cluster nodes (/dbfs/dir).
+    """
+    if dbfs_path.startswith("dbfs:"):
+        dbfs_path = dbfs_path[len("dbfs:"):]
+    elif dbfs_path.startswith("/dbfs/"):
+        dbfs_path = dbfs_path[len("/dbfs"):]
+    return f"/dbfs/{dbfs_path.strip('/')}"
+
+
+def build_wheelhouse_script_content(
+    package_dbfs_dir: str, wheelhouse_dbfs_dir: str, requirements_files: tuple, *args
+) -> str:
+    """
+    Create init script content for Databricks, which installs all of the
+    requirements and the whl files with a single pip invocation that only uses
+    wheels from the wheelhouse uploaded to DBFS by CI (no index lookups, no
+    downloads and a single resolver run on each node).
+
+    *args - whl files
+    """
+    # the wheelhouse is content-addressed, pip finds the wheels through its index
+    wheelhouse = f"{dbfs_fuse_path(wheelhouse_dbfs_dir)}/index.html"
+    package_dir = dbfs_fuse_path(package_dbfs_dir)
+    requirements = []
+    if requirements_files is not None:
+        # index options are not used - everything is installed from the wheelhouse
+        requirements = wheelhouse_requirements(lock_requirements(requirements_files))
+    packages = [shlex.quote(requirement) for requirement in requirements]
+    packages += [f"{package_dir}/{arg.split('/')[-1]}" for arg in args]
+    if not packages:
+        return "#!/bin/bash\n"
+    return (
+        f"#!/bin/bash\n"
+        f"set -e\n"
+        f"pip install --no-index --find-links {wheelhouse} --find-links {package_dir} "
+        f"{' '.join(packages)}\n"
+    )
+
+
 def write_init_script_to_file(content: str, file_path: str) -> None:
     """
     Function for writing init script content to a file.
@@ -41,9 +90,12 @@ def create_init_script_workflow(
     package_dbfs_dir: str,
     whl_files_variable: str,
     requirements_variable: str,
+    wheelhouse_dbfs_dir: str = None,
 ):
     """
-    Workflow for creating init scripts
+    Workflow for creating init scripts. If wheelhouse_dbfs_dir is given, the init
+    script installs everything from the wheelhouse in a single pip invocation
+    (see build_wheelhouse_script_content).
 
     :param working_dir: working directory,
     :type working_dir: str
@@ -55,20 +107,26 @@ def create_init_script_workflow(
     :type whl_files_variable: str
     :param requirements_variable: env variable with requirements,
     :type requirements_variable: str
+    :param wheelhouse_dbfs_dir: DBFS wheelhouse with wheels of all requirements
+        (see databricks_api_workflows_internal.upload_wheelhouse),
+    :type wheelhouse_dbfs_dir: str
     """
     os.chdir(str(working_dir))
     whl_files = whl_files_variable.split(",")
     requirements = requirements_variable.split(",")
 
-    requirements_files = []
-    for req_file in requirements:
-        # init script is always for worklads, so it will never use dev.txt requirements
-        if req_file.split("/")[-1] == "common.txt":
-            requirements_files.append(req_file)
+    # init script is always for worklads, so it will never use dev.txt requirements
+    requirements_files = tuple(select_requirements_files(requirements, "common"))
 
-    requirements_files = tuple(requirements_files)
-
-    init_script = build_script_content(
-        str(package_dbfs_dir), requirements_files, *whl_files
-    )
+    if wheelhouse_dbfs_dir:
+        init_script = build_wheelhouse_script_content(
+            str(package_dbfs_dir),
+            str(wheelhouse_dbfs_dir),
+            requirements_files,
+            *whl_files,
+        )
+    else:
+        init_script = build_script_content(
+            str(package_dbfs_dir), requirements_files, *whl_files
+        )
     write_init_script_to_file(init_script, str(init_script_local_path))
@@ -0,0 +1,291 @@
+import json
+import asyncio
+from typing import Union
+
+try:
+    import httpx
+except ImportError:  # optional dependency - needed only by the async workflows
+    httpx = None
+
+from databricks_api_class_internal import (
+    BUILD_REPOSITORY_NAME,
+    HTTP_POOL_SIZE,
+    StreamingImportBody,
+)
+from databricks_api_workflows_internal import (
+    DEFAULT_WHEELHOUSE_DBFS_DIR,
+    ENVIRONMENT_NAME,
+    DatabricksRequest,
+    get_dependencies,
+    get_manifest,
+    get_wheel_dbfs_paths,
+    parse_force_flag,
+    process_all_packages_steps,
+    process_dependencies_steps,
+    read_env_cfg,
+    read_token_from_file,
+    upload_notebooks_steps,
+)
+from request_executor import (
+    CONNECT_TIMEOUT,
+    READ_TIMEOUT,
+    RequestExecutor,
+    error_from_response,
+    get_rate_limiter,
+)
+from step_runner import run_steps_async
+from tracing import get_logger, traced
+
+logger = get_logger(__name__)
+
+
+def require_httpx() -> None:
+    """
+    Fail with a clear message if httpx (optional dependency) is not installed.
+    """
+    if httpx is None:
+        raise ImportError(
+            "The async workflows require httpx - install it with `pip install httpx`"
+        )
+
+
+def create_async_client(pool_size: int = HTTP_POOL_SIZE) -> "httpx.AsyncClient":
+    """
+    Create an async HTTP client (httpx, optional dependency) with a keep-alive
+    connection pool of a given size.
+    """
+    require_httpx()
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=pool_size, max_keepalive_connections=pool_size
+        ),
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+        headers={"Accept-Encoding": "gzip, deflate"},
+    )
+
+
+def request_content(request: "httpx.Request"):
+    """
+    Body of a sent request - bytes, or the stream for streamed bodies (e.g.
+    multipart uploads), as body_size expects.
+    """
+    try:
+        return request.content
+    except httpx.RequestNotRead:
+        return request.stream
+
+
+class AsyncStreamingBody:
+    """
+    Async iterable over the chunks of a StreamingImportBody - httpx.AsyncClient
+    accepts only async streams. It can be iterated again when a request is retried.
+    """
+
+    def __init__(self, body: StreamingImportBody) -> None:
+        self.body = body
+
+    async def __aiter__(self):
+        for chunk in self.body:
+            yield chunk
+
+
+class AsyncRequestExecutor(RequestExecutor):
+    """
+    asyncio counterpart of request_executor.RequestExecutor - the retry policies
+    (request_steps) and the rate limiting are the same, the token bucket is shared
+    with the synchronous requests sent to the workspace. Only sending of the
+    requests (with an httpx.AsyncClient as the session) differs.
+    """
+
+    connection_errors = (httpx.HTTPError,) if httpx is not None else ()
+
+    async def send(self, method: str, url: str, **kwargs) -> "httpx.Response":
+        return await self.session.request(method, url, **kwargs)
+
+    def was_not_sent(self, error: Exception) -> bool:
+        return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+
+    def request_body(self, response: "httpx.Response"):
+        return request_content(response.request)
+
+    async def request(
+        self, method: str, url: str, endpoint: str, **kwargs
+    ) -> "httpx.Response":
+        return await run_steps_async(
+            self.request_steps(method, url, endpoint, **kwargs)
+        )
+
+
+class AsyncDatabricksRequest(DatabricksRequest):
+    """
+    asyncio counterpart of DatabricksRequest with the same surface - all of the
+    methods return coroutines, so one event loop can keep many requests in flight.
+    The methods are inherited, only the requests are sent with httpx and the steps
+    of the methods are run with run_steps_async.
+    All of the objects of one event loop should share one client (see
+    create_async_client).
+    """
+
+    def __init__(
+        self,
+        host: str,
+        cluster_id: Union[str, None],
+        databricks_token: str,
+        client: "httpx.AsyncClient",
+    ) -> None:
+        self.host = host
+        if self.host[-1] != "/":
+            self.host = self.host + "/"
+        self.url = self.host + "api/2.0/"
+        self.headers = {"Authorization": f"Bearer {databricks_token}"}
+        self.payload = {"cluster_id": cluster_id}
+        self.package = BUILD_REPOSITORY_NAME
+        self.client = client
+        self.executor = AsyncRequestExecutor(client, get_rate_limiter(self.host))
+
+    async def run_steps(self, steps):
+        return await run_steps_async(steps)
+
+    async def request(
+        self, method: str, endpoint: str, api_version: str = "2.0", **kwargs
+    ) -> "httpx.Response":
+        headers = {**self.headers, **kwargs.pop("headers", {})}
+        # httpx does not accept a body for GET in request(json=...) - it is
+        # serialized explicitly (the API 2.0 GET endpoints read JSON bodies)
+        if "json" in kwargs:
+            kwargs["content"] = json.dumps(kwargs.pop("json")).encode()
+            headers["Content-Type"] = "application/json"
+        if isinstance(kwargs.get("data"), StreamingImportBody):
+            headers["Content-Length"] = str(len(kwargs["data"]))
+            kwargs["content"] = AsyncStreamingBody(kwargs.pop("data"))
+        url = self.host + f"api/{api_version}/" + endpoint
+        return await self.executor.request(
+            method, url, endpoint, headers=headers, **kwargs
+        )
+
+    async def request_json(self, method: str, endpoint: str, **kwargs) -> dict:
+        response = await self.request(method, endpoint, **kwargs)
+        if response.status_code != 200:
+            raise error_from_response(endpoint, response)
+        return json.loads(response.text)
+
+
+@traced()
+async def upload_notebooks_workflow_async(
+    cfg_path: str,
+    secret_path: str,
+    notebooks_artifact_path: str,
+    notebooks_target_dir: str = "/deployed/notebooks/",
+    max_parallel_imports: Union[int, str] = 32,
+    force: Union[bool, str] = False,
+    import_mode: str = "files",
+    replace_directories: Union[bool, str] = False,
+):
+    """
+    asyncio version of upload_notebooks_workflow - directories are created and
+    notebooks imported concurrently (at most max_parallel_imports imports in
+    flight) from a single thread.
+    """
+    require_httpx()
+    databricks_token = read_token_from_file(secret_path)
+    cfg = read_env_cfg(ENVIRONMENT_NAME, cfg_path)
+    manifest = await asyncio.to_thread(
+        get_manifest,
+        DatabricksRequest(cfg.get("databricks_host"), None, databricks_token),
+        cfg.get("deploy_manifest_path"),
+    )
+    async with create_async_client() as client:
+        api_object = AsyncDatabricksRequest(
+            cfg.get("databricks_host"), None, databricks_token, client
+        )
+        await run_steps_async(
+            upload_notebooks_steps(
+                api_object,
+                manifest,
+                notebooks_artifact_path,
+                notebooks_target_dir,
+                max_parallel_imports,
+                force,
+                import_mode,
+                replace_directories,
+            )
+        )
+
+
+@traced()
+async def process_all_packages_async(
+    cfg_path: str,
+    secret_path: str,
+    whl_files: str,
+    dbfs_target_dir: str = "dbfs:/FileStore/jars/",
+    max_parallel_clusters: Union[int, str] = 16,
+    force: Union[bool, str] = False,
+) -> dict:
+    """
+    asyncio version of process_all_packages - the wheels are staged on DBFS
+    concurrently and then deployed to each of the clusters concurrently.
+    """
+    require_httpx()
+    databricks_token = read_token_from_file(secret_path)
+    cfg = read_env_cfg(ENVIRONMENT_NAME, cfg_path)
+    manifest = await asyncio.to_thread(
+        get_manifest,
+        DatabricksRequest(cfg.get("databricks_host"), None, databricks_token),
+        cfg.get("deploy_manifest_path"),
+    )
+    async with create_async_client() as client:
+        api_object = AsyncDatabricksRequest(
+            cfg.get("databricks_host"), None, databricks_token, client
+        )
+        cluster_api_objects = [
+            AsyncDatabricksRequest(
+                cfg.get("databricks_host"), cluster, databricks_token, client
+            )
+            for cluster in cfg.get("databricks_cluster_id")
+        ]
+        return await run_steps_async(
+            process_all_packages_steps(
+                api_object,
+                cluster_api_objects,
+                get_wheel_dbfs_paths(whl_files.split(","), dbfs_target_dir),
+                manifest,
+                parse_force_flag(force),
+                int(max_parallel_clusters),
+            )
+        )
+
+
+@traced()
+async def process_dependencies_async(
+    cfg_path: str,
+    secret_path: str,
+    requirements_variable: str,
+    wheelhouse_dir: str = None,
+    wheelhouse_dbfs_dir: str = DEFAULT_WHEELHOUSE_DBFS_DIR,
+):
+    """
+    asyncio version of process_dependencies - clusters are started (or restarted),
+    awaited and polled for library statuses concurrently.
+    """
+    require_httpx()
+    databricks_token = read_token_from_file(secret_path)
+    cfg = read_env_cfg(ENVIRONMENT_NAME, cfg_path)
+    libraries_to_install, wheelhouse_updated_at = await asyncio.to_thread(
+        get_dependencies,
+        DatabricksRequest(cfg.get("databricks_host"), None, databricks_token),
+        requirements_variable,
+        wheelhouse_dir,
+        wheelhouse_dbfs_dir,
+    )
+    async with create_async_client() as client:
+        api_objects = [
+            AsyncDatabricksRequest(
+                cfg.get("databricks_host"), cluster, databricks_token, client
+            )
+            for cluster in cfg.get("databricks_cluster_id")
+        ]
+        await run_steps_async(
+            process_dependencies_steps(
+                api_objects, libraries_to_install, wheelhouse_updated_at
+            )
+        )
@@ -2,12 +2,174 @@ import requests
 import os
 import json
 import base64
+import time
+import random
+import atexit
+import threading
+import uuid
 from typing import Union
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 
+from request_executor import (
+    DatabricksAPIError,
+    RequestExecutor,
+    ResourceNotFoundError,
+    error_from_response,
+    get_rate_limiter,
+)
+from step_runner import BlockingCall, Call, Gather, Sleep, run_steps
+from tracing import get_logger, traced
+
+
+logger = get_logger(__name__)
 
 ENVIRONMENT_NAME = os.environ.get("ENVIRONMENT_NAME")
-print(f"Environment name: {ENVIRONMENT_NAME}")
+logger.debug(f"Environment name: {ENVIRONMENT_NAME}")
 BUILD_REPOSITORY_NAME = os.environ.get("BUILD_REPOSITORY_NAME")
+# size of the keep-alive connection pool shared by all DatabricksRequest objects;
+# it should not be lower than the number of threads talking to one workspace
+HTTP_POOL_SIZE = int(os.environ.get("DATABRICKS_HTTP_POOL_SIZE", 32))
+# files bigger than this are uploaded to DBFS in blocks instead of a single dbfs/put
+DBFS_STREAMING_THRESHOLD = int(
+    os.environ.get("DBFS_STREAMING_THRESHOLD", 10 * 1024 * 1024)
+)
+# dbfs/add-block accepts at most 1 MB of (not encoded) data
+DBFS_BLOCK_SIZE = 1024 * 1024
+# maximum time (in seconds) of waiting for a cluster to reach a given state
+CLUSTER_WAIT_TIMEOUT = int(os.environ.get("CLUSTER_WAIT_TIMEOUT", 1800))
+# maximum time (in seconds) of waiting for libraries to be installed on clusters
+LIBRARY_WAIT_TIMEOUT = int(os.environ.get("LIBRARY_WAIT_TIMEOUT", 1800))
+LIBRARY_FINAL_STATUSES = ["INSTALLED", "FAILED", "SKIPPED"]
+# notebooks are base64-encoded into workspace/import bodies in chunks of this size
+# (a multiple of 3, so that the encoded chunks can be concatenated)
+IMPORT_CHUNK_SIZE = 3 * 64 * 1024
+
+_connection_stats = {"requests": 0, "new_connections": 0}
+_connection_stats_lock = threading.Lock()
+_shared_session = None
+_shared_session_lock = threading.Lock()
+
+
+def _count(key: str) -> None:
+    with _connection_stats_lock:
+        _connection_stats[key] += 1
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _count("new_connections")
+        return super()._new_conn()
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _count("new_connections")
+        return super()._new_conn()
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter keeping track of the number of sent requests and of the number of
+    opened connections (TCP+TLS handshakes).
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        _count("requests")
+        response = super().send(request, **kwargs)
+        logger.debug(f"{request.method} {request.url}: {response.status_code}")
+        return response
+
+
+def create_session(pool_size: int = HTTP_POOL_SIZE) -> requests.Session:
+    """
+    Create a requests.Session with a keep-alive connection pool of a given size.
+    Responses are requested in a compressed form.
+    """
+    session = requests.Session()
+    adapter = CountingHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(
+        {"Connection": "keep-alive", "Accept-Encoding": "gzip, deflate"}
+    )
+    return session
+
+
+def get_shared_session() -> requests.Session:
+    """
+    Return the session shared by all of the workflows run in the current process.
+    It is created on the first call; connection reuse stats are printed at exit.
+    """
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            _shared_session = create_session()
+            atexit.register(print_connection_stats)
+    return _shared_session
+
+
+def get_connection_stats() -> dict:
+    """
+    Return the number of sent requests, opened connections and the number of
+    handshakes saved thanks to connection reuse.
+    """
+    with _connection_stats_lock:
+        stats = dict(_connection_stats)
+    stats["reused_connections"] = max(0, stats["requests"] - stats["new_connections"])
+    return stats
+
+
+def print_connection_stats() -> None:
+    stats = get_connection_stats()
+    print(
+        f"HTTP connections: {stats['requests']} requests sent over "
+        f"{stats['new_connections']} connections "
+        f"({stats['reused_connections']} handshakes saved)"
+    )
+
+class ClusterStateError(RuntimeError):
+    """
+    Raised when a cluster ends up in a state from which the awaited state will not
+    be reached (e.g. it was terminated while starting).
+    """
+
+
+class StreamingImportBody:
+    """
+    JSON body of workspace/import with the content of a file base64-encoded on the
+    fly - only one chunk of the file (IMPORT_CHUNK_SIZE) is in memory at a time,
+    regardless of the size of the file. Its length is known up front, so it is
+    sent with Content-Length (not chunked), and it can be iterated again when the
+    request is retried.
+    """
+
+    def __init__(
+        self, file_path: str, chunk_size: int = IMPORT_CHUNK_SIZE, **fields
+    ) -> None:
+        self.file_path = str(file_path)
+        self.chunk_size = max(3, chunk_size - chunk_size % 3)
+        self.prefix = (json.dumps(fields)[:-1] + ', "content": "').encode()
+        self.suffix = b'"}'
+        self.content_length = 4 * -(-os.path.getsize(self.file_path) // 3)
+
+    def __len__(self) -> int:
+        return len(self.prefix) + self.content_length + len(self.suffix)
+
+    def __iter__(self):
+        yield self.prefix
+        with open(self.file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                yield base64.b64encode(chunk)
+        yield self.suffix
+
 
 class DatabricksRequest:
     """
@@ -19,10 +181,19 @@ class DatabricksRequest:
     Processing of packages is separated into a separate function (process_package),
     that is outside the scope of this class.
     It mainly focuses on interaction with clusters API.
+    Errors returned by the API are raised as typed errors (see
+    request_executor.DatabricksAPIError).
+    Methods which need more than a single request are written as steps (see
+    step_runner) and run with self.run_steps, so that they are shared with
+    databricks_api_async.AsyncDatabricksRequest.
     """
 
     def __init__(
-        self, host: str, cluster_id: Union[str, None], databricks_token: str
+        self,
+        host: str,
+        cluster_id: Union[str, None],
+        databricks_token: str,
+        session: requests.Session = None,
     ) -> None:
         self.host = host
         if self.host[-1] != "/":
@@ -31,18 +202,41 @@ class DatabricksRequest:
         self.headers = {"Authorization": f"Bearer {databricks_token}"}
         self.payload = {"cluster_id": cluster_id}
         self.package = BUILD_REPOSITORY_NAME
+        self.session = session if session is not None else get_shared_session()
+        self.executor = RequestExecutor(self.session, get_rate_limiter(self.host))
+
+    def run_steps(self, steps):
+        """
+        Run the steps of a method (see step_runner) and return its result.
+        """
+        return run_steps(steps)
+
+    def request(
+        self, method: str, endpoint: str, api_version: str = "2.0", **kwargs
+    ) -> requests.Response:
+        """
+        Send a request to an API endpoint (e.g. clusters/get) through the request
+        executor (rate limiting and retries, see RequestExecutor).
+        """
+        headers = {**self.headers, **kwargs.pop("headers", {})}
+        url = self.host + f"api/{api_version}/" + endpoint
+        return self.executor.request(method, url, endpoint, headers=headers, **kwargs)
+
+    def request_json(self, method: str, endpoint: str, **kwargs) -> dict:
+        """
+        Send a request and return its parsed JSON response. A typed
+        DatabricksAPIError is raised if the API returns an error.
+        """
+        response = self.request(method, endpoint, **kwargs)
+        if response.status_code != 200:
+            raise error_from_response(endpoint, response)
+        return json.loads(response.text)
 
     def get_cluster_details(self) -> dict:
         """
         Check the cluster details.
         """
-        url = self.url + "clusters/get"
-        response = requests.get(url, headers=self.headers, json=self.payload)
-        if response.status_code != 200:
-            print(response.text)
-            return response.text
-        else:
-            return json.loads(response.text)
+        return self.request_json("GET", "clusters/get", json=self.payload)
 
     def check_current_cluster_status(self, cluster_details):
         """
@@ -53,29 +247,148 @@ class DatabricksRequest:
         """
         return cluster_details.get("state")
 
-    def start_cluster(self) -> str:
+    def start_cluster(self) -> dict:
         """
         Start the cluster.
         """
-        url = self.url + "clusters/start"
-        response = requests.post(url, headers=self.headers, json=self.payload)
-        return response.text
+        return self.request_json("POST", "clusters/start", json=self.payload)
 
-    def restart_cluster(self) -> str:
+    def restart_cluster(self) -> dict:
         """
         Restart the cluster
         """
-        url = self.url + "clusters/restart"
-        response = requests.post(url, headers=self.headers, json=self.payload)
-        return response.text
+        return self.request_json("POST", "clusters/restart", json=self.payload)
+
+    def get_cluster_events(
+        self, start_time: int = None, event_types: list = None, limit: int = 50
+    ) -> dict:
+        """
+        Get the latest events of the cluster (newest first).
+        start_time is an epoch timestamp in milliseconds.
+        """
+        payload = {"cluster_id": self.payload["cluster_id"], "order": "DESC"}
+        payload["limit"] = limit
+        if start_time is not None:
+            payload["start_time"] = start_time
+        if event_types is not None:
+            payload["event_types"] = event_types
+        return self.request_json("POST", "clusters/events", json=payload)
+
+    def get_events_baseline(self) -> int:
+        """
+        Return the start_time (epoch timestamp in ms, in the clock of the server)
+        from which cluster events logged after this call are listed - it has to be
+        taken before an action (start/restart) awaited with wait_for_cluster_state.
+        The clock of the agent cannot be used, as it may be ahead of the server.
+        """
+        return self.run_steps(self.get_events_baseline_steps())
+
+    def get_events_baseline_steps(self):
+        response = yield Call(self.get_cluster_events, limit=1)
+        events = response.get("events") or [{"timestamp": -1}]
+        return events[0]["timestamp"] + 1
+
+    def wait_for_cluster_state(self, target_state: str = "RUNNING", **kwargs) -> str:
+        """
+        Wait until the cluster reaches target_state and return it (see
+        wait_for_cluster_state_steps for the arguments).
+        """
+        return self.run_steps(
+            self.wait_for_cluster_state_steps(target_state, **kwargs)
+        )
+
+    @traced(
+        name="wait_for_cluster_state",
+        cluster=lambda arguments: arguments["self"].payload["cluster_id"],
+    )
+    def wait_for_cluster_state_steps(
+        self,
+        target_state: str = "RUNNING",
+        timeout: float = CLUSTER_WAIT_TIMEOUT,
+        since: int = None,
+        after_event: str = None,
+        initial_interval: float = 2.0,
+        max_interval: float = 30.0,
+        backoff: float = 1.5,
+        jitter: float = 0.2,
+    ):
+        """
+        Steps of waiting until the cluster reaches target_state.
+        Polling interval grows exponentially (with jitter) from initial_interval up
+        to max_interval and is reset whenever the cluster changes its state.
+
+        since - baseline of the events (see get_events_baseline) taken before the
+        action (start/restart) that is awaited; if the cluster is TERMINATED and
+        clusters/events shows it has been terminating after that moment (or the
+        cluster is in ERROR state), ClusterStateError is raised straight away.
+        Without since no action is awaited, so ClusterStateError is raised as soon
+        as the cluster is TERMINATING, TERMINATED or in ERROR state.
+        TimeoutError is raised when the state is not reached within timeout seconds.
+        after_event - event type (e.g. RESTARTING) that must have been logged since
+        the awaited action before target_state is accepted; it prevents returning
+        too early when the cluster still reports its state from before the action.
+        """
+        cluster_id = self.payload["cluster_id"]
+        if after_event is not None and since is None:
+            raise ValueError("after_event requires since (see get_events_baseline)")
+        deadline = time.monotonic() + timeout
+        interval = initial_interval
+        previous_state = None
+        while True:
+            cluster_details = yield Call(self.get_cluster_details)
+            state = self.check_current_cluster_status(cluster_details)
+            if state == target_state:
+                if after_event is None:
+                    return state
+                events = yield Call(
+                    self.get_cluster_events,
+                    start_time=since,
+                    event_types=[after_event],
+                    limit=1,
+                )
+                if events.get("events"):
+                    return state
+            if since is None and state in ["TERMINATING", "TERMINATED", "ERROR"]:
+                raise ClusterStateError(
+                    f"Cluster {cluster_id} is {state} while waiting for "
+                    f"{target_state}: {cluster_details}"
+                )
+            if state in ["TERMINATED", "ERROR"]:
+                events = yield Call(
+                    self.get_cluster_events,
+                    start_time=since,
+                    event_types=["TERMINATING"],
+                )
+                events = events.get("events", [])
+                if events or state == "ERROR":
+                    reason = events[0].get("details") if events else cluster_details
+                    raise ClusterStateError(
+                        f"Cluster {cluster_id} is {state} while waiting for "
+                        f"{target_state}: {reason}"
+                    )
+            if state != previous_state:
+                interval = initial_interval
+                previous_state = state
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(
+                    f"Cluster {cluster_id} did not reach {target_state} within "
+                    f"{timeout} s (current state: {state})"
+                )
+            sleep_time = interval * random.uniform(1 - jitter, 1 + jitter)
+            sleep_time = min(sleep_time, remaining)
+            print(
+                f"[{cluster_id}] Cluster state: {state}, waiting for {target_state}. "
+                f"Next check in {sleep_time:.1f} s."
+            )
+            yield Sleep(sleep_time)
+            interval = min(interval * backoff, max_interval)
 
     def get_cluster_libraries(self) -> dict:
         """
         Returns details about installed libraries on the cluster.
         """
-        url = self.url + "libraries/cluster-status"
-        response = requests.get(url, headers=self.headers, json=self.payload)
-        return json.loads(response.text)
+        return self.request_json("GET", "libraries/cluster-status", json=self.payload)
 
     def extract_installed_libraries_names(self, cluster_libraries: dict) -> list:
         """
@@ -88,7 +401,7 @@ class DatabricksRequest:
                 libraries_list.append(library.get("library"))
         return libraries_list
 
-    def uninstall_library(self, library: dict) -> str:
+    def uninstall_library(self, library: dict) -> dict:
         """
         Uninstall a library from the cluster.
 
@@ -97,107 +410,462 @@ class DatabricksRequest:
         library = {'whl': 'dbfs:/FileStore/jars/databricks_processing-0.0.1-py3-none-any.whl'}
         api_object.uninstall_library(library)
         """
-        url = self.url + "libraries/uninstall"
-        payload = self.payload
-        payload["libraries"] = [library]
-        response = requests.post(url, headers=self.headers, json=payload)
-        return response.text
+        return self.uninstall_libraries([library])
 
-    def delete_file_dbfs(self, path: str) -> str:
+    def uninstall_libraries(self, libraries: list) -> dict:
+        """
+        Uninstall a list of libraries from the cluster in a single request.
+        Libraries are removed on the next restart of the cluster.
+        """
+        payload = {"cluster_id": self.payload["cluster_id"], "libraries": libraries}
+        return self.request_json("POST", "libraries/uninstall", json=payload)
+
+    def delete_file_dbfs(self, path: str) -> dict:
         """
         Delete a file from DBFS.
         """
-        url = self.url + "dbfs/delete"
         payload = {"path": path, "recursive": True}
-        response = requests.post(url, headers=self.headers, json=payload)
-        return response.text
+        return self.request_json("POST", "dbfs/delete", json=payload)
 
-    def upload_file_dbfs(self, file_local_path: str, dbfs_path: str) -> str:
+    def upload_file_dbfs(self, file_local_path: str, dbfs_path: str) -> dict:
         """
         Upload file to DBFS.
+        Files bigger than DBFS_STREAMING_THRESHOLD are streamed in blocks (see
+        upload_file_dbfs_streaming_steps), smaller ones are sent in a single request.
         """
-        url = self.url + "dbfs/put"
+        return self.run_steps(self.upload_file_dbfs_steps(file_local_path, dbfs_path))
+
+    def upload_file_dbfs_steps(self, file_local_path: str, dbfs_path: str):
+        if os.path.getsize(file_local_path) > DBFS_STREAMING_THRESHOLD:
+            return (
+                yield from self.upload_file_dbfs_streaming_steps(
+                    file_local_path, dbfs_path
+                )
+            )
         with open(file_local_path, "rb") as whl_file:
             payload = {"path": dbfs_path, "overwrite": True}
             files = {"file": whl_file}
-            response = requests.post(
-                url, headers=self.headers, data=payload, files=files
+            return (
+                yield Call(
+                    self.request_json, "POST", "dbfs/put", data=payload, files=files
+                )
             )
-        return response.text
 
-    def install_whl(self, dbfs_path: str) -> str:
+    def upload_file_dbfs_streaming(
+        self, file_local_path: str, dbfs_path: str, block_size: int = DBFS_BLOCK_SIZE
+    ) -> dict:
+        """
+        Upload file to DBFS using the streaming API (see
+        upload_file_dbfs_streaming_steps).
+        """
+        return self.run_steps(
+            self.upload_file_dbfs_streaming_steps(
+                file_local_path, dbfs_path, block_size
+            )
+        )
+
+    def upload_file_dbfs_streaming_steps(
+        self, file_local_path: str, dbfs_path: str, block_size: int = DBFS_BLOCK_SIZE
+    ):
+        """
+        Steps of uploading a file to DBFS using the streaming API (dbfs/create,
+        dbfs/add-block, dbfs/close).
+        The file is read block by block into a single reusable buffer. Blocks have to
+        be appended in order, so they are sent one at a time while the next block is
+        read and encoded - at most two encoded blocks are kept in memory.
+        The blocks are written to a temporary path next to dbfs_path, which is moved
+        into place only after the whole file has been written - if any of the blocks
+        fails, the handle is closed, the partial file is deleted and the file at
+        dbfs_path is left intact.
+        """
+        temporary_path = f"{dbfs_path}.{uuid.uuid4().hex}.tmp"
+        created = yield Call(
+            self.request_json,
+            "POST",
+            "dbfs/create",
+            json={"path": temporary_path, "overwrite": True},
+        )
+        handle = created["handle"]
+        closed = False
+        buffer = bytearray(block_size)
+        view = memoryview(buffer)
+        try:
+            with open(file_local_path, "rb") as file:
+
+                def read_block() -> Union[str, None]:
+                    read_bytes = file.readinto(buffer)
+                    if not read_bytes:
+                        return None
+                    return base64.b64encode(view[:read_bytes]).decode("ascii")
+
+                data = yield BlockingCall(read_block)
+                while data is not None:
+                    results = yield Gather(
+                        [
+                            Call(
+                                self.request_json,
+                                "POST",
+                                "dbfs/add-block",
+                                json={"handle": handle, "data": data},
+                            ),
+                            BlockingCall(read_block),
+                        ],
+                        return_exceptions=True,
+                    )
+                    # both have finished, so the file is not read after it is closed
+                    for result in results:
+                        if isinstance(result, BaseException):
+                            raise result
+                    data = results[1]
+            yield Call(self.request_json, "POST", "dbfs/close", json={"handle": handle})
+            closed = True
+        except Exception:
+            if not closed:
+                try:
+                    yield Call(
+                        self.request_json,
+                        "POST",
+                        "dbfs/close",
+                        json={"handle": handle},
+                    )
+                except DatabricksAPIError as e:
+                    logger.info(f"Handle of {temporary_path} was not closed: {e}")
+            try:
+                yield Call(self.delete_file_dbfs, temporary_path)
+            except DatabricksAPIError as e:
+                logger.info(f"Partial upload {temporary_path} was not deleted: {e}")
+            raise
+        # dbfs/move does not overwrite existing files
+        try:
+            yield Call(self.delete_file_dbfs, dbfs_path)
+        except ResourceNotFoundError:
+            logger.debug(f"{dbfs_path} does not exist yet")
+        payload = {"source_path": temporary_path, "destination_path": dbfs_path}
+        return (yield Call(self.request_json, "POST", "dbfs/move", json=payload))
+
+    def get_file_status_dbfs(self, dbfs_path: str) -> Union[dict, None]:
+        """
+        Get the status of a file on DBFS (path, is_dir, file_size, modification_time).
+        Returns None if the file does not exist; other errors are raised.
+        """
+        return self.run_steps(self.get_file_status_dbfs_steps(dbfs_path))
+
+    def get_file_status_dbfs_steps(self, dbfs_path: str):
+        payload = {"path": dbfs_path}
+        try:
+            return (
+                yield Call(self.request_json, "GET", "dbfs/get-status", json=payload)
+            )
+        except ResourceNotFoundError as e:
+            logger.debug(f"{dbfs_path} does not exist: {e}")
+            return None
+
+    def read_file_dbfs(self, dbfs_path: str, chunk_size: int = DBFS_BLOCK_SIZE):
+        """
+        Read the whole content of a file from DBFS.
+        Returns None if the file does not exist; other errors are raised.
+        """
+        return self.run_steps(self.read_file_dbfs_steps(dbfs_path, chunk_size))
+
+    def read_file_dbfs_steps(self, dbfs_path: str, chunk_size: int = DBFS_BLOCK_SIZE):
+        content = b""
+        while True:
+            payload = {"path": dbfs_path, "offset": len(content), "length": chunk_size}
+            try:
+                response_json = yield Call(
+                    self.request_json, "GET", "dbfs/read", json=payload
+                )
+            except ResourceNotFoundError:
+                return None
+            content += base64.b64decode(response_json.get("data", ""))
+            if response_json.get("bytes_read", 0) < chunk_size:
+                return content
+
+    def install_whl(self, dbfs_path: str) -> dict:
         """
         Install whl file from DBFS on a given cluster.
         """
-        url = self.url + "libraries/install"
-        payload = self.payload
-        payload["libraries"] = {"whl": dbfs_path}
-        response = requests.post(url, headers=self.headers, json=self.payload)
-        print(response)
-        return response.text
+        return self.install_libraries([{"whl": dbfs_path}])
 
-    def install_library_pip(self, library: str) -> str:
+    def install_library_pip(self, library: str) -> dict:
         """
         Install a library from PYPI repository - equals to `pip install <library>`.
         """
-        url = self.url + "libraries/install"
-        payload = self.payload
-        payload["libraries"] = {"pypi": {"package": f"{library}"}}
-        response = requests.post(url, headers=self.headers, json=self.payload)
-        return response.text
+        return self.install_libraries([{"pypi": {"package": f"{library}"}}])
+
+    def install_libraries(self, libraries: list) -> dict:
+        """
+        Install a list of libraries on the cluster in a single request.
+        Libraries of different types can be mixed, e.g.:
+
+        [{"pypi": {"package": "requests==2.26.0"}}, {"whl": "dbfs:/FileStore/a.whl"}]
+        """
+        payload = {"cluster_id": self.payload["cluster_id"], "libraries": libraries}
+        return self.request_json("POST", "libraries/install", json=payload)
 
     def get_directory_info(self, dir_path: str, api_version: str = "2.0"):
         """
         Get info about a directory.
         """
-        url = self.host + f"api/{api_version}/workspace/get-status"
         payload = {"path": dir_path}
-        response = requests.get(url, headers=self.headers, json=payload)
-        return json.loads(response.text)
+        return self.request_json(
+            "GET", "workspace/get-status", api_version=api_version, json=payload
+        )
 
     def check_if_notebook_dir_exists(self, notebooks_dir: str) -> dict:
         """
         Check if the parent directory for notebooks exists.
+        Returns its status, or the error (with error_code RESOURCE_DOES_NOT_EXIST)
+        if it does not exist.
         """
-        url = self.url + "workspace/get-status"
+        return self.run_steps(self.check_if_notebook_dir_exists_steps(notebooks_dir))
+
+    def check_if_notebook_dir_exists_steps(self, notebooks_dir: str):
         payload = {"path": f"{notebooks_dir}"}
-        print(
-            f"Check if notebook dir exists \nurl: {url}\npayload: {payload}\n"
-            f"headers: {self.headers}"
-        )
-        response = requests.get(url, headers=self.headers, json=payload)
-        return json.loads(response.text)
+        logger.debug(f"Check if notebook dir exists \npayload: {payload}")
+        try:
+            return (
+                yield Call(
+                    self.request_json, "GET", "workspace/get-status", json=payload
+                )
+            )
+        except ResourceNotFoundError as e:
+            return {"error_code": e.error_code, "message": e.message}
 
     def create_directory(self, notebooks_dir: str) -> dict:
         """
         Create directory in the workspace.
         """
-        url = self.url + "workspace/mkdirs"
         payload = {"path": f"{notebooks_dir}"}
-        response = requests.post(url, headers=self.headers, json=payload)
-        return json.loads(response.text)
+        return self.request_json("POST", "workspace/mkdirs", json=payload)
 
     def upload_notebooks(
         self, local_notebook_path: str, target_path: str, language: str = "PYTHON"
-    ):
+    ) -> dict:
         """
         Upload notebooks from the artifact to the given path on the workspace.
         Target path is stripped of notebook subdirectory.
+        The notebook is streamed into the request body (see StreamingImportBody).
+        """
+        body = StreamingImportBody(
+            local_notebook_path,
+            path=f"{target_path}",
+            format="SOURCE",
+            language=f"{language}",
+            overwrite="true",
+        )
+        return self.request_json(
+            "POST",
+            "workspace/import",
+            data=body,
+            headers={"Content-Type": "application/json"},
+        )
+
+    def archive_import_body(
+        self, archive_path: str, target_path: str
+    ) -> StreamingImportBody:
+        """
+        Body of the workspace/import request of import_archive - its len() is the
+        size of the request.
+        """
+        return StreamingImportBody(archive_path, path=f"{target_path}", format="AUTO")
+
+    def import_archive(self, archive_path: str, target_path: str) -> dict:
+        """
+        Import an archive (zip of notebook sources or DBC) as the directory
+        target_path, with format AUTO. The directory must not exist - archives
+        cannot overwrite existing objects. The archive is streamed from the file,
+        base64-encoded on the fly (see StreamingImportBody).
+        """
+        return self.request_json(
+            "POST",
+            "workspace/import",
+            data=self.archive_import_body(archive_path, target_path),
+            headers={"Content-Type": "application/json"},
+        )
+
+    def delete_workspace_path(self, path: str, recursive: bool = True) -> dict:
+        """
+        Delete a notebook or a directory from the workspace.
         """
-        url = self.url + "workspace/import"
-        headers = self.headers
-        with open(f"{local_notebook_path}", "rb") as notebook_file:
-            notebook_file = notebook_file.read()
-            encoded = base64.b64encode(notebook_file)
-            decoded_utf8 = encoded.decode("UTF-8")
-            payload = {
-                "path": f"{target_path}",
-                "format": "SOURCE",
-                "language": f"{language}",
-                "overwrite": "true",
-                "content": decoded_utf8,
-            }
-            response = requests.post(url, headers=headers, json=payload)
-            return response.text
+        payload = {"path": f"{path}", "recursive": recursive}
+        return self.request_json("POST", "workspace/delete", json=payload)
 
 
+def wait_for_clusters_state(
+    api_objects: list, target_state: str = "RUNNING", since: dict = None, **kwargs
+) -> dict:
+    """
+    Wait for many clusters concurrently (see wait_for_clusters_state_steps).
+    """
+    return run_steps(
+        wait_for_clusters_state_steps(api_objects, target_state, since, **kwargs)
+    )
+
+
+def wait_for_clusters_state_steps(
+    api_objects: list, target_state: str = "RUNNING", since: dict = None, **kwargs
+):
+    """
+    Steps (see step_runner) of waiting until all of the given clusters reach
+    target_state, concurrently (see DatabricksRequest.wait_for_cluster_state_steps
+    for the other arguments). since - cluster id -> baseline of its events taken
+    before the awaited action (see DatabricksRequest.get_events_baseline).
+    Returns a dict of cluster id -> reached state or the raised exception, so that
+    the caller can decide what to do with clusters that failed.
+    """
+    since = since or {}
+    states = yield Gather(
+        (
+            api_object.wait_for_cluster_state_steps(
+                target_state,
+                since=since.get(api_object.payload["cluster_id"]),
+                **kwargs,
+            )
+            for api_object in api_objects
+        ),
+        return_exceptions=True,
+    )
+    return {
+        api_object.payload["cluster_id"]: state
+        for api_object, state in zip(api_objects, states)
+    }
+
+
+def wait_for_libraries(api_objects: list, libraries: dict, **kwargs) -> list:
+    """
+    Wait until all of the requested libraries are either INSTALLED or FAILED on all
+    of the given clusters (see wait_for_libraries_steps).
+    """
+    return run_steps(wait_for_libraries_steps(api_objects, libraries, **kwargs))
+
+
+@traced(name="wait_for_libraries")
+def wait_for_libraries_steps(
+    api_objects: list,
+    libraries: dict,
+    timeout: float = LIBRARY_WAIT_TIMEOUT,
+    initial_interval: float = 2.0,
+    max_interval: float = 30.0,
+    backoff: float = 1.5,
+):
+    """
+    Steps (see step_runner) of waiting until all of the requested libraries are
+    either INSTALLED or FAILED on all of the given clusters. Cluster statuses
+    (libraries/cluster-status) are polled concurrently in rounds, with an
+    exponentially growing interval between them.
+
+    libraries - cluster id -> list of requested library specs, e.g.
+    {"0819-133744-wake392": [{"pypi": {"package": "requests"}}]}
+
+    Returns a per-library report: cluster, library, final status, time (in seconds,
+    with the precision of the polling interval) after which the final status was
+    observed, and messages from the API. Libraries that did not finish in time are
+    reported with status TIMEOUT.
+    """
+    started = time.monotonic()
+    deadline = started + timeout
+    report = new_libraries_report(api_objects, libraries)
+    interval = initial_interval
+    pending_api_objects = [
+        api_object
+        for api_object in api_objects
+        if libraries.get(api_object.payload["cluster_id"])
+    ]
+    while pending_api_objects:
+        cluster_statuses = yield Gather(
+            Call(api_object.get_cluster_libraries) for api_object in pending_api_objects
+        )
+        elapsed = round(time.monotonic() - started, 1)
+        for api_object, cluster_status in zip(pending_api_objects, cluster_statuses):
+            update_libraries_report(
+                report, api_object.payload["cluster_id"], cluster_status, elapsed
+            )
+        pending_api_objects = [
+            api_object
+            for api_object in pending_api_objects
+            if has_pending_libraries(report, api_object.payload["cluster_id"])
+        ]
+        remaining = deadline - time.monotonic()
+        if not pending_api_objects or remaining <= 0:
+            break
+        print(
+            f"Waiting for libraries on {len(pending_api_objects)} cluster(s). "
+            f"Next check in {min(interval, remaining):.1f} s."
+        )
+        yield Sleep(min(interval, remaining))
+        interval = min(interval * backoff, max_interval)
+    return finish_libraries_report(report)
+
+
+def new_libraries_report(api_objects: list, libraries: dict) -> dict:
+    """
+    Create a report of the requested libraries (see wait_for_libraries_steps), keyed
+    (cluster id, library spec as JSON).
+    """
+    return {
+        (api_object.payload["cluster_id"], json.dumps(library, sort_keys=True)): {
+            "cluster": api_object.payload["cluster_id"],
+            "library": library,
+            "status": None,
+            "elapsed_s": None,
+            "messages": [],
+        }
+        for api_object in api_objects
+        for library in libraries.get(api_object.payload["cluster_id"], [])
+    }
+
+
+def update_libraries_report(
+    report: dict, cluster_id: str, cluster_status: dict, elapsed: float
+) -> None:
+    """
+    Update the report with a response from libraries/cluster-status. elapsed is
+    recorded for libraries which have just reached a final status.
+    """
+    for library_status in cluster_status.get("library_statuses", []):
+        library = json.dumps(library_status.get("library"), sort_keys=True)
+        entry = report.get((cluster_id, library))
+        if entry is None or entry["status"] in LIBRARY_FINAL_STATUSES:
+            continue
+        entry["status"] = library_status.get("status")
+        entry["messages"] = library_status.get("messages", [])
+        if entry["status"] in LIBRARY_FINAL_STATUSES:
+            entry["elapsed_s"] = elapsed
+
+
+def has_pending_libraries(report: dict, cluster_id: str) -> bool:
+    return any(
+        entry["cluster"] == cluster_id and entry["status"] not in LIBRARY_FINAL_STATUSES
+        for entry in report.values()
+    )
+
+
+def finish_libraries_report(report: dict) -> list:
+    """
+    Mark libraries which have not reached a final status as TIMEOUT.
+    """
+    for entry in report.values():
+        if entry["status"] not in LIBRARY_FINAL_STATUSES:
+            entry["status"] = "TIMEOUT"
+    return list(report.values())
+
+
+def print_libraries_report(report: list) -> None:
+    """
+    Print the report from wait_for_libraries_steps, the slowest libraries first.
+    """
+    print("Libraries installation report:")
+    elapsed = [
+        float("inf") if entry["elapsed_s"] is None else entry["elapsed_s"]
+        for entry in report
+    ]
+    for _, entry in sorted(zip(elapsed, report), key=lambda e: -e[0]):
+        line = (
+            f"  [{entry['cluster']}] {entry['status']:<9} "
+            f"{entry['elapsed_s'] if entry['elapsed_s'] is not None else '-':>7} s  "
+            f"{entry['library']}"
+        )
+        if entry["status"] != "INSTALLED" and entry["messages"]:
+            line += f" - {entry['messages']}"
+        print(line)
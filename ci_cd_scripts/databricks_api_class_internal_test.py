@@ -0,0 +1,150 @@
+import base64
+import json
+
+import pytest
+
+from databricks_api_class_internal import (
+    ClusterStateError,
+    DatabricksRequest,
+    StreamingImportBody,
+    wait_for_clusters_state,
+)
+from request_executor import ResourceNotFoundError, ServiceUnavailableError
+
+
+@pytest.mark.parametrize("file_size", [0, 1, 2, 3, 4, 11, 12, 100])
+@pytest.mark.parametrize("chunk_size", [3, 7, 12])
+def test_streaming_import_body_length_matches_its_content(
+    tmp_path, file_size, chunk_size
+):
+    file = tmp_path / "notebooks.zip"
+    content = bytes(i % 256 for i in range(file_size))
+    file.write_bytes(content)
+    body = StreamingImportBody(
+        file, chunk_size=chunk_size, path="/notebooks", format="AUTO"
+    )
+    data = b"".join(body)
+    assert len(body) == len(data)
+    assert json.loads(data) == {
+        "path": "/notebooks",
+        "format": "AUTO",
+        "content": base64.b64encode(content).decode(),
+    }
+    # the body is sent again when the request is retried
+    assert b"".join(body) == data
+
+
+class FakeDbfsRequest(DatabricksRequest):
+    """
+    Answers the DBFS streaming API from memory - requests to the endpoints listed
+    in failing_endpoints fail.
+    """
+
+    def __init__(self, files: dict, failing_endpoints: set = ()) -> None:
+        super().__init__("https://host/", None, "token", session=object())
+        self.files = files
+        self.failing_endpoints = set(failing_endpoints)
+        self.handles = {}
+        self.calls = []
+
+    def request_json(self, method: str, endpoint: str, **kwargs) -> dict:
+        payload = kwargs["json"]
+        self.calls.append(endpoint)
+        if endpoint in self.failing_endpoints:
+            raise ServiceUnavailableError(endpoint, 500)
+        if endpoint == "dbfs/create":
+            self.handles[len(self.handles)] = payload["path"]
+            self.files[payload["path"]] = b""
+            return {"handle": len(self.handles) - 1}
+        if endpoint == "dbfs/add-block":
+            path = self.handles[payload["handle"]]
+            self.files[path] += base64.b64decode(payload["data"])
+        elif endpoint == "dbfs/close":
+            del self.handles[payload["handle"]]
+        elif endpoint == "dbfs/delete":
+            if payload["path"] not in self.files:
+                raise ResourceNotFoundError(endpoint, 404, "RESOURCE_DOES_NOT_EXIST")
+            del self.files[payload["path"]]
+        elif endpoint == "dbfs/move":
+            self.files[payload["destination_path"]] = self.files.pop(
+                payload["source_path"]
+            )
+        return {}
+
+
+def test_streaming_upload_creates_missing_files(tmp_path):
+    file = tmp_path / "package-0.1-py3-none-any.whl"
+    file.write_bytes(b"x" * 10)
+    api_object = FakeDbfsRequest({})
+    api_object.upload_file_dbfs_streaming(str(file), "dbfs:/jars/package.whl", 4)
+    assert api_object.files == {"dbfs:/jars/package.whl": b"x" * 10}
+    assert api_object.handles == {}
+
+
+def test_failed_streaming_upload_closes_handle_and_keeps_existing_file(tmp_path):
+    file = tmp_path / "package-0.1-py3-none-any.whl"
+    file.write_bytes(b"x" * 10)
+    api_object = FakeDbfsRequest(
+        {"dbfs:/jars/package.whl": b"old"}, failing_endpoints={"dbfs/add-block"}
+    )
+    with pytest.raises(ServiceUnavailableError):
+        api_object.upload_file_dbfs_streaming(str(file), "dbfs:/jars/package.whl", 4)
+    assert api_object.files == {"dbfs:/jars/package.whl": b"old"}
+    assert api_object.handles == {}
+    assert api_object.calls == [
+        "dbfs/create",
+        "dbfs/add-block",
+        "dbfs/close",
+        "dbfs/delete",
+    ]
+
+
+class FakeClusterRequest(DatabricksRequest):
+    """
+    Reports the given cluster states one by one (the last one repeatedly) and
+    the given cluster events.
+    """
+
+    def __init__(self, cluster_id: str, states: list, events: list = ()) -> None:
+        super().__init__("https://host/", cluster_id, "token", session=object())
+        self.states = list(states)
+        self.events = list(events)
+
+    def get_cluster_details(self) -> dict:
+        state = self.states.pop(0) if len(self.states) > 1 else self.states[0]
+        return {"state": state}
+
+    def get_cluster_events(self, start_time=None, event_types=None, limit=None):
+        return {
+            "events": [
+                event
+                for event in self.events
+                if event["timestamp"] >= (start_time or 0)
+                and (event_types is None or event["type"] in event_types)
+            ]
+        }
+
+
+def test_wait_for_clusters_state_waits_for_all_clusters_concurrently():
+    terminated = {"type": "TERMINATING", "timestamp": 20, "details": "no quota"}
+    api_objects = [
+        FakeClusterRequest("running", ["RUNNING"]),
+        FakeClusterRequest("starting", ["PENDING", "PENDING", "RUNNING"]),
+        FakeClusterRequest("failed", ["PENDING", "TERMINATED"], [terminated]),
+    ]
+    states = wait_for_clusters_state(
+        api_objects,
+        "RUNNING",
+        since={"starting": 10, "failed": 10},
+        initial_interval=0.01,
+    )
+    assert states["running"] == "RUNNING"
+    assert states["starting"] == "RUNNING"
+    assert isinstance(states["failed"], ClusterStateError)
+    assert "no quota" in str(states["failed"])
+
+
+def test_wait_for_clusters_state_without_since_fails_on_terminated_clusters():
+    api_objects = [FakeClusterRequest("terminated", ["TERMINATED"])]
+    states = wait_for_clusters_state(api_objects, initial_interval=0.01)
+    assert isinstance(states["terminated"], ClusterStateError)
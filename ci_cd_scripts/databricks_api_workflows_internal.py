@@ -1,271 +1,1269 @@
 import os
 import re
 import time
-import glob
+import zipfile
+import tempfile
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Union
+
+from packaging.utils import canonicalize_name
 
 from read_config import read_env_cfg
-from databricks_api_class_internal import DatabricksRequest
+from databricks_api_class_internal import (
+    DatabricksRequest,
+    wait_for_libraries_steps,
+    print_libraries_report,
+)
+from file_index import find
+from request_executor import DatabricksAPIError
+from deploy_manifest import DeployManifest, get_manifest, parse_force_flag
+from file_hashing import file_sha256
+from requirements_lock import lock_requirements
+from step_runner import BlockingCall, Call, Gather, run_steps
+from tracing import get_logger, traced
+
+logger = get_logger(__name__)
 
 if os.environ.get("ENVIRONMENT_NAME") == "prd_bi":
     ENVIRONMENT_NAME = "prd"
 else:
     ENVIRONMENT_NAME = os.environ.get("ENVIRONMENT_NAME")
-print(f"Environment name: {ENVIRONMENT_NAME}")
+logger.debug(f"Environment name: {ENVIRONMENT_NAME}")
 BUILD_REPOSITORY_NAME = os.environ.get("BUILD_REPOSITORY_NAME")
 
+# content-addressed DBFS directory for wheels of dependencies (see upload_wheelhouse)
+DEFAULT_WHEELHOUSE_DBFS_DIR = "dbfs:/FileStore/wheelhouse/"
+# notebook file extension -> language of the notebook in the workspace
+NOTEBOOK_LANGUAGES = {"sql": "SQL", "py": "PYTHON"}
+# first line which makes the AUTO import format treat a source file as a notebook
+NOTEBOOK_HEADERS = {
+    "sql": "-- Databricks notebook source",
+    "py": "# Databricks notebook source",
+}
+# workspace/import rejects requests bigger than 10 MB - archives whose request
+# (base64-encoded in JSON) is bigger than this are imported file by file
+MAX_ARCHIVE_SIZE = int(
+    os.environ.get("NOTEBOOKS_MAX_ARCHIVE_SIZE", int(7.5 * 1024 * 1024))
+)
 # name for the folder which groups notebooks on databricks_steps workspace
 local_notebooks_dirs = "notebooks"
+# workspace directories known to exist, as (host, path) - filled by
+# create_notebook_directories, so that repeated uploads in one process skip them
+known_workspace_directories = set()
+# DBFS files already staged (uploaded or verified) by the current process, as
+# (host, path) - see stage_artifacts
+staged_dbfs_files = set()
 
 
 
+@traced()
 def upload_init_script_workflow(
     cfg_path: str,
     secret_path: str,
     init_script_local_path: str,
     init_script_dbfs_path: str = "dbfs:/databricks/scripts",
+    force: Union[bool, str] = False,
 ):
     """
     Workflow for uploading init script to Databricks.
     By default init script is overwritten at the default path set in the function
     definition.
+    Upload is skipped if the init script has not changed since the last deployment
+    or has already been staged (see stage_artifacts), unless force is set.
     """
     databricks_token = read_token_from_file(secret_path)
     cfg = read_env_cfg(ENVIRONMENT_NAME, cfg_path)
     api_object = DatabricksRequest(cfg.get("databricks_host"), None, databricks_token)
-    if init_script_dbfs_path[-1] != "/":
-        init_script_dbfs_path += "/"
-    dbfs_path = init_script_dbfs_path + init_script_local_path.split("/")[-1]
-    upload_response = api_object.upload_file_dbfs(init_script_local_path, dbfs_path)
-    if upload_response == dict():
-        print(f"Package has been successfully installed.")
+    manifest = get_manifest(api_object, cfg.get("deploy_manifest_path"))
+    dbfs_path = get_init_script_dbfs_path(init_script_local_path, init_script_dbfs_path)
+    if stage_artifacts(
+        api_object,
+        {init_script_local_path: dbfs_path},
+        manifest,
+        parse_force_flag(force),
+    ):
+        print("Init script has been successfully uploaded.")
+        manifest.save()
+    else:
+        print(f"Init script {dbfs_path} is up to date - skipping upload.")
+    manifest.print_summary()
 
 
+@traced()
 def upload_notebooks_workflow(
     cfg_path: str,
     secret_path: str,
     notebooks_artifact_path: str,
     notebooks_target_dir: str = "/deployed/notebooks/",
+    max_parallel_imports: Union[int, str] = 8,
+    force: Union[bool, str] = False,
+    import_mode: str = "files",
+    replace_directories: Union[bool, str] = False,
 ):
     """
     Workflow for uploading notebooks to Databricks workspace.
     It does not need cluster info.
+    Notebooks are imported concurrently by at most max_parallel_imports workers.
+    Only notebooks that have changed since the last deployment are imported, unless
+    force is set.
+    With import_mode "archive", each top-level directory of the notebooks tree is
+    imported as a single archive where possible (see import_notebook_archives) and
+    the remaining notebooks are imported file by file.
     """
-    print(f"notebooks_target_dir: {notebooks_target_dir}")
-    print(f"notebooks_artifact_path: {notebooks_artifact_path}")
+    logger.debug(f"notebooks_target_dir: {notebooks_target_dir}")
+    logger.debug(f"notebooks_artifact_path: {notebooks_artifact_path}")
     databricks_token = read_token_from_file(secret_path)
     cfg = read_env_cfg(ENVIRONMENT_NAME, cfg_path)
     api_object = DatabricksRequest(cfg.get("databricks_host"), None, databricks_token)
+    manifest = get_manifest(api_object, cfg.get("deploy_manifest_path"))
+    run_steps(
+        upload_notebooks_steps(
+            api_object,
+            manifest,
+            notebooks_artifact_path,
+            notebooks_target_dir,
+            max_parallel_imports,
+            force,
+            import_mode,
+            replace_directories,
+        )
+    )
+
+
+def upload_notebooks_steps(
+    api_object: DatabricksRequest,
+    manifest: DeployManifest,
+    notebooks_artifact_path: str,
+    notebooks_target_dir: str,
+    max_parallel_imports: Union[int, str],
+    force: Union[bool, str],
+    import_mode: str,
+    replace_directories: Union[bool, str],
+):
+    """
+    Steps (see step_runner) of upload_notebooks_workflow, shared with
+    databricks_api_async.upload_notebooks_workflow_async.
+    """
+    force = parse_force_flag(force)
+    notebooks_target_dir = normalize_notebooks_target_dir(notebooks_target_dir)
+    notebook_paths = discover_notebooks(notebooks_artifact_path, notebooks_target_dir)
+    changed_notebooks = yield BlockingCall(
+        find_changed_notebooks, manifest, notebook_paths, force
+    )
+    archive_results = []
+    if import_mode == "archive":
+        archive_results, changed_notebooks = yield from import_notebook_archives_steps(
+            api_object,
+            notebook_paths,
+            changed_notebooks,
+            notebooks_target_dir,
+            replace_directories=parse_force_flag(replace_directories),
+        )
+    elif import_mode != "files":
+        raise ValueError(f"Invalid import_mode {import_mode}. Use files or archive")
+    for key in ["local_paths", "db_paths"]:
+        notebook_paths[key] = [notebook_paths[key][x] for x in changed_notebooks]
+
+    yield from create_notebook_directories_steps(
+        api_object, notebook_paths.get("db_paths")
+    )
 
+    logger.debug(f"Length of local paths: {(len(notebook_paths.get('local_paths')))}")
+    languages = [
+        NOTEBOOK_LANGUAGES.get(str(local_path).split(".")[-1])
+        for local_path in notebook_paths.get("local_paths")
+    ]
+    results = archive_results + (
+        yield from import_notebooks_steps(
+            api_object,
+            notebook_paths.get("local_paths"),
+            notebook_paths.get("db_paths"),
+            languages,
+            max_parallel=int(max_parallel_imports),
+        )
+    )
+    failed_imports = [result for result in results if result["status"] != "SUCCESS"]
+    for result in results:
+        if result["status"] == "SUCCESS":
+            yield BlockingCall(manifest.record, result["db_path"], result["local_path"])
+    yield BlockingCall(manifest.save)
+    manifest.print_summary()
+    print(
+        f"Notebooks import: {len(results) - len(failed_imports)} succeeded, "
+        f"{len(failed_imports)} failed."
+    )
+    for result in failed_imports:
+        print(f"  {result['local_path']} -> {result['db_path']}: {result['error']}")
+    if failed_imports:
+        raise RuntimeError(f"{len(failed_imports)} notebook(s) were not imported")
+
+
+def find_changed_notebooks(
+    manifest: DeployManifest, notebook_paths: dict, force: bool = False
+) -> list:
+    """
+    Return indices of the notebooks (see discover_notebooks) which have changed
+    since the last deployment (see DeployManifest.is_unchanged).
+    """
+    return [
+        x
+        for x, db_path in enumerate(notebook_paths.get("db_paths"))
+        if not manifest.is_unchanged(
+            db_path, notebook_paths.get("local_paths")[x], force
+        )
+    ]
+
+
+def normalize_notebooks_target_dir(notebooks_target_dir: str) -> str:
+    """
+    Make the workspace target directory absolute and ending with a slash.
+    """
     if notebooks_target_dir[0] != "/":
         notebooks_target_dir = "/" + notebooks_target_dir
     if notebooks_target_dir[-1] != "/":
         notebooks_target_dir += "/"
+    return notebooks_target_dir
+
 
+def discover_notebooks(notebooks_artifact_path: str, notebooks_target_dir: str) -> dict:
+    """
+    Find notebooks (.py and .sql files nested one or two directories deep) in the
+    artifact and map them to their target paths in the workspace.
+    Returns {"local_paths": [...], "db_paths": [...]}.
+    """
     notebook_paths = {"local_paths": [], "db_paths": []}
     handled_extensions = ["sql", "py"]
     wildcards_supported_nesting = ["**", "**/**"]
-    extension_language_mapping = {"sql": "SQL", "py": "PYTHON"}
-    print(f"cwd: {os.getcwd()}")
-    print(f"listdir: {os.listdir()}")
+    logger.debug(f"cwd: {os.getcwd()}")
+    logger.debug(f"listdir: {os.listdir()}")
 
     for file_extension in handled_extensions:
         for nesting in wildcards_supported_nesting:
-            print(f"path: {notebooks_artifact_path}/{nesting}/*.{file_extension}")
             lookup_path = f"{notebooks_artifact_path}/{nesting}/*.{file_extension}"
+            logger.debug(f"path: {lookup_path}")
             slashes_count = lookup_path.count("/")
             slice_index = slashes_count - 2
-            for entity in glob.glob(lookup_path):
-                print(f"entity: {entity}")
+            lookup_pattern = f"{nesting}/*.{file_extension}"
+            for entity in find(notebooks_artifact_path, lookup_pattern):
+                logger.debug(f"entity: {entity}")
                 notebook_paths["db_paths"].append(
                     notebooks_target_dir
                     + "/".join(entity.split("/")[-slice_index:])
                 )
                 notebook_paths["local_paths"].append(Path(entity))
 
-    print(f"Local paths: {notebook_paths.get('local_paths')}")
-    print(f"Databricks paths: {notebook_paths.get('db_paths')}")
+    logger.debug(f"Local paths: {notebook_paths.get('local_paths')}")
+    logger.debug(f"Databricks paths: {notebook_paths.get('db_paths')}")
 
     if len(notebook_paths.get("local_paths")) != len(notebook_paths.get("db_paths")):
         raise ValueError(
-            f"Length of local_paths is different than db_paths - THEY MUST be the same"
+            "Length of local_paths is different than db_paths - THEY MUST be the same"
+        )
+    return notebook_paths
+
+
+def import_notebooks(
+    api_object: DatabricksRequest,
+    local_paths: list,
+    db_paths: list,
+    languages: list,
+    max_workers: int = 8,
+) -> list:
+    """
+    Import notebooks into the workspace, at most max_workers at a time (see
+    import_notebooks_steps).
+    """
+    return run_steps(
+        import_notebooks_steps(
+            api_object, local_paths, db_paths, languages, max_parallel=max_workers
         )
+    )
+
+
+@traced(name="import_notebooks")
+def import_notebooks_steps(
+    api_object: DatabricksRequest,
+    local_paths: list,
+    db_paths: list,
+    languages: list,
+    max_parallel: int = 8,
+):
+    """
+    Import notebooks into the workspace, at most max_parallel at a time.
+    Failed requests are retried by the request executor (only when it is safe,
+    see request_executor.RequestExecutor) - an import which still fails is
+    reported as FAILED with the error.
+    Returns a list of per-file results in the order of local_paths.
+    """
 
-    for x in range(len(notebook_paths.get("db_paths"))):
-        print(f"current: {'/'.join(notebook_paths.get('db_paths')[x].split('/')[:-1])}")
-        subdir = "/".join(notebook_paths.get("db_paths")[x].split("/")[:-1])
-        notebooks_dir_status = api_object.check_if_notebook_dir_exists(subdir)
-        print(f"notebooks_dir_status: {notebooks_dir_status}")
-        if notebooks_dir_status.get("error_code") == "RESOURCE_DOES_NOT_EXIST":
-            print("This path does not exist - proceed to creating a directory")
-            response = api_object.create_directory(subdir)
-            if len(response) == 0:
-                print(f"Directory has been created successfully.")
-            else:
-                print(f"Directory was not created - response from API:\n{response}")
-
-    print(f"Length of local paths: {(len(notebook_paths.get('local_paths')))}")
-    for x in range(len(notebook_paths.get("local_paths"))):
-        print(f"current db_path: {notebook_paths.get('db_paths')[x]}")
-        response = api_object.upload_notebooks(
-            notebook_paths.get("local_paths")[x],
-            notebook_paths.get("db_paths")[x],
-            extension_language_mapping.get(
-                f'{str(notebook_paths.get("local_paths")[x]).split(".")[-1]}'
-            ),
+    def import_single_notebook(local_path, db_path, language):
+        result = {"local_path": str(local_path), "db_path": db_path}
+        started = time.monotonic()
+        try:
+            yield Call(api_object.upload_notebooks, local_path, db_path, language)
+            result["status"] = "SUCCESS"
+        except Exception as e:
+            result["status"] = "FAILED"
+            result["error"] = repr(e)
+        result["elapsed_s"] = round(time.monotonic() - started, 2)
+        print(f"{result['status']}: {result['db_path']} ({result['elapsed_s']} s)")
+        return result
+
+    return (
+        yield Gather(
+            map(import_single_notebook, local_paths, db_paths, languages),
+            max_parallel=max_parallel,
         )
-        print(response)
-        if response == dict():
+    )
+
+
+def import_notebook_archives(
+    api_object: DatabricksRequest,
+    notebook_paths: dict,
+    changed_notebooks: list,
+    notebooks_target_dir: str,
+    replace_directories: bool = False,
+) -> tuple:
+    """
+    Import notebooks in bulk, one archive per top-level directory (see
+    import_notebook_archives_steps).
+    """
+    return run_steps(
+        import_notebook_archives_steps(
+            api_object,
+            notebook_paths,
+            changed_notebooks,
+            notebooks_target_dir,
+            replace_directories,
+        )
+    )
+
+
+@traced(name="import_notebook_archives")
+def import_notebook_archives_steps(
+    api_object: DatabricksRequest,
+    notebook_paths: dict,
+    changed_notebooks: list,
+    notebooks_target_dir: str,
+    replace_directories: bool = False,
+) -> tuple:
+    """
+    Import notebooks in bulk - each top-level directory of the notebooks tree (in
+    notebooks_target_dir) which contains changed notebooks is packed into a single
+    zip archive (see build_notebooks_archive) with all of its notebooks and
+    imported with one workspace/import request, streamed from a temporary file.
+    The AUTO import format names the notebooks of an archive without their file
+    extensions, unlike notebooks imported file by file (see discover_notebooks), so
+    a directory with notebooks differing only in the extension is never archived.
+    Archives cannot overwrite existing objects, so a directory which already exists
+    in the workspace is deleted first if replace_directories is set - only once the
+    archive has been built and checked against MAX_ARCHIVE_SIZE, and all of the
+    notebooks of a deleted directory have to be imported again. Otherwise, as well
+    as for notebooks placed directly in notebooks_target_dir, archives bigger than
+    MAX_ARCHIVE_SIZE and failed archive imports, the changed notebooks (all of the
+    notebooks of a deleted directory) are left to be imported file by file.
+
+    :param notebook_paths: all of the notebooks (see discover_notebooks)
+    :type notebook_paths: dict
+    :param changed_notebooks: indices of the notebooks which have to be imported
+    :type changed_notebooks: list
+
+    :return: results of the imported notebooks (as in import_notebooks_steps) and
+        indices of the notebooks left to be imported file by file
+    :rtype: tuple
+    """
+    directories = {}
+    for x, db_path in enumerate(notebook_paths.get("db_paths")):
+        relative_path = db_path[len(notebooks_target_dir):]
+        if "/" in relative_path:
+            directory, relative_path = relative_path.split("/", 1)
+            directories.setdefault(directory, []).append((x, relative_path))
+    changed = set(changed_notebooks)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for directory, notebooks in sorted(directories.items()):
+            indices = [x for x, _ in notebooks]
+            if not changed.intersection(indices):
+                continue
+            directory_path = notebooks_target_dir + directory
+            started = time.monotonic()
+            names = [os.path.splitext(path)[0] for _, path in notebooks]
+            if len(set(names)) != len(names):
+                print(
+                    f"{directory_path} has notebooks differing only in the extension "
+                    f"- importing notebooks file by file"
+                )
+                continue
+            directory_status = yield Call(
+                api_object.check_if_notebook_dir_exists, directory_path
+            )
+            directory_exists = "error_code" not in directory_status
+            if directory_exists and not replace_directories:
+                print(f"{directory_path} exists - importing notebooks file by file")
+                continue
+            archive_path = os.path.join(tmp_dir, f"{directory}.zip")
+            yield BlockingCall(
+                build_notebooks_archive,
+                [
+                    (notebook_paths.get("local_paths")[x], relative_path)
+                    for x, relative_path in notebooks
+                ],
+                archive_path,
+            )
+            body = api_object.archive_import_body(archive_path, directory_path)
+            if len(body) > MAX_ARCHIVE_SIZE:
+                print(
+                    f"Import request of {directory_path} would have {len(body)} "
+                    f"bytes - importing notebooks file by file"
+                )
+                continue
+            if directory_exists:
+                try:
+                    yield Call(api_object.delete_workspace_path, directory_path)
+                except DatabricksAPIError as e:
+                    print(f"{directory_path} was not deleted: {e}")
+                    continue
+                # the unchanged notebooks of the directory are gone as well
+                changed.update(indices)
+                known_workspace_directories.difference_update(
+                    (host, path)
+                    for host, path in list(known_workspace_directories)
+                    if host == api_object.host
+                    and (path + "/").startswith(directory_path + "/")
+                )
+            yield from create_notebook_directories_steps(api_object, [directory_path])
+            try:
+                yield Call(api_object.import_archive, archive_path, directory_path)
+            except DatabricksAPIError as e:
+                print(f"Archive import of {directory_path} failed: {e}")
+                continue
+            elapsed_s = round(time.monotonic() - started, 2)
             print(
-                f"Notebooks have been successfully uploaded to the path:\n"
-                f"{notebook_paths['python_db_paths'][x]}"
+                f"SUCCESS: {directory_path} ({len(notebooks)} notebook(s) from one "
+                f"archive, {elapsed_s} s)"
             )
+            for x in indices:
+                results.append(
+                    {
+                        "local_path": str(notebook_paths.get("local_paths")[x]),
+                        "db_path": notebook_paths.get("db_paths")[x],
+                        "status": "SUCCESS",
+                        "elapsed_s": elapsed_s,
+                    }
+                )
+            changed.difference_update(indices)
+    return results, sorted(changed)
+
+
+def build_notebooks_archive(notebooks: list, archive_path: str) -> None:
+    """
+    Build a zip archive of notebook sources in archive_path - notebooks is a list
+    of (local path, path in the archive) pairs. The notebook header (see
+    NOTEBOOK_HEADERS) is added to the files which do not start with it, so that
+    all of them are imported as notebooks, as with format SOURCE.
+    """
+    with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for local_path, path_in_archive in notebooks:
+            with open(local_path, "rb") as f:
+                content = f.read()
+            header = NOTEBOOK_HEADERS[str(local_path).split(".")[-1]].encode()
+            if not content.startswith(header):
+                content = header + b"\n" + content
+            archive.writestr(path_in_archive, content)
+
+
+def plan_notebook_directories(db_paths: list, known_directories: set = None) -> list:
+    """
+    Reduce workspace notebook paths to the minimal list of directories which have
+    to be created.
+    workspace/mkdirs creates all missing parent directories, so only leaf
+    directories are kept - a directory that is an ancestor of another planned
+    directory, or that is already known to exist, is skipped.
+    """
+    known_directories = known_directories or set()
+    directories = {"/".join(path.split("/")[:-1]) for path in db_paths}
+    directories = sorted(
+        (d for d in directories if d and d not in known_directories),
+        key=lambda d: d.split("/"),
+    )
+    # after sorting by path components, descendants directly follow their ancestor
+    leaf_directories = []
+    for i, directory in enumerate(directories):
+        next_directory = directories[i + 1] if i + 1 < len(directories) else ""
+        if not next_directory.startswith(directory + "/"):
+            leaf_directories.append(directory)
+    return leaf_directories
+
+
+def create_notebook_directories(api_object: DatabricksRequest, db_paths: list) -> dict:
+    """
+    Create all of the workspace directories needed for the given notebook paths
+    (see create_notebook_directories_steps).
+    """
+    return run_steps(create_notebook_directories_steps(api_object, db_paths))
 
 
+@traced(name="create_notebook_directories")
+def create_notebook_directories_steps(api_object: DatabricksRequest, db_paths: list):
+    """
+    Create all of the workspace directories needed for the given notebook paths
+    using the fewest possible workspace/mkdirs calls (see plan_notebook_directories),
+    concurrently.
+    Returns the number of API calls made and saved compared to checking and
+    creating the directory of every notebook separately.
+    """
+    known_directories = {
+        path for host, path in known_workspace_directories if host == api_object.host
+    }
+    leaf_directories = plan_notebook_directories(db_paths, known_directories)
+    responses = yield Gather(
+        [Call(api_object.create_directory, d) for d in leaf_directories],
+        return_exceptions=True,
+    )
+    for directory, response in zip(leaf_directories, responses):
+        if isinstance(response, DatabricksAPIError):
+            print(
+                f"Directory {directory} was not created - error from API:\n{response}"
+            )
+            continue
+        if isinstance(response, Exception):
+            raise response
+        parts = directory.split("/")
+        for i in range(2, len(parts) + 1):
+            known_workspace_directories.add((api_object.host, "/".join(parts[:i])))
+    # previously: one get-status per notebook plus one mkdirs per missing directory
+    stats = {
+        "api_calls": len(leaf_directories),
+        "api_calls_saved": max(0, len(db_paths) - len(leaf_directories)),
+    }
+    print(
+        f"Workspace directories: {stats['api_calls']} mkdirs call(s) for "
+        f"{len(db_paths)} notebook(s), at least {stats['api_calls_saved']} "
+        f"call(s) saved."
+    )
+    return stats
+
+
+def stage_artifacts(
+    api_object: DatabricksRequest,
+    artifacts: dict,
+    manifest: DeployManifest,
+    force: bool = False,
+    max_parallel_uploads: int = 8,
+) -> list:
+    """
+    Upload artifacts ({local path: DBFS path}) to DBFS (see stage_artifacts_steps).
+    """
+    return run_steps(
+        stage_artifacts_steps(
+            api_object, artifacts, manifest, force, max_parallel_uploads
+        )
+    )
+
+
+@traced(name="stage_artifacts")
+def stage_artifacts_steps(
+    api_object: DatabricksRequest,
+    artifacts: dict,
+    manifest: DeployManifest,
+    force: bool = False,
+    max_parallel_uploads: int = 8,
+):
+    """
+    Upload artifacts ({local path: DBFS path}) to DBFS once per workspace, in
+    parallel, before any cluster work - the per-cluster steps only reference the
+    staged DBFS paths.
+    An artifact is not uploaded if it has already been staged by the current
+    process, or if it has not changed since the last deployment (see
+    DeployManifest) and the file on DBFS has the same size, unless force is set.
+    Returns DBFS paths of the uploaded artifacts; raises RuntimeError if any of the
+    uploads failed.
+    """
+
+    def stage(local_path: str, dbfs_path: str):
+        if (api_object.host, dbfs_path) in staged_dbfs_files:
+            return False
+        if (yield BlockingCall(manifest.is_unchanged, dbfs_path, local_path, force)):
+            file_status = yield Call(api_object.get_file_status_dbfs, dbfs_path)
+            if file_status is not None and file_status.get(
+                "file_size"
+            ) == os.path.getsize(local_path):
+                staged_dbfs_files.add((api_object.host, dbfs_path))
+                return False
+        yield Call(api_object.upload_file_dbfs, local_path, dbfs_path)
+        yield BlockingCall(manifest.record, dbfs_path, local_path)
+        staged_dbfs_files.add((api_object.host, dbfs_path))
+        return True
+
+    results = yield Gather(
+        [stage(*artifact) for artifact in artifacts.items()],
+        max_parallel=max_parallel_uploads,
+        return_exceptions=True,
+    )
+    errors = [
+        f"{dbfs_path}: {result!r}"
+        for dbfs_path, result in zip(artifacts.values(), results)
+        if isinstance(result, Exception)
+    ]
+    uploaded = [
+        dbfs_path
+        for dbfs_path, result in zip(artifacts.values(), results)
+        if result is True
+    ]
+    print(
+        f"Staged {len(artifacts)} artifact(s): {len(uploaded)} uploaded, "
+        f"{len(artifacts) - len(uploaded) - len(errors)} unchanged, "
+        f"{len(errors)} failed."
+    )
+    if errors:
+        raise RuntimeError("Staging of artifacts failed:\n" + "\n".join(errors))
+    return sorted(uploaded)
+
+
+@traced()
+def stage_artifacts_workflow(
+    cfg_path: str,
+    secret_path: str,
+    whl_files: str = None,
+    init_script_local_path: str = None,
+    wheelhouse_dir: str = None,
+    dbfs_target_dir: str = "dbfs:/FileStore/jars/",
+    init_script_dbfs_path: str = "dbfs:/databricks/scripts",
+    wheelhouse_dbfs_dir: str = DEFAULT_WHEELHOUSE_DBFS_DIR,
+    force: Union[bool, str] = False,
+):
+    """
+    Staging phase of a deployment: upload the wheels, the init script and the
+    wheelhouse of dependencies to DBFS at once, before process_dependencies,
+    process_all_packages and upload_init_script_workflow run in the same process -
+    these then find the artifacts already staged and only reference them.
+    """
+    databricks_token = read_token_from_file(secret_path)
+    cfg = read_env_cfg(ENVIRONMENT_NAME, cfg_path)
+    api_object = DatabricksRequest(cfg.get("databricks_host"), None, databricks_token)
+    manifest = get_manifest(api_object, cfg.get("deploy_manifest_path"))
+    artifacts = {}
+    if whl_files:
+        artifacts.update(get_wheel_dbfs_paths(whl_files.split(","), dbfs_target_dir))
+    if init_script_local_path:
+        artifacts[init_script_local_path] = get_init_script_dbfs_path(
+            init_script_local_path, init_script_dbfs_path
+        )
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        wheelhouse_future = None
+        if wheelhouse_dir and os.path.isdir(wheelhouse_dir):
+            wheelhouse_future = executor.submit(
+                upload_wheelhouse, api_object, wheelhouse_dir, wheelhouse_dbfs_dir
+            )
+        stage_artifacts(api_object, artifacts, manifest, parse_force_flag(force))
+        if wheelhouse_future is not None:
+            wheelhouse_future.result()
+    manifest.save()
+    manifest.print_summary()
+
+
+def get_wheel_dbfs_paths(whl_local_paths: list, dbfs_target_dir: str) -> dict:
+    """
+    Map local wheels to their DBFS paths ({local path: DBFS path}).
+    """
+    return {
+        whl_local_path: dbfs_target_dir + whl_local_path.split("/")[-1]
+        for whl_local_path in whl_local_paths
+    }
+
+
+def get_init_script_dbfs_path(
+    init_script_local_path: str, init_script_dbfs_path: str
+) -> str:
+    if init_script_dbfs_path[-1] != "/":
+        init_script_dbfs_path += "/"
+    return init_script_dbfs_path + init_script_local_path.split("/")[-1]
+
+
+@traced()
 def process_all_packages(
     cfg_path: str,
     secret_path: str,
     whl_files: str,
     dbfs_target_dir: str = "dbfs:/FileStore/jars/",
-) -> None:
+    max_parallel_clusters: Union[int, str] = 4,
+    force: Union[bool, str] = False,
+) -> dict:
     """
     Function for processing all packages in form of a .whl file in a repository.
     This function accepts list of packages in form of a string from sys.argv
     (arguments to cli) separated by a comma.
-    From this string, list of .whl files is recreated and each of those files is
-    processed using process_single_package function.
 
     Example of whl_files:
     whl_files = "test.whl,test1.whl"
+
+    The wheels are first uploaded to DBFS once for all of the clusters (see
+    stage_artifacts). Then they are deployed to each cluster together (see
+    deploy_packages_to_cluster_steps), so each cluster is restarted at most once
+    regardless of the number of wheels.
+    In case of multiple clusters specified in the cfg file, they are processed
+    concurrently (since processing is dependant on the cluster specification).
+    At most max_parallel_clusters clusters are processed at the same time - setting
+    it to 1 restores sequential processing.
+    Returns per-cluster results; raises RuntimeError if deployment failed on any of
+    the clusters.
+    """
+    databricks_token = read_token_from_file(secret_path)
+    cfg = read_env_cfg(ENVIRONMENT_NAME, cfg_path)
+    api_object = DatabricksRequest(cfg.get("databricks_host"), None, databricks_token)
+    manifest = get_manifest(api_object, cfg.get("deploy_manifest_path"))
+    cluster_api_objects = [
+        DatabricksRequest(cfg.get("databricks_host"), cluster, databricks_token)
+        for cluster in cfg.get("databricks_cluster_id")
+    ]
+    return run_steps(
+        process_all_packages_steps(
+            api_object,
+            cluster_api_objects,
+            get_wheel_dbfs_paths(whl_files.split(","), dbfs_target_dir),
+            manifest,
+            parse_force_flag(force),
+            int(max_parallel_clusters),
+        )
+    )
+
+
+def process_all_packages_steps(
+    api_object: DatabricksRequest,
+    cluster_api_objects: list,
+    staged_wheels: dict,
+    manifest: DeployManifest,
+    force: bool,
+    max_parallel_clusters: int,
+):
     """
-    whl_files = whl_files.split(",")
-    for whl_file in whl_files:
-        process_single_package(
-            cfg_path=cfg_path,
-            secret_path=secret_path,
-            whl_local_path=whl_file,
-            dbfs_target_dir=dbfs_target_dir,
+    Steps (see step_runner) of process_all_packages, shared with
+    databricks_api_async.process_all_packages_async.
+    """
+    yield from stage_artifacts_steps(api_object, staged_wheels, manifest, force)
+    max_parallel_clusters = max(1, min(max_parallel_clusters, len(cluster_api_objects)))
+    print(
+        f"Deploying {len(staged_wheels)} package(s) to {len(cluster_api_objects)} "
+        f"cluster(s), {max_parallel_clusters} at a time."
+    )
+    cluster_results = yield Gather(
+        [
+            deploy_packages_to_cluster_steps(
+                cluster_api_object, staged_wheels, manifest, force
+            )
+            for cluster_api_object in cluster_api_objects
+        ],
+        max_parallel=max_parallel_clusters,
+    )
+    results = {result["cluster"]: result for result in cluster_results}
+    report_cluster_results(results)
+    yield BlockingCall(manifest.save)
+    manifest.print_summary()
+    failed_clusters = [
+        cluster for cluster, result in results.items() if result["status"] != "SUCCESS"
+    ]
+    if failed_clusters:
+        raise RuntimeError(
+            f"Deployment of {','.join(staged_wheels)} failed on clusters: "
+            f"{failed_clusters}"
         )
+    return results
 
 
 def process_single_package(
-    cfg_path: str, secret_path: str, whl_local_path: str, dbfs_target_dir: str
-) -> None:
+    cfg_path: str,
+    secret_path: str,
+    whl_local_path: str,
+    dbfs_target_dir: str,
+    max_parallel_clusters: Union[int, str] = 4,
+    force: Union[bool, str] = False,
+) -> dict:
     """
-    The main workflow for installing an updated wheel package on databricks cluster.
-    Steps consist of:
+    Deploy a single wheel to all of the clusters (see process_all_packages).
+    """
+    return process_all_packages(
+        cfg_path=cfg_path,
+        secret_path=secret_path,
+        whl_files=whl_local_path,
+        dbfs_target_dir=dbfs_target_dir,
+        max_parallel_clusters=max_parallel_clusters,
+        force=force,
+    )
 
-    1. get host address and cluster id from json
-    2. start cluster
-    3. check if databricks_processing is installed on the cluster
-    4. uninstall current version of databricks_processing
-    5. restart the cluster
-    6. upload whl to dbfs; overwrite if exists
-    6. install wheel file
 
-    Prints are added whenever debugging would be useful.
-    In case of multiple clusters specified in the cfg file, script iterates over each
-    cluster (since processing is dependant on the cluster specification.).
+def deploy_packages_to_cluster(
+    host: str,
+    cluster: str,
+    databricks_token: str,
+    staged_wheels: dict,
+    manifest: DeployManifest,
+    force: bool = False,
+) -> dict:
     """
-    databricks_token = read_token_from_file(secret_path)
-    print(f"Databricks token: {databricks_token}")
-    cfg = read_env_cfg(ENVIRONMENT_NAME, cfg_path)
-    for cluster in cfg.get("databricks_cluster_id"):
-        api_object = DatabricksRequest(
-            cfg.get("databricks_host"), cluster, databricks_token
+    Run the whole deployment state machine of all of the wheels staged on DBFS for
+    a single cluster (see deploy_packages_to_cluster_steps).
+    """
+    api_object = DatabricksRequest(host, cluster, databricks_token)
+    return run_steps(
+        deploy_packages_to_cluster_steps(api_object, staged_wheels, manifest, force)
+    )
+
+
+@traced(
+    name="deploy_packages_to_cluster",
+    cluster=lambda arguments: arguments["api_object"].payload["cluster_id"],
+)
+def deploy_packages_to_cluster_steps(
+    api_object: DatabricksRequest,
+    staged_wheels: dict,
+    manifest: DeployManifest,
+    force: bool = False,
+):
+    """
+    Steps (see step_runner) of the whole deployment state machine of all of the
+    wheels staged on DBFS ({local path: DBFS path}, see stage_artifacts) for a
+    single cluster:
+
+    1. start the cluster if it is terminated
+    2. uninstall all of the stale versions of the wheels in one request (see
+    find_stale_libraries) and restart the cluster once
+    3. install all of the wheels in one request and wait until they are installed
+
+    Wheels already attached to the cluster from the same DBFS path are left out,
+    unless their content differs from the one installed on the cluster (see
+    find_outdated_wheels) or force is set - if all of them are, the cluster is not
+    touched at all. Wheels are recorded in the manifest as installed on the
+    cluster only when all of them have been installed.
+    It never raises - any error is captured in the returned result, so that one
+    failing cluster does not stop deployment to the other ones.
+    """
+    cluster = api_object.payload["cluster_id"]
+    started = time.monotonic()
+    result = {
+        "cluster": cluster,
+        "status": "SUCCESS",
+        "restarted": False,
+        "skipped": False,
+    }
+    try:
+        cluster_libraries = yield Call(api_object.get_cluster_libraries)
+        outdated_wheels = yield BlockingCall(
+            find_outdated_wheels,
+            staged_wheels,
+            cluster_libraries,
+            manifest,
+            cluster,
+            force,
         )
+        for whl_local_path, dbfs_path in staged_wheels.items():
+            if whl_local_path not in outdated_wheels:
+                print(
+                    f"[{cluster}] {dbfs_path} is already installed and identical "
+                    f"to {whl_local_path} - skipping"
+                )
+        if not outdated_wheels:
+            result["skipped"] = True
+            result["elapsed_s"] = round(time.monotonic() - started, 1)
+            return result
         current_cluster_status = api_object.check_current_cluster_status(
-            api_object.get_cluster_details()
+            (yield Call(api_object.get_cluster_details))
         )
         if current_cluster_status == "TERMINATED":
-            api_object.start_cluster()
-            time.sleep(5)
-        cluster_libraries = api_object.get_cluster_libraries()
-        # CAVEAT: searching for the processed package on the cluster
-        installed_libraries = api_object.extract_installed_libraries_names(
-            cluster_libraries
+            started_at = yield Call(api_object.get_events_baseline)
+            yield Call(api_object.start_cluster)
+            yield Call(api_object.wait_for_cluster_state, "RUNNING", since=started_at)
+            cluster_libraries = yield Call(api_object.get_cluster_libraries)
+        libraries_to_uninstall = find_stale_libraries(
+            outdated_wheels,
+            api_object.extract_installed_libraries_names(cluster_libraries),
         )
-        pattern = "[\W_]+"
-        package_alphanumeric = re.sub(pattern, "", api_object.package)
-        for installed_library in installed_libraries:
-            print(f"installed library: {installed_library}")
-            if "pypi" not in installed_library.keys():
-                installed_library_alphanumeric = re.sub(
-                    pattern, "", installed_library.get("whl")
-                )
-                print(
-                    f"package_alphanumeric: {package_alphanumeric}\n"
-                    f"installed_library_alphanumeric: {installed_library_alphanumeric}"
-                )
-                if package_alphanumeric in installed_library_alphanumeric:
-                    print(
-                        f"Specified library {installed_library} is installed on the cluster - "
-                        f"uninstalling and restarting the cluster"
-                    )
-                    api_object.uninstall_library(installed_library)
-                    api_object.restart_cluster()
-                    time.sleep(5)
-        while True:
-            current_cluster_status = api_object.check_current_cluster_status(
-                api_object.get_cluster_details()
+        if libraries_to_uninstall:
+            print(
+                f"[{cluster}] Specified libraries {libraries_to_uninstall} are "
+                f"installed on the cluster - uninstalling and restarting the cluster"
+            )
+            yield Call(api_object.uninstall_libraries, libraries_to_uninstall)
+            restarted_at = yield Call(api_object.get_events_baseline)
+            yield Call(api_object.restart_cluster)
+            result["restarted"] = True
+            yield Call(
+                api_object.wait_for_cluster_state,
+                "RUNNING",
+                since=restarted_at,
+                after_event="RESTARTING",
             )
-            if current_cluster_status != "RUNNING":
-                wait_interval = 10
-                print(
-                    f"Cluster must be running for installing Python package (whl file) "
-                    f"onto the cluster. Currently its status is: {current_cluster_status}."
-                    f"\nNext check of the cluster status is to be done in "
-                    f"{wait_interval} s."
-                )
-                time.sleep(wait_interval)
-            else:
-                break
-        dbfs_path = dbfs_target_dir + whl_local_path.split("/")[-1]
-        print(f"whl_local_path: {whl_local_path}\ndbfs_path: {dbfs_path}")
-        print(f"Uploading and installing Python package (whl file) onto the cluster.")
-        upload_output = api_object.upload_file_dbfs(whl_local_path, dbfs_path)
-        print(f"Upload output: {upload_output}; file was uploaded")
-        installation_output = api_object.install_whl(dbfs_path)
-        if installation_output == dict():
-            print(f"Package has been successfully installed.")
         else:
-            print(f"installation output: {installation_output}")
+            yield Call(api_object.wait_for_cluster_state, "RUNNING")
+        libraries_to_install = [
+            {"whl": staged_wheels[whl_local_path]} for whl_local_path in outdated_wheels
+        ]
+        installation_output = yield Call(
+            api_object.install_libraries, libraries_to_install
+        )
+        logger.debug(f"[{cluster}] installation output: {installation_output}")
+        report = yield from wait_for_libraries_steps(
+            [api_object], {cluster: libraries_to_install}
+        )
+        result["libraries"] = report
+        failed_libraries = [e for e in report if e["status"] != "INSTALLED"]
+        if failed_libraries:
+            raise RuntimeError(
+                "Installation failed: "
+                + "; ".join(
+                    f"{e['library']} ended with status {e['status']}: {e['messages']}"
+                    for e in failed_libraries
+                )
+            )
+        for whl_local_path in outdated_wheels:
+            yield BlockingCall(
+                manifest.record_installed,
+                cluster,
+                staged_wheels[whl_local_path],
+                whl_local_path,
+            )
+        print(f"[{cluster}] {len(libraries_to_install)} package(s) installed.")
+    except Exception as e:
+        result["status"] = "FAILED"
+        result["error"] = repr(e)
+    result["elapsed_s"] = round(time.monotonic() - started, 1)
+    return result
+
+
+def find_outdated_wheels(
+    staged_wheels: dict,
+    cluster_libraries: dict,
+    manifest: DeployManifest,
+    cluster_id: str,
+    force: bool = False,
+) -> list:
+    """
+    Find staged wheels ({local path: DBFS path}) which have to be installed on the
+    cluster: all of them if force is set, otherwise those not attached to the
+    cluster from their DBFS path and those whose content differs from the one
+    last installed on the cluster according to the manifest - a cluster keeps the
+    content of a wheel from the time it was installed, even if the file on DBFS is
+    overwritten.
+    """
+    return [
+        whl_local_path
+        for whl_local_path, dbfs_path in staged_wheels.items()
+        if force
+        or not is_wheel_attached(cluster_libraries, dbfs_path)
+        or not manifest.is_installed(cluster_id, dbfs_path, whl_local_path)
+    ]
+
+
+def is_wheel_attached(cluster_libraries: dict, dbfs_path: str) -> bool:
+    """
+    Check if the wheel from dbfs_path is attached to the cluster and is not failed
+    or scheduled for uninstallation.
+    """
+    attached_statuses = ["INSTALLED", "INSTALLING", "RESOLVING", "PENDING"]
+    return any(
+        library_status.get("library", {}).get("whl") == dbfs_path
+        and library_status.get("status") in attached_statuses
+        for library_status in cluster_libraries.get("library_statuses", [])
+    )
+
+
+def report_cluster_results(results: dict) -> None:
+    """
+    Print a per-cluster summary of a deployment.
+    """
+    print("Deployment summary:")
+    for cluster, result in results.items():
+        line = (
+            f"  {cluster}: {result['status']} in {result['elapsed_s']} s"
+            f" (restarted: {result.get('restarted')},"
+            f" skipped as unchanged: {result.get('skipped')})"
+        )
+        if result.get("error"):
+            line += f" - {result['error']}"
+        print(line)
 
 
+@lru_cache(maxsize=None)
 def read_token_from_file(file: str) -> str:
     """
     Read databricks_token from a file (provided in secrets.txt).
+    The file is read only once per process.
     """
     with open(file, "r") as f:
         databricks_token = f.read().replace("\n", "")
     return databricks_token
 
 
-def process_dependencies(cfg_path: str, secret_path: str, requirements_variable: str):
+def wheel_distribution_name(whl_path: str) -> str:
+    """
+    Normalized distribution name from the name of a wheel file
+    (<distribution>-<version>-<python tag>-<abi tag>-<platform tag>.whl).
+    """
+    return canonicalize_name(whl_path.split("/")[-1].split("-")[0])
+
+
+def find_stale_libraries(whl_local_paths: list, installed_libraries: list) -> list:
+    """
+    Find whl libraries installed on a cluster which are versions (the same
+    distribution, any version or path) of any of the deployed wheels.
+    """
+    distribution_names = {
+        wheel_distribution_name(whl_local_path) for whl_local_path in whl_local_paths
+    }
+    stale_libraries = []
+    for installed_library in installed_libraries:
+        logger.debug(f"installed library: {installed_library}")
+        if (
+            "whl" in installed_library.keys()
+            and wheel_distribution_name(installed_library["whl"]) in distribution_names
+        ):
+            stale_libraries.append(installed_library)
+    return stale_libraries
+
+
+@traced()
+def process_dependencies(
+    cfg_path: str,
+    secret_path: str,
+    requirements_variable: str,
+    wheelhouse_dir: str = None,
+    wheelhouse_dbfs_dir: str = DEFAULT_WHEELHOUSE_DBFS_DIR,
+):
     """
     Install dependencies found in the repository on the clusters specified in
     config.json.
+    Requirements from all of the files are merged into a single de-duplicated set
+    (see requirements_lock.RequirementsLock) and installed on each cluster with
+    a single request. The workflow waits until all of the libraries
+    are installed and prints how long it took for each of them.
+    If wheelhouse_dir (built with process_requirements_locally.build_wheelhouse)
+    is given, its wheels are uploaded to DBFS (see upload_wheelhouse) and no
+    libraries are installed - the dependencies are installed from the wheelhouse
+    by the init script of the clusters (see
+    create_init_script.build_wheelhouse_script_content) in a single pip run,
+    so clusters which have not been restarted since the wheelhouse changed are
+    restarted.
     """
     databricks_token = read_token_from_file(secret_path)
     cfg = read_env_cfg(ENVIRONMENT_NAME, cfg_path)
-    requirements_files = requirements_variable.split(",")
-    for cluster in cfg.get("databricks_cluster_id"):
-        api_object = DatabricksRequest(
-            cfg.get("databricks_host"), cluster, databricks_token
+    libraries_to_install, wheelhouse_updated_at = get_dependencies(
+        DatabricksRequest(cfg.get("databricks_host"), None, databricks_token),
+        requirements_variable,
+        wheelhouse_dir,
+        wheelhouse_dbfs_dir,
+    )
+    api_objects = [
+        DatabricksRequest(cfg.get("databricks_host"), cluster, databricks_token)
+        for cluster in cfg.get("databricks_cluster_id")
+    ]
+    run_steps(
+        process_dependencies_steps(
+            api_objects, libraries_to_install, wheelhouse_updated_at
         )
-        current_cluster_status = api_object.check_current_cluster_status(
-            api_object.get_cluster_details()
+    )
+
+
+def get_dependencies(
+    api_object: DatabricksRequest,
+    requirements_variable: str,
+    wheelhouse_dir: str = None,
+    wheelhouse_dbfs_dir: str = DEFAULT_WHEELHOUSE_DBFS_DIR,
+) -> tuple:
+    """
+    Return library specs of the dependencies to be installed on the clusters and
+    the time (epoch timestamp in ms, in the clock of the server) the wheelhouse
+    on DBFS was last changed:
+    - if wheelhouse_dir exists, it is uploaded (see upload_wheelhouse) and there
+    are no libraries to install - the init script installs the dependencies
+    - otherwise the merged requirements are installed from PyPI and the time is
+    None
+    """
+    if wheelhouse_dir and not os.path.isdir(wheelhouse_dir):
+        print(f"Wheelhouse {wheelhouse_dir} does not exist - installing from PyPI")
+        wheelhouse_dir = None
+    if wheelhouse_dir:
+        return [], upload_wheelhouse(api_object, wheelhouse_dir, wheelhouse_dbfs_dir)
+    requirements_files = requirements_variable.split(",")
+    libraries_to_install = [
+        build_library_spec(requirement)
+        for requirement in lock_requirements(requirements_files).requirements
+    ]
+    print(f"Libraries to be installed on the clusters: {libraries_to_install}")
+    return libraries_to_install, None
+
+
+def last_restarted_time(cluster_details: dict) -> int:
+    """
+    Time (epoch timestamp in ms) the cluster was last started or restarted, i.e.
+    its init script was last run.
+    """
+    return cluster_details.get("last_restarted_time") or cluster_details.get(
+        "start_time", 0
+    )
+
+
+def process_dependencies_steps(
+    api_objects: list, libraries_to_install: list, wheelhouse_updated_at: int = None
+):
+    """
+    Steps (see step_runner) of process_dependencies, shared with
+    databricks_api_async.process_dependencies_async - the clusters are started
+    (or restarted, if the wheelhouse changed after their last restart), awaited and
+    polled for library statuses concurrently.
+    """
+
+    def prepare_cluster(api_object):
+        cluster = api_object.payload["cluster_id"]
+        try:
+            cluster_details = yield Call(api_object.get_cluster_details)
+            current_cluster_status = api_object.check_current_cluster_status(
+                cluster_details
+            )
+            started_at, after_event = None, None
+            if current_cluster_status == "TERMINATED":
+                started_at = yield Call(api_object.get_events_baseline)
+                yield Call(api_object.start_cluster)
+            elif (
+                current_cluster_status == "RUNNING"
+                and wheelhouse_updated_at is not None
+                and last_restarted_time(cluster_details) < wheelhouse_updated_at
+            ):
+                print(
+                    f"[{cluster}] The wheelhouse changed after the last restart - "
+                    f"restarting the cluster, so that its init script installs "
+                    f"the dependencies"
+                )
+                started_at = yield Call(api_object.get_events_baseline)
+                yield Call(api_object.restart_cluster)
+                after_event = "RESTARTING"
+            state = yield Call(
+                api_object.wait_for_cluster_state,
+                "RUNNING",
+                since=started_at,
+                after_event=after_event,
+            )
+        except Exception as e:
+            print(f"[{cluster}] cluster is not running: {e}")
+            return e
+        if libraries_to_install:
+            try:
+                response = yield Call(
+                    api_object.install_libraries, libraries_to_install
+                )
+            except Exception as e:
+                print(f"[{cluster}] libraries were not installed: {e}")
+                return e
+            logger.debug(f"[{cluster}] response: {response}")
+        return state
+
+    cluster_states = yield Gather(prepare_cluster(a) for a in api_objects)
+    # libraries are not awaited on clusters which are not running or on which
+    # they could not be installed
+    running_api_objects = [
+        api_object
+        for api_object, state in zip(api_objects, cluster_states)
+        if state == "RUNNING"
+    ]
+    report = yield from wait_for_libraries_steps(
+        running_api_objects,
+        {
+            api_object.payload["cluster_id"]: libraries_to_install
+            for api_object in api_objects
+        },
+    )
+    print_libraries_report(report)
+    failed_libraries = [entry for entry in report if entry["status"] != "INSTALLED"]
+    if failed_libraries or len(running_api_objects) < len(api_objects):
+        raise RuntimeError(
+            f"{len(failed_libraries)} library installation(s) did not succeed, "
+            f"{len(api_objects) - len(running_api_objects)} cluster(s) not running "
+            f"or without installed libraries"
         )
-        if current_cluster_status == "TERMINATED":
-            api_object.start_cluster()
-            time.sleep(5)
-        libraries_to_install = []
-        for file in requirements_files:
-            with open(file, "r") as f:
-                for line in f.readlines():
-                    library_to_install = "".join(line.split())
-                    libraries_to_install.append(library_to_install)
-        for library_to_install in libraries_to_install:
-            print(f"Library to be installed on the cluster: {library_to_install}")
-            response = api_object.install_library_pip(library_to_install)
-            print(f"response: {response}")
+
+
+@traced()
+def upload_wheelhouse(
+    api_object: DatabricksRequest,
+    wheelhouse_dir: str,
+    wheelhouse_dbfs_dir: str = DEFAULT_WHEELHOUSE_DBFS_DIR,
+    max_parallel_uploads: int = 8,
+) -> list:
+    """
+    Upload wheels from a local wheelhouse to a content-addressed DBFS directory:
+    each wheel is stored as <wheelhouse_dbfs_dir>/<sha256 of the wheel>/<wheel name>,
+    so a wheel which already exists on DBFS is never uploaded again (e.g. by
+    repeated deployments or by other projects using the same dependencies).
+    The wheelhouse index (index.html, usable as `pip --find-links`) is updated
+    with links to all of the wheels.
+    Returns the time (epoch timestamp in ms, in the clock of the server) the index
+    was last changed.
+    """
+    if wheelhouse_dbfs_dir[-1] != "/":
+        wheelhouse_dbfs_dir += "/"
+    wheels = sorted(
+        os.path.join(wheelhouse_dir, file)
+        for file in os.listdir(wheelhouse_dir)
+        if file.endswith(".whl")
+    )
+
+    def upload_wheel(wheel: str) -> tuple:
+        relative_path = f"{file_sha256(wheel)}/{os.path.basename(wheel)}"
+        dbfs_path = wheelhouse_dbfs_dir + relative_path
+        if (api_object.host, dbfs_path) in staged_dbfs_files:
+            return relative_path, False
+        is_uploaded = api_object.get_file_status_dbfs(dbfs_path) is None
+        if is_uploaded:
+            api_object.upload_file_dbfs(wheel, dbfs_path)
+        staged_dbfs_files.add((api_object.host, dbfs_path))
+        return relative_path, is_uploaded
+
+    with ThreadPoolExecutor(max_workers=max_parallel_uploads) as executor:
+        uploads = list(executor.map(upload_wheel, wheels))
+    uploaded = sum(1 for _, is_uploaded in uploads if is_uploaded)
+    print(
+        f"Wheelhouse {wheelhouse_dbfs_dir}: {uploaded} wheel(s) uploaded, "
+        f"{len(uploads) - uploaded} already cached"
+    )
+    # regenerated every time - wheels may be cached while the index is missing them
+    update_wheelhouse_index(
+        api_object, wheelhouse_dbfs_dir, [path for path, _ in uploads]
+    )
+    return api_object.get_file_status_dbfs(wheelhouse_dbfs_dir + "index.html")[
+        "modification_time"
+    ]
+
+
+def update_wheelhouse_index(
+    api_object: DatabricksRequest, wheelhouse_dbfs_dir: str, relative_paths: list
+) -> None:
+    """
+    Add links to the wheels to the wheelhouse index (index.html), keeping the links
+    to the wheels uploaded by the previous deployments. The index is uploaded only
+    if it changed, so its modification time tells when the wheelhouse changed.
+    """
+    index_path = wheelhouse_dbfs_dir + "index.html"
+    content = api_object.read_file_dbfs(index_path) or b""
+    links = set(re.findall(r'href="([^"]+)"', content.decode()))
+    links.update(relative_paths)
+    index = "<html><body>\n"
+    for link in sorted(links):
+        index += f'<a href="{link}">{link.split("/")[-1]}</a><br>\n'
+    index += "</body></html>\n"
+    if index.encode() == content:
+        return
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        local_index = os.path.join(tmp_dir, "index.html")
+        with open(local_index, "w") as f:
+            f.write(index)
+        api_object.upload_file_dbfs(local_index, index_path)
+
+
+def build_library_spec(requirement: str) -> dict:
+    """
+    Build a library specification accepted by libraries/install - wheel files are
+    installed as whl libraries, everything else as PyPI packages.
+    """
+    if requirement.endswith(".whl"):
+        return {"whl": requirement}
+    return {"pypi": {"package": requirement}}
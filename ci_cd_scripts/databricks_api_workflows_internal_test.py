@@ -0,0 +1,311 @@
+import zipfile
+
+import pytest
+
+from databricks_api_class_internal import StreamingImportBody
+from databricks_api_workflows_internal import (
+    discover_notebooks,
+    find_outdated_wheels,
+    find_stale_libraries,
+    import_notebook_archives_steps,
+    plan_notebook_directories,
+    process_dependencies_steps,
+    wheel_distribution_name,
+)
+from deploy_manifest import DeployManifest
+from request_executor import InvalidRequestError
+from step_runner import run_steps
+
+
+def test_plan_notebook_directories_keeps_only_leaf_directories():
+    db_paths = [
+        "/deployed/notebooks/a/b/c/notebook1",
+        "/deployed/notebooks/a/b/notebook2",
+        "/deployed/notebooks/a/b/notebook3",
+        "/deployed/notebooks/d/notebook4",
+    ]
+    assert plan_notebook_directories(db_paths) == [
+        "/deployed/notebooks/a/b/c",
+        "/deployed/notebooks/d",
+    ]
+
+
+def test_plan_notebook_directories_does_not_treat_name_prefix_as_ancestor():
+    db_paths = ["/notebooks/a/notebook1", "/notebooks/ab/notebook2"]
+    assert plan_notebook_directories(db_paths) == ["/notebooks/a", "/notebooks/ab"]
+
+
+def test_plan_notebook_directories_skips_known_directories():
+    db_paths = ["/notebooks/a/b/notebook1", "/notebooks/c/notebook2"]
+    known_directories = {"/notebooks/c"}
+    assert plan_notebook_directories(db_paths, known_directories) == [
+        "/notebooks/a/b"
+    ]
+
+
+def test_plan_notebook_directories_without_directories():
+    assert plan_notebook_directories([]) == []
+    assert plan_notebook_directories(["/notebook1"]) == []
+
+
+def test_wheel_distribution_name_is_normalized():
+    assert (
+        wheel_distribution_name("dbfs:/FileStore/jars/My_Package-0.1-py3-none-any.whl")
+        == "my-package"
+    )
+    assert wheel_distribution_name("other.pkg-2.0-cp310-cp310-linux_x86_64.whl") == (
+        "other-pkg"
+    )
+
+
+def test_find_stale_libraries_matches_any_version_and_path_of_deployed_wheels():
+    installed_libraries = [
+        {"whl": "dbfs:/FileStore/jars/my_package-0.1-py3-none-any.whl"},
+        {"whl": "dbfs:/old/jars/My_Package-0.0.9-py3-none-any.whl"},
+        {"whl": "dbfs:/FileStore/jars/unrelated-1.0-py3-none-any.whl"},
+        {"pypi": {"package": "other_package"}},
+        {"jar": "dbfs:/FileStore/jars/my_package-0.1.jar"},
+    ]
+    stale_libraries = find_stale_libraries(
+        [
+            "dist/my_package-0.2-py3-none-any.whl",
+            "dist/other_package-1.0-py3-none-any.whl",
+        ],
+        installed_libraries,
+    )
+    assert stale_libraries == installed_libraries[:2]
+
+
+def test_find_stale_libraries_without_installed_libraries():
+    assert find_stale_libraries(["dist/my_package-0.2-py3-none-any.whl"], []) == []
+
+
+class FakeApiObject:
+    def __init__(self) -> None:
+        self.uploads = []
+
+    def upload_file_dbfs(self, file_local_path: str, dbfs_path: str) -> None:
+        self.uploads.append(dbfs_path)
+
+
+def make_staged_wheels(tmp_path) -> dict:
+    staged_wheels = {}
+    for name in ["a-0.1-py3-none-any.whl", "b-0.1-py3-none-any.whl"]:
+        wheel = tmp_path / name
+        wheel.write_bytes(name.encode())
+        staged_wheels[str(wheel)] = f"dbfs:/FileStore/jars/{name}"
+    return staged_wheels
+
+
+def cluster_libraries(dbfs_paths: list, status: str = "INSTALLED") -> dict:
+    return {
+        "library_statuses": [
+            {"library": {"whl": dbfs_path}, "status": status}
+            for dbfs_path in dbfs_paths
+        ]
+    }
+
+
+def test_find_outdated_wheels_skips_attached_wheels_installed_with_same_content(
+    tmp_path,
+):
+    staged_wheels = make_staged_wheels(tmp_path)
+    manifest = DeployManifest(FakeApiObject())
+    for whl_local_path, dbfs_path in staged_wheels.items():
+        manifest.record_installed("cluster-1", dbfs_path, whl_local_path)
+    libraries = cluster_libraries(list(staged_wheels.values()))
+    assert find_outdated_wheels(staged_wheels, libraries, manifest, "cluster-1") == []
+    assert find_outdated_wheels(
+        staged_wheels, libraries, manifest, "cluster-1", force=True
+    ) == list(staged_wheels)
+
+
+def test_find_outdated_wheels_finds_changed_detached_and_unrecorded_wheels(tmp_path):
+    staged_wheels = make_staged_wheels(tmp_path)
+    (wheel_a, dbfs_path_a), (wheel_b, dbfs_path_b) = staged_wheels.items()
+    manifest = DeployManifest(FakeApiObject())
+    manifest.record_installed("cluster-1", dbfs_path_a, wheel_a)
+    manifest.record_installed("cluster-1", dbfs_path_b, wheel_b)
+    # a rebuilt wheel staged under the same DBFS path
+    with open(wheel_a, "ab") as f:
+        f.write(b"changed")
+    libraries = cluster_libraries([dbfs_path_a, dbfs_path_b])
+    assert find_outdated_wheels(staged_wheels, libraries, manifest, "cluster-1") == [
+        wheel_a
+    ]
+    # nothing has been recorded for cluster-2
+    assert find_outdated_wheels(
+        staged_wheels, libraries, manifest, "cluster-2"
+    ) == list(staged_wheels)
+    # wheels which are not attached (or are being uninstalled) are outdated
+    assert find_outdated_wheels(
+        staged_wheels,
+        cluster_libraries([dbfs_path_b], "UNINSTALL_ON_RESTART"),
+        manifest,
+        "cluster-1",
+    ) == list(staged_wheels)
+
+
+def test_installed_wheels_are_kept_in_saved_manifest(tmp_path):
+    staged_wheels = make_staged_wheels(tmp_path)
+    whl_local_path, dbfs_path = next(iter(staged_wheels.items()))
+    local_path = str(tmp_path / "manifest.json")
+    api_object = FakeApiObject()
+    manifest = DeployManifest(api_object, local_path=local_path)
+    manifest.record_installed("cluster-1", dbfs_path, whl_local_path)
+    manifest.save()
+    assert api_object.uploads == [manifest.dbfs_path]
+    loaded = DeployManifest(api_object, local_path=local_path).load()
+    assert loaded.is_installed("cluster-1", dbfs_path, whl_local_path)
+    assert not loaded.is_installed("cluster-2", dbfs_path, whl_local_path)
+
+
+class FakeWorkspace:
+    host = "https://workspace/"
+
+    def __init__(self, existing_directories: set) -> None:
+        self.existing_directories = set(existing_directories)
+        self.calls = []
+        self.archives = {}
+
+    def check_if_notebook_dir_exists(self, path: str) -> dict:
+        self.calls.append(("get-status", path))
+        if path in self.existing_directories:
+            return {"object_type": "DIRECTORY"}
+        return {"error_code": "RESOURCE_DOES_NOT_EXIST"}
+
+    def archive_import_body(self, archive_path: str, path: str):
+        self.calls.append(("build", path))
+        return StreamingImportBody(archive_path, path=path, format="AUTO")
+
+    def delete_workspace_path(self, path: str) -> dict:
+        self.calls.append(("delete", path))
+        self.existing_directories.discard(path)
+        return {}
+
+    def create_directory(self, path: str) -> dict:
+        self.calls.append(("mkdirs", path))
+        return {}
+
+    def import_archive(self, archive_path: str, path: str) -> dict:
+        self.calls.append(("import", path))
+        with zipfile.ZipFile(archive_path) as archive:
+            self.archives[path] = sorted(archive.namelist())
+        return {}
+
+
+def make_notebooks(tmp_path, names: list) -> dict:
+    notebook_paths = {"local_paths": [], "db_paths": []}
+    for name in names:
+        notebook = tmp_path / name
+        notebook.parent.mkdir(parents=True, exist_ok=True)
+        notebook.write_text("print(1)\n")
+        notebook_paths["local_paths"].append(notebook)
+        notebook_paths["db_paths"].append(f"/deployed/notebooks/{name}")
+    return notebook_paths
+
+
+def test_discover_notebooks_keeps_file_extensions(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    make_notebooks(tmp_path / "notebooks", ["a/nb.py", "a/nb.sql"])
+    notebook_paths = discover_notebooks("notebooks", "/deployed/notebooks/")
+    assert sorted(notebook_paths["db_paths"]) == [
+        "/deployed/notebooks/notebooks/a/nb.py",
+        "/deployed/notebooks/notebooks/a/nb.sql",
+    ]
+
+
+def test_import_notebook_archives_skips_existing_directories_without_building(
+    tmp_path,
+):
+    notebook_paths = make_notebooks(tmp_path, ["a/nb1.py", "a/nb2.sql"])
+    api_object = FakeWorkspace({"/deployed/notebooks/a"})
+    results, changed = run_steps(
+        import_notebook_archives_steps(
+            api_object, notebook_paths, [0], "/deployed/notebooks/"
+        )
+    )
+    assert (results, changed) == ([], [0])
+    assert api_object.calls == [("get-status", "/deployed/notebooks/a")]
+
+
+def test_import_notebook_archives_replaces_directories(tmp_path):
+    notebook_paths = make_notebooks(tmp_path, ["a/nb1.py", "a/b/nb2.sql", "nb3.py"])
+    api_object = FakeWorkspace({"/deployed/notebooks/a"})
+    results, changed = run_steps(
+        import_notebook_archives_steps(
+            api_object,
+            notebook_paths,
+            [0, 2],
+            "/deployed/notebooks/",
+            replace_directories=True,
+        )
+    )
+    assert [call[0] for call in api_object.calls] == [
+        "get-status",
+        "build",
+        "delete",
+        "mkdirs",
+        "import",
+    ]
+    assert api_object.archives == {"/deployed/notebooks/a": ["b/nb2.sql", "nb1.py"]}
+    # the unchanged notebook of the deleted directory has been imported as well
+    assert sorted(result["db_path"] for result in results) == [
+        "/deployed/notebooks/a/b/nb2.sql",
+        "/deployed/notebooks/a/nb1.py",
+    ]
+    assert changed == [2]
+
+
+def test_import_notebook_archives_skips_notebooks_differing_in_extension(tmp_path):
+    notebook_paths = make_notebooks(tmp_path, ["a/nb.py", "a/nb.sql"])
+    api_object = FakeWorkspace(set())
+    results, changed = run_steps(
+        import_notebook_archives_steps(
+            api_object, notebook_paths, [0, 1], "/deployed/notebooks/"
+        )
+    )
+    assert (results, changed, api_object.calls) == ([], [0, 1], [])
+
+
+class FakeCluster:
+    def __init__(self, cluster_id: str, install_error: Exception = None) -> None:
+        self.payload = {"cluster_id": cluster_id}
+        self.install_error = install_error
+        self.installed = []
+
+    def get_cluster_details(self) -> dict:
+        return {"state": "RUNNING"}
+
+    def check_current_cluster_status(self, cluster_details: dict) -> str:
+        return cluster_details["state"]
+
+    def wait_for_cluster_state(self, state: str, since=None, after_event=None):
+        return state
+
+    def install_libraries(self, libraries: list) -> dict:
+        if self.install_error is not None:
+            raise self.install_error
+        self.installed = libraries
+        return {}
+
+    def get_cluster_libraries(self) -> dict:
+        return {
+            "library_statuses": [
+                {"library": library, "status": "INSTALLED"}
+                for library in self.installed
+            ]
+        }
+
+
+def test_process_dependencies_reports_libraries_of_other_clusters_on_errors(capsys):
+    libraries = [{"pypi": {"package": "requests"}}]
+    api_objects = [
+        FakeCluster("cluster-1"),
+        FakeCluster("cluster-2", InvalidRequestError("libraries/install", 400)),
+    ]
+    with pytest.raises(RuntimeError, match="1 cluster\\(s\\) not running"):
+        run_steps(process_dependencies_steps(api_objects, libraries))
+    output = capsys.readouterr().out
+    assert "[cluster-2] libraries were not installed" in output
+    assert "[cluster-1] INSTALLED" in output
@@ -0,0 +1,188 @@
+import os
+import json
+import tempfile
+import threading
+from typing import TYPE_CHECKING, Union
+
+from file_hashing import file_sha256
+
+if TYPE_CHECKING:
+    from databricks_api_class_internal import DatabricksRequest
+
+
+DEFAULT_MANIFEST_DBFS_PATH = "dbfs:/FileStore/deploy_manifest.json"
+# optional local copy of the manifest, e.g. in a cached pipeline directory
+MANIFEST_LOCAL_PATH = os.environ.get("DEPLOY_MANIFEST_LOCAL_PATH")
+
+# manifests shared by all of the workflows in the current process, per (host, path)
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def parse_force_flag(force: Union[bool, str]) -> bool:
+    """
+    Parse the force flag which comes either as a bool or as a string from the CLI.
+    """
+    if isinstance(force, bool):
+        return force
+    return str(force).lower() in ("true", "1", "yes", "force", "--force")
+
+
+class DeployManifest:
+    """
+    Manifest of content hashes of the artifacts deployed to a Databricks workspace
+    (notebooks, wheels, init scripts), keyed by their target path.
+    It is stored as a sidecar JSON file on DBFS (and optionally copied to a local
+    file), so that the workflows upload only the artifacts that have changed since
+    the last deployment.
+    It also records the hashes of the wheels successfully installed on each
+    cluster, so that a cluster which still has an older content of a wheel (e.g.
+    its deployment failed) gets it installed again.
+    """
+
+    def __init__(
+        self,
+        api_object: "DatabricksRequest",
+        dbfs_path: str = DEFAULT_MANIFEST_DBFS_PATH,
+        local_path: str = MANIFEST_LOCAL_PATH,
+    ) -> None:
+        self.api_object = api_object
+        self.dbfs_path = dbfs_path
+        self.local_path = local_path
+        self.hashes = {}
+        # cluster id -> {DBFS path of a wheel: sha256 of the installed wheel}
+        self.installed = {}
+        self.uploaded = set()
+        self.skipped = set()
+        self._modified = False
+        self._lock = threading.Lock()
+        # held for the whole save, so that an older snapshot is never uploaded
+        # after a newer one by concurrent workflows sharing the manifest
+        self._save_lock = threading.Lock()
+
+    def load(self) -> "DeployManifest":
+        """
+        Load the manifest from the local file (if it exists) or from DBFS.
+        """
+        content = None
+        if self.local_path and os.path.exists(self.local_path):
+            with open(self.local_path, "rb") as f:
+                content = f.read()
+        else:
+            content = self.api_object.read_file_dbfs(self.dbfs_path)
+        if content:
+            content = json.loads(content)
+            self.hashes = content.get("hashes", {})
+            self.installed = content.get("installed", {})
+        print(f"Deploy manifest {self.dbfs_path}: {len(self.hashes)} known artifacts")
+        return self
+
+    def save(self) -> None:
+        """
+        Write the manifest to DBFS and to the local file (if specified).
+        Nothing is written if no deployment has been recorded since the last save.
+        Concurrent saves are serialized - the last one uploads the latest state.
+        """
+        with self._save_lock:
+            with self._lock:
+                if not self._modified:
+                    return
+                self._modified = False
+                content = json.dumps(
+                    {"hashes": self.hashes, "installed": self.installed},
+                    indent=1,
+                    sort_keys=True,
+                )
+            local_path = self.local_path
+            if local_path is None:
+                fd, local_path = tempfile.mkstemp(suffix=".json")
+                os.close(fd)
+            try:
+                with open(local_path, "w") as f:
+                    f.write(content)
+                self.api_object.upload_file_dbfs(local_path, self.dbfs_path)
+            except Exception:
+                with self._lock:
+                    self._modified = True
+                raise
+            finally:
+                if self.local_path is None:
+                    os.remove(local_path)
+
+    def is_unchanged(
+        self, target_path: str, file_local_path: str, force: bool = False
+    ) -> bool:
+        """
+        Check if the local file is identical to the one deployed to target_path.
+        It is always False when force is set.
+        If the file is unchanged, it is counted as skipped.
+        The manifest does not know if the deployed file still exists - DBFS
+        artifacts are skipped only if dbfs/get-status confirms it as well (see
+        databricks_api_workflows_internal.stage_artifacts_steps).
+        """
+        if force:
+            return False
+        unchanged = self.hashes.get(target_path) == file_sha256(file_local_path)
+        if unchanged:
+            with self._lock:
+                self.skipped.add(target_path)
+        return unchanged
+
+    def record(self, target_path: str, file_local_path: str) -> None:
+        """
+        Record that the local file has been deployed to target_path.
+        """
+        sha256 = file_sha256(file_local_path)
+        with self._lock:
+            self.hashes[target_path] = sha256
+            self.uploaded.add(target_path)
+            self.skipped.discard(target_path)
+            self._modified = True
+
+    def is_installed(
+        self, cluster_id: str, dbfs_path: str, file_local_path: str
+    ) -> bool:
+        """
+        Check if the local wheel is identical to the one last installed on the
+        cluster from dbfs_path (see record_installed).
+        """
+        with self._lock:
+            installed = self.installed.get(cluster_id, {}).get(dbfs_path)
+        return installed == file_sha256(file_local_path)
+
+    def record_installed(
+        self, cluster_id: str, dbfs_path: str, file_local_path: str
+    ) -> None:
+        """
+        Record that the local wheel has been installed on the cluster from
+        dbfs_path - only after the installation succeeded.
+        """
+        sha256 = file_sha256(file_local_path)
+        with self._lock:
+            self.installed.setdefault(cluster_id, {})[dbfs_path] = sha256
+            self._modified = True
+
+    def print_summary(self) -> None:
+        print(
+            f"Deploy manifest summary: {len(self.uploaded)} uploaded, "
+            f"{len(self.skipped)} skipped as unchanged."
+        )
+        for target_path in sorted(self.uploaded):
+            print(f"  uploaded: {target_path}")
+        for target_path in sorted(self.skipped):
+            print(f"  skipped:  {target_path}")
+
+
+def get_manifest(
+    api_object: "DatabricksRequest", dbfs_path: str = None
+) -> DeployManifest:
+    """
+    Return the manifest for a given workspace, loading it on the first call.
+    The manifest is shared by all the workflows run in the current process.
+    """
+    dbfs_path = dbfs_path or DEFAULT_MANIFEST_DBFS_PATH
+    key = (api_object.host, dbfs_path)
+    with _manifests_lock:
+        if key not in _manifests:
+            _manifests[key] = DeployManifest(api_object, dbfs_path).load()
+        return _manifests[key]
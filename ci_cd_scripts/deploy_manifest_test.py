@@ -0,0 +1,68 @@
+import json
+import threading
+
+import pytest
+
+from deploy_manifest import DeployManifest
+
+
+class BlockingUploadApiObject:
+    """
+    Records uploaded manifests - the first upload waits until it is released.
+    """
+
+    def __init__(self) -> None:
+        self.uploads = []
+        self.first_upload_started = threading.Event()
+        self.release_first_upload = threading.Event()
+
+    def upload_file_dbfs(self, file_local_path: str, dbfs_path: str) -> None:
+        with open(file_local_path) as f:
+            content = json.load(f)
+        if not self.first_upload_started.is_set():
+            self.first_upload_started.set()
+            self.release_first_upload.wait(5)
+        self.uploads.append(content)
+
+
+def make_file(tmp_path, name: str) -> str:
+    path = tmp_path / name
+    path.write_text(name)
+    return str(path)
+
+
+def test_concurrent_saves_upload_the_latest_state_last(tmp_path):
+    api_object = BlockingUploadApiObject()
+    manifest = DeployManifest(api_object, local_path=None)
+    manifest.record("/notebooks/a", make_file(tmp_path, "a.py"))
+    first_save = threading.Thread(target=manifest.save)
+    first_save.start()
+    assert api_object.first_upload_started.wait(5)
+    manifest.record("/notebooks/b", make_file(tmp_path, "b.py"))
+    second_save = threading.Thread(target=manifest.save)
+    second_save.start()
+    api_object.release_first_upload.set()
+    first_save.join(5)
+    second_save.join(5)
+    assert [sorted(content["hashes"]) for content in api_object.uploads] == [
+        ["/notebooks/a"],
+        ["/notebooks/a", "/notebooks/b"],
+    ]
+
+
+def test_failed_save_is_retried_by_the_next_one(tmp_path):
+    class FailingApiObject:
+        def upload_file_dbfs(self, file_local_path: str, dbfs_path: str) -> None:
+            raise RuntimeError("upload failed")
+
+    manifest = DeployManifest(FailingApiObject(), local_path=None)
+    manifest.record("/notebooks/a", make_file(tmp_path, "a.py"))
+    with pytest.raises(RuntimeError):
+        manifest.save()
+    api_object = BlockingUploadApiObject()
+    api_object.first_upload_started.set()
+    manifest.api_object = api_object
+    manifest.save()
+    assert [sorted(content["hashes"]) for content in api_object.uploads] == [
+        ["/notebooks/a"]
+    ]
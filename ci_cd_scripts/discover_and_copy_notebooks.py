@@ -1,7 +1,11 @@
-import glob
-from shutil import copy
 from pathlib import Path
 
+from artifact_staging import stage_files
+from file_index import find
+from tracing import get_logger
+
+logger = get_logger(__name__)
+
 
 def discover_and_copy_notebooks_workflow(
     working_dir: str, subdir: str, target_dir: str, pattern: str = r".notebooks"
@@ -25,13 +29,13 @@ def discover_and_copy_notebooks_workflow(
         "*/*.sql",
     ]  # includes one level of subdirectories
 
-    print(f"Working dir: {working_dir}\nsubdir: {subdir}\ntarget dir: {target_dir}")
+    logger.debug(
+        f"Working dir: {working_dir}\nsubdir: {subdir}\ntarget dir: {target_dir}"
+    )
     for path_pattern in notebooks_path_patterns:
-        print(f"path: {str(working_dir)}/*/{subdir}/{path_pattern}")
-        for entity in glob.glob(
-            f"{str(working_dir)}/*/{subdir}/{path_pattern}"
-        ):
-            print(f"notebook files paths: {entity}")
+        logger.debug(f"path: {str(working_dir)}/*/{subdir}/{path_pattern}")
+        for entity in find(str(working_dir), f"*/{subdir}/{path_pattern}"):
+            logger.debug(f"notebook files paths: {entity}")
             notebooks_local_paths.append(Path(entity))
 
     pattern = r".notebooks"
@@ -44,18 +48,12 @@ def discover_and_copy_notebooks_workflow(
             + "/"
             + "/".join(str(notebooks_local_paths[x]).split("/")[8:])
         )
-        print(f"target_sub_path_relative: {target_sub_path_relative}")
+        logger.debug(f"target_sub_path_relative: {target_sub_path_relative}")
         final_path = Path(
             target_dir.__str__() + "/" + target_sub_path_relative.__str__()
         )
         notebooks_target_paths.append(final_path)
 
-    for i, file in enumerate(notebooks_local_paths):
-        dir_path = Path(
-            "/".join(
-                notebooks_target_paths[i].__str__().replace("\\", "/").split("/")[:-1]
-            )
-        )
-        print(f"File: {file}; dir_path: {dir_path}")
-        dir_path.mkdir(parents=True, exist_ok=True)
-        copy(file, notebooks_target_paths[i])
+    stage_files(
+        list(zip(notebooks_local_paths, notebooks_target_paths)), label="notebook(s)"
+    )
@@ -0,0 +1,258 @@
+import os
+import json
+import fnmatch
+import threading
+from typing import Union
+
+
+# optional directory for persisting indexes between separate CLI invocations
+FILE_INDEX_CACHE_DIR = os.environ.get("FILE_INDEX_CACHE_DIR")
+# directories which are never indexed (no query is meant to look into them)
+SKIPPED_DIRS = {".git"}
+
+# indexes built in the current process, per root directory
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def is_wildcard(pattern: str) -> bool:
+    return any(char in pattern for char in "*?[")
+
+
+def pattern_parts_of(pattern: str, recursive: bool = False) -> tuple:
+    """
+    Split a glob pattern into its components - without recursive, `**` is the
+    same as `*`.
+    """
+    pattern_parts = tuple(part for part in pattern.split("/") if part)
+    if not recursive:
+        pattern_parts = tuple("*" if p == "**" else p for p in pattern_parts)
+    return pattern_parts
+
+
+def pattern_depth(pattern: str, recursive: bool = False) -> Union[int, None]:
+    """
+    Return the depth (number of path components) of the files a glob pattern can
+    match, or None if it matches files at any depth (recursive `**`).
+    """
+    pattern_parts = pattern_parts_of(pattern, recursive)
+    return None if "**" in pattern_parts else len(pattern_parts)
+
+
+def deeper(depth: Union[int, None], other_depth: Union[int, None]):
+    """
+    Return the bigger of two maximum depths (None - unlimited).
+    """
+    if depth is None or other_depth is None:
+        return None
+    return max(depth, other_depth)
+
+
+class FileIndex:
+    """
+    In-memory index of all of the files below a root directory, built with a single
+    os.scandir walk. It answers glob-style queries (see FileIndex.glob) without
+    touching the filesystem again.
+    Files are indexed by extension, by the names of their parent directories and
+    by depth (number of path components relative to the root).
+    With max_depth, the walk does not descend below that depth, so shallow
+    queries (e.g. dist/*.whl) do not have to list the whole tree. Directories in
+    SKIPPED_DIRS are never indexed.
+    """
+
+    def __init__(self, root: str, max_depth: int = None) -> None:
+        self.root = root
+        self.max_depth = max_depth
+        self.files = []
+        self.directories = {}
+        self.by_extension = {}
+        self.by_dir_name = {}
+        self.by_depth = {}
+
+    def scan(self) -> "FileIndex":
+        """
+        Walk the root directory once and index every file.
+        Symlinked directories are followed, but each directory is visited once.
+        """
+        visited = set()
+        stack = [()]
+        while stack:
+            relative_dir = stack.pop()
+            path = os.path.join(self.root, *relative_dir)
+            try:
+                stat = os.stat(path)
+                entries = list(os.scandir(path))
+            except OSError:
+                continue
+            if (stat.st_dev, stat.st_ino) in visited:
+                continue
+            visited.add((stat.st_dev, stat.st_ino))
+            self.directories["/".join(relative_dir)] = stat.st_mtime_ns
+            # files in subdirectories are at least two components deeper
+            descend = self.max_depth is None or len(relative_dir) + 2 <= self.max_depth
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        if descend and entry.name not in SKIPPED_DIRS:
+                            stack.append(relative_dir + (entry.name,))
+                    elif entry.is_file():
+                        self.add_file(relative_dir + (entry.name,))
+                except OSError:
+                    continue
+        return self
+
+    def add_file(self, parts: tuple) -> None:
+        index = len(self.files)
+        self.files.append(parts)
+        name = parts[-1]
+        if "." in name:
+            self.by_extension.setdefault(name.rsplit(".", 1)[-1], []).append(index)
+        for dir_name in set(parts[:-1]):
+            self.by_dir_name.setdefault(dir_name, []).append(index)
+        self.by_depth.setdefault(len(parts), []).append(index)
+
+    def covers(self, max_depth: Union[int, None]) -> bool:
+        """
+        Check if the index has all of the files up to max_depth (None - any depth).
+        """
+        return deeper(self.max_depth, max_depth) == self.max_depth
+
+    def is_up_to_date(self) -> bool:
+        """
+        Check if none of the indexed directories has been modified (a directory's
+        mtime changes whenever an entry is added to or removed from it).
+        """
+        for relative_dir, mtime_ns in self.directories.items():
+            try:
+                path = os.path.join(self.root, relative_dir)
+                if os.stat(path).st_mtime_ns != mtime_ns:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def glob(self, pattern: str, recursive: bool = False, root: str = None) -> list:
+        """
+        Return paths of the indexed files matching a glob pattern relative to the
+        root, following glob.glob semantics: `*`, `?` and `[...]` match within a
+        single path component, wildcards do not match hidden names and, if
+        recursive is True, `**` matches any number of directories.
+        Paths are prefixed with root (by default the indexed root), sorted and
+        unique.
+        """
+        pattern_parts = pattern_parts_of(pattern, recursive)
+        candidates = self.candidates(pattern_parts)
+        root = self.root if root is None else root
+        prefix = root if root.endswith("/") else root + "/"
+        return sorted(
+            prefix + "/".join(self.files[i])
+            for i in candidates
+            if match_parts(self.files[i], pattern_parts)
+        )
+
+    def candidates(self, pattern_parts: tuple):
+        """
+        Narrow down files which may match the pattern using the indexes.
+        """
+        index_sets = []
+        name_pattern = pattern_parts[-1] if pattern_parts else ""
+        extension = name_pattern.rsplit(".", 1)[-1]
+        if "." in name_pattern and not is_wildcard(extension):
+            index_sets.append(self.by_extension.get(extension, []))
+        if "**" not in pattern_parts:
+            index_sets.append(self.by_depth.get(len(pattern_parts), []))
+        for part in pattern_parts[:-1]:
+            if not is_wildcard(part):
+                index_sets.append(self.by_dir_name.get(part, []))
+        if not index_sets:
+            return range(len(self.files))
+        smallest = min(index_sets, key=len)
+        others = [set(s) for s in index_sets if s is not smallest]
+        return [i for i in smallest if all(i in other for other in others)]
+
+    def to_dict(self) -> dict:
+        return {
+            "root": self.root,
+            "max_depth": self.max_depth,
+            "directories": self.directories,
+            "files": ["/".join(parts) for parts in self.files],
+        }
+
+    @classmethod
+    def from_dict(cls, content: dict) -> "FileIndex":
+        file_index = cls(content["root"], content["max_depth"])
+        file_index.directories = content["directories"]
+        for file in content["files"]:
+            file_index.add_file(tuple(file.split("/")))
+        return file_index
+
+
+def match_parts(path_parts: tuple, pattern_parts: tuple) -> bool:
+    """
+    Match path components against glob pattern components (`**` matches zero or
+    more components).
+    """
+    if not pattern_parts:
+        return not path_parts
+    pattern, rest = pattern_parts[0], pattern_parts[1:]
+    if pattern == "**":
+        required_parts = sum(1 for part in rest if part != "**")
+        for i in range(len(path_parts) - required_parts + 1):
+            if i and path_parts[i - 1].startswith("."):
+                break
+            if match_parts(path_parts[i:], rest):
+                return True
+        return False
+    if not path_parts:
+        return False
+    name = path_parts[0]
+    if is_wildcard(pattern) and name.startswith(".") and not pattern.startswith("."):
+        return False
+    return fnmatch.fnmatchcase(name, pattern) and match_parts(path_parts[1:], rest)
+
+
+def cache_file_path(root: str) -> str:
+    key = os.path.abspath(root).strip("/").replace("/", "_") or "root"
+    return os.path.join(FILE_INDEX_CACHE_DIR, f"file_index_{key}.json")
+
+
+def get_index(root: str, max_depth: int = None) -> FileIndex:
+    """
+    Return an index of a root directory with all of the files up to max_depth
+    (None - any depth). The index is built once per process (or loaded from
+    FILE_INDEX_CACHE_DIR if set) and rebuilt only if any of the indexed
+    directories has changed since then or a deeper index is needed.
+    """
+    key = os.path.abspath(root)
+    with _indexes_lock:
+        file_index = _indexes.get(key)
+        if file_index is None and FILE_INDEX_CACHE_DIR:
+            try:
+                with open(cache_file_path(root), "r") as f:
+                    file_index = FileIndex.from_dict(json.load(f))
+            except (OSError, ValueError, KeyError):
+                file_index = None
+        if (
+            file_index is None
+            or not file_index.covers(max_depth)
+            or not file_index.is_up_to_date()
+        ):
+            if file_index is not None:
+                max_depth = deeper(file_index.max_depth, max_depth)
+            file_index = FileIndex(root, max_depth).scan()
+            if FILE_INDEX_CACHE_DIR:
+                os.makedirs(FILE_INDEX_CACHE_DIR, exist_ok=True)
+                with open(cache_file_path(root), "w") as f:
+                    json.dump(file_index.to_dict(), f)
+        _indexes[key] = file_index
+    return file_index
+
+
+def find(root: str, pattern: str, recursive: bool = False) -> list:
+    """
+    Find files below root matching a glob pattern relative to root, using the
+    cached index of root (see get_index and FileIndex.glob) - the index goes only
+    as deep as the pattern can match.
+    """
+    file_index = get_index(root, pattern_depth(pattern, recursive))
+    return file_index.glob(pattern, recursive, root)
@@ -0,0 +1,54 @@
+import file_index
+from file_index import FileIndex, find, pattern_depth
+
+
+def make_tree(tmp_path, files: list) -> str:
+    for file in files:
+        path = tmp_path / file
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+    return str(tmp_path)
+
+
+def test_pattern_depth():
+    assert pattern_depth("dist/*.whl") == 2
+    assert pattern_depth("**/**/*.py") == 3
+    assert pattern_depth("**/setup.py", recursive=True) is None
+
+
+def test_scan_does_not_descend_below_max_depth_or_into_git(tmp_path):
+    root = make_tree(
+        tmp_path, ["dist/a.whl", "pkg/sub/deep/b.whl", ".git/objects/c.whl", "d.whl"]
+    )
+    shallow = FileIndex(root, max_depth=2).scan()
+    assert sorted(shallow.directories) == ["", "dist", "pkg"]
+    assert shallow.glob("*/*.whl") == [f"{root}/dist/a.whl"]
+    full = FileIndex(root).scan()
+    assert ".git" not in full.directories
+    assert full.glob("**/*.whl", recursive=True) == [
+        f"{root}/d.whl",
+        f"{root}/dist/a.whl",
+        f"{root}/pkg/sub/deep/b.whl",
+    ]
+
+
+def test_find_rescans_deeper_when_needed(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_index, "_indexes", {})
+    root = make_tree(tmp_path, ["dist/a.whl", "pkg/sub/b.py"])
+    assert find(root, "dist/*.whl") == [f"{root}/dist/a.whl"]
+    assert file_index.get_index(root).max_depth is None
+    monkeypatch.setattr(file_index, "_indexes", {})
+    assert find(root, "dist/*.whl") == [f"{root}/dist/a.whl"]
+    assert find(root, "*/*/*.py") == [f"{root}/pkg/sub/b.py"]
+    assert file_index.get_index(root, 2).max_depth == 3
+
+
+def test_persisted_index_keeps_max_depth(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_index, "_indexes", {})
+    monkeypatch.setattr(file_index, "FILE_INDEX_CACHE_DIR", str(tmp_path / "cache"))
+    root = make_tree(tmp_path / "tree", ["dist/a.whl", "pkg/sub/b.py"])
+    assert find(root, "dist/*.whl") == [f"{root}/dist/a.whl"]
+    monkeypatch.setattr(file_index, "_indexes", {})
+    loaded = file_index.get_index(root, 2)
+    assert (loaded.max_depth, loaded.is_up_to_date()) == (2, True)
+    assert "pkg/sub" not in loaded.directories
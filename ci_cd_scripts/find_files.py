@@ -1,17 +1,17 @@
-import glob
+from file_index import find
+from read_config import task_variables
+from tracing import get_logger
+
+logger = get_logger(__name__)
 
 
 def find_files_in_a_path_with_extension(path: str, pattern: str) -> list:
     """
     Find .{pattern} files in the provided path.
     """
-    files_local_paths = []
     if path[-1] != "/":
         path += "/"
-    search_path = path + pattern
-    for file in glob.glob(search_path):
-        files_local_paths.append(file)
-    return files_local_paths
+    return find(path, pattern)
 
 
 def output_list_as_bash_variable_ado(list_to_output: list, variable_name: str) -> None:
@@ -21,6 +21,7 @@ def output_list_as_bash_variable_ado(list_to_output: list, variable_name: str) -
     separated by a comma.
     """
     string_output = ",".join(list_to_output)
+    task_variables[variable_name] = string_output
     print(f"##vso[task.setvariable variable={variable_name}]{string_output}")
 
 
@@ -58,12 +59,10 @@ def find_files_in_nested_dir(
     nested_dir_depth = int(nested_dir_depth)
     if path[-1] != "/":
         path += "/"
-    search_path = path + nested_dir_depth * f"**/"
-    search_path += f"{nested_dir}/{filename}.{extension}"
-    files_list = []
-    for entity in glob.glob(search_path, recursive=True):
-        files_list.append(entity)
-    print(f"files_list: {files_list}")
+    search_pattern = nested_dir_depth * f"**/"
+    search_pattern += f"{nested_dir}/{filename}.{extension}"
+    files_list = find(path, search_pattern, recursive=True)
+    logger.debug(f"files_list: {files_list}")
     return files_list
 
 
@@ -1,5 +1,10 @@
+import os
 import subprocess
 import sys
+import tempfile
+
+from requirements_lock import select_requirements_files, write_lock_file
+from tracing import traced
 
 
 def install_locally(package: str) -> None:
@@ -9,6 +14,45 @@ def install_locally(package: str) -> None:
     subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", package])
 
 
+def build_wheels_locally(
+    requirements_file: str,
+    wheel_dir: str,
+    python_version: str = None,
+    platform: str = None,
+) -> None:
+    """
+    Download or build wheels of all packages from a requirements file (and of their
+    dependencies) by calling 'python -m pip wheel' using subprocess.
+    Wheels already present in wheel_dir are reused.
+    If python_version (e.g. 3.10) or platform (e.g. manylinux2014_x86_64, or more
+    of them separated by a comma) is given, wheels for that target are downloaded
+    with 'python -m pip download' instead - packages without a compatible wheel
+    fail the build, as wheels built locally would be built for the CI agent.
+    """
+    if not python_version and not platform:
+        subprocess.check_call(
+            [
+                sys.executable, "-m", "pip", "wheel", "--wheel-dir", wheel_dir,
+                "--find-links", wheel_dir, "-r", requirements_file,
+            ]
+        )
+        return
+    target = []
+    if python_version:
+        target += ["--python-version", python_version]
+    for platform_tag in (platform or "").split(","):
+        if platform_tag:
+            target += ["--platform", platform_tag]
+    subprocess.check_call(
+        [
+            sys.executable, "-m", "pip", "download", "--only-binary=:all:",
+            "--dest", wheel_dir, "--find-links", wheel_dir, *target,
+            "-r", requirements_file,
+        ]
+    )
+
+
+@traced()
 def process_requirements(
     requirements_variable: str,
     requirements_type: str = "dev",
@@ -17,15 +61,52 @@ def process_requirements(
     Function for installing dependancies during CI step.
     It processes bash variables that contains paths to requirements file and accordingly
     to the specified paremater, install given given dependancies (either common.txt or
-    dev.txt).
+    dev.txt) with a single pip install of their merged lock file.
     """
-    requirements = requirements_variable.split(",")
-    requirements_files = []
-    for req_file in requirements:
-        if req_file.split("/")[-1].split(".")[-2] == requirements_type:
-            requirements_files.append(req_file)
+    requirements_files = select_requirements_files(
+        requirements_variable.split(","), requirements_type
+    )
     print(f"requirements_files: {requirements_files}")
-    for file in requirements_files:
-        print(f"Current file: {file}")
-        install_locally(file)
+    # all of the files are merged into one lock file, so pip resolves them once
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        lock_path = os.path.join(tmp_dir, f"{requirements_type}.lock.txt")
+        write_lock_file(requirements_files, lock_path)
+        install_locally(lock_path)
 
+
+@traced()
+def build_wheelhouse(
+    requirements_variable: str,
+    wheelhouse_dir: str,
+    requirements_type: str = "common",
+    python_version: str = None,
+    platform: str = None,
+) -> list:
+    """
+    Function for building a wheelhouse during CI step - a directory with wheels of
+    all of the requirements (of the specified type) and of their dependencies,
+    which is later uploaded to DBFS and installed on clusters instead of
+    downloading the packages from PyPI (see upload_wheelhouse in
+    databricks_api_workflows_internal).
+    Wheels are built for the Python version and the platform of the CI agent,
+    unless python_version and platform of the Databricks runtime are given (see
+    build_wheels_locally).
+    Returns paths of the wheels in the wheelhouse.
+    """
+    requirements_files = select_requirements_files(
+        requirements_variable.split(","), requirements_type
+    )
+    print(f"requirements_files: {requirements_files}")
+    os.makedirs(wheelhouse_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        lock_path = os.path.join(tmp_dir, f"{requirements_type}.lock.txt")
+        lock = write_lock_file(requirements_files, lock_path)
+        if lock.requirements:
+            build_wheels_locally(lock_path, wheelhouse_dir, python_version, platform)
+    wheels = sorted(
+        os.path.join(wheelhouse_dir, file)
+        for file in os.listdir(wheelhouse_dir)
+        if file.endswith(".whl")
+    )
+    print(f"Wheelhouse {wheelhouse_dir}: {len(wheels)} wheel(s)")
+    return wheels
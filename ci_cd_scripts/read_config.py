@@ -1,6 +1,25 @@
 import json
+from functools import lru_cache
 from typing import Union
 
+from tracing import get_logger
+
+logger = get_logger(__name__)
+
+
+# task variables exported in the current process - consumed by steps that run
+# in the same interpreter (see run_plan.py) instead of Azure DevOps variables
+task_variables = {}
+
+
+@lru_cache(maxsize=None)
+def read_cfg_file(cfg_file: str) -> str:
+    """
+    Read the content of a config file - it is read only once per process.
+    """
+    with open(cfg_file) as f:
+        return f.read()
+
 
 def read_env_cfg(
     env: str,
@@ -35,16 +54,14 @@ def read_env_cfg(
     :return: parsed configuration
     :rtype: dict
     """
-    file = open(cfg_file)
-    whole_cfg = json.load(file)
-    file.close()
-    print(f"env: {env}")
-    print(f"whole cfg: {whole_cfg}")
+    whole_cfg = json.loads(read_cfg_file(cfg_file))
+    logger.debug(f"env: {env}")
+    logger.debug(f"whole cfg: {whole_cfg}")
     cfg_keys = [*whole_cfg.keys()]
     cfg = dict()
     for x in cfg_keys:
         cfg[x] = whole_cfg.get(x).get(env)
-    print(f"Parsed config: {cfg}")
+    logger.debug(f"Parsed config: {cfg}")
     if output_file:
         with open(output_file, "w") as f:
             json.dump(cfg, f)
@@ -65,11 +82,9 @@ def read_flat_cfg(cfg_file: str, export_to_task_variables: bool = True) -> dict:
     :return: parsed configuration
     :rtype: dict
     """
-    file = open(cfg_file)
-    cfg = json.load(file)
-    file.close()
-    print(f"cfg: {cfg}")
-    print(f"cfg type: {type(cfg)}")
+    cfg = json.loads(read_cfg_file(cfg_file))
+    logger.debug(f"cfg: {cfg}")
+    logger.debug(f"cfg type: {type(cfg)}")
     if export_to_task_variables:
         export_dict_to_task_variables(cfg)
     return cfg
@@ -84,9 +99,9 @@ def export_dict_to_task_variables(cfg: dict) -> None:
     """
     for k, v in cfg.items():
         if k == "databricks_cluster_id" and isinstance(v, list):
-            print(f"##vso[task.setvariable variable={k}]{v[0]}")
-        else:
-            print(f"##vso[task.setvariable variable={k}]{v}")
+            v = v[0]
+        task_variables[k] = str(v)
+        print(f"##vso[task.setvariable variable={k}]{v}")
 
 
 def export_string_to_task_variables(
@@ -100,7 +115,8 @@ def export_string_to_task_variables(
     :param value: value of the task variable
     :type value: str
     """
-    print(f"Creating task variable: {variable_name} with value: {value}")
+    logger.debug(f"Creating task variable: {variable_name} with value: {value}")
+    task_variables[variable_name] = str(value)
     print(
         f"##vso[task.setvariable variable={variable_name};isOutput={str(is_output).lower}]{value}"
     )
@@ -0,0 +1,336 @@
+import os
+import json
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Union
+
+import requests
+from urllib3.exceptions import ConnectTimeoutError
+
+from step_runner import Call, Sleep, run_steps
+from tracing import get_logger, tracer
+
+logger = get_logger(__name__)
+
+# client-side limit of requests per second sent to one workspace (token bucket)
+RATE_LIMIT = float(os.environ.get("DATABRICKS_RATE_LIMIT", 20))
+RATE_LIMIT_BURST = int(os.environ.get("DATABRICKS_RATE_LIMIT_BURST", 20))
+# maximum number of attempts of a single request
+MAX_ATTEMPTS = int(os.environ.get("DATABRICKS_MAX_ATTEMPTS", 6))
+# maximum delay (in seconds) between attempts, also caps Retry-After
+MAX_RETRY_DELAY = float(os.environ.get("DATABRICKS_MAX_RETRY_DELAY", 60))
+# timeouts (in seconds) of establishing a connection and of waiting for the server
+CONNECT_TIMEOUT = float(os.environ.get("DATABRICKS_CONNECT_TIMEOUT", 10))
+READ_TIMEOUT = float(os.environ.get("DATABRICKS_READ_TIMEOUT", 60))
+
+# the request was rejected without being processed - it is safe to retry any request
+REJECTED_STATUSES = {429, 503}
+# the request may have been processed - only idempotent requests are retried
+FAILED_STATUSES = {500, 502, 504}
+# endpoints which must not be repeated once they may have been processed:
+# a second restart restarts the cluster again, a second start fails with
+# INVALID_STATE once the cluster is PENDING, a repeated add-block appends the
+# block twice, create opens another handle, close of a closed handle fails and
+# a repeated move fails as its source is gone
+NOT_IDEMPOTENT_ENDPOINTS = {
+    "clusters/restart",
+    "clusters/start",
+    "dbfs/create",
+    "dbfs/add-block",
+    "dbfs/close",
+    "dbfs/move",
+}
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+class DatabricksAPIError(RuntimeError):
+    """
+    Raised when the Databricks API returns an error (or cannot be reached).
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        status_code: Union[int, None],
+        error_code: str = None,
+        message: str = "",
+    ) -> None:
+        self.endpoint = endpoint
+        self.status_code = status_code
+        self.error_code = error_code
+        self.message = message
+        super().__init__(f"{endpoint}: {status_code} {error_code or ''} {message}")
+
+
+class RateLimitError(DatabricksAPIError):
+    """429 - too many requests"""
+
+
+class ServiceUnavailableError(DatabricksAPIError):
+    """5xx - server-side or temporary error"""
+
+
+class ResourceNotFoundError(DatabricksAPIError):
+    """404 or RESOURCE_DOES_NOT_EXIST"""
+
+
+class InvalidRequestError(DatabricksAPIError):
+    """other 4xx - e.g. invalid parameters, invalid cluster state or permissions"""
+
+
+class APIConnectionError(DatabricksAPIError):
+    """the request did not get a response (connection error or timeout)"""
+
+
+def error_from_response(endpoint: str, response: requests.Response):
+    """
+    Build a typed error from an error response of the API.
+    """
+    try:
+        content = json.loads(response.text)
+    except ValueError:
+        content = {}
+    if not isinstance(content, dict):
+        content = {}
+    error_code = content.get("error_code")
+    message = content.get("message", response.text[:500])
+    if response.status_code == 429:
+        error_class = RateLimitError
+    elif response.status_code >= 500:
+        error_class = ServiceUnavailableError
+    elif response.status_code == 404 or error_code == "RESOURCE_DOES_NOT_EXIST":
+        error_class = ResourceNotFoundError
+    else:
+        error_class = InvalidRequestError
+    return error_class(endpoint, response.status_code, error_code, message)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket - allows `rate` requests per second on average with
+    bursts of up to `capacity` requests. pause() stops all of the requests for a
+    while, e.g. after the server responded with 429.
+    """
+
+    def __init__(self, rate: float = RATE_LIMIT, capacity: int = RATE_LIMIT_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """
+        Take a token if available and return 0, otherwise return the time (in
+        seconds) after which it is worth trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            if now >= self.paused_until and self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return max(self.paused_until - now, (1 - self.tokens) / self.rate)
+
+    def acquire(self) -> None:
+        wait = self.try_acquire()
+        while wait:
+            time.sleep(wait)
+            wait = self.try_acquire()
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+def get_rate_limiter(host: str) -> TokenBucket:
+    """
+    Return the rate limiter shared by all of the requests sent to a workspace.
+    """
+    with _rate_limiters_lock:
+        if host not in _rate_limiters:
+            _rate_limiters[host] = TokenBucket()
+        return _rate_limiters[host]
+
+
+def is_idempotent(method: str, endpoint: str) -> bool:
+    return method.upper() == "GET" or endpoint not in NOT_IDEMPOTENT_ENDPOINTS
+
+
+def was_not_sent(error: requests.exceptions.RequestException) -> bool:
+    """
+    Check if a request failed before it could reach the server - the connection
+    could not be established (refused, DNS failure or connect timeout).
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError) or not error.args:
+        return False
+    # requests wraps the urllib3 error in MaxRetryError, whose reason is the cause
+    cause = getattr(error.args[0], "reason", error.args[0])
+    # NewConnectionError (and NameResolutionError) subclass ConnectTimeoutError
+    return isinstance(cause, ConnectTimeoutError)
+
+
+def retry_after(response: requests.Response) -> Union[float, None]:
+    """
+    Parse the Retry-After header (delay in seconds or an HTTP date).
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def body_size(body) -> Union[int, None]:
+    """
+    Size of a request body in bytes (None for streamed bodies).
+    """
+    if isinstance(body, bytes):
+        return len(body)
+    if isinstance(body, str):
+        return len(body.encode())
+    return None if body is not None else 0
+
+
+def cluster_id_from_body(body) -> Union[str, None]:
+    """
+    Extract cluster_id from a (small) JSON request body.
+    """
+    if isinstance(body, bytes) and len(body) < 4096 and b'"cluster_id"' in body:
+        try:
+            return json.loads(body).get("cluster_id")
+        except ValueError:
+            return None
+    return None
+
+
+def rewind_files(kwargs: dict) -> None:
+    """
+    Rewind files attached to a request, so that it can be sent again.
+    """
+    for file in (kwargs.get("files") or {}).values():
+        if hasattr(file, "seek"):
+            file.seek(0)
+
+
+class RequestExecutor:
+    """
+    Central executor of the requests sent to a Databricks workspace:
+    - requests are throttled by the workspace's token bucket (see TokenBucket)
+    - 429 and 503 responses (rejected requests) are retried for every endpoint,
+    after the delay from Retry-After if given; 429 also pauses the other requests
+    to the workspace for that time
+    - 500, 502, 504 responses and connection errors after the request was sent are
+    retried only for idempotent requests (see NOT_IDEMPOTENT_ENDPOINTS)
+    - the delay between attempts grows exponentially, with full jitter
+    - every attempt is sent with a (connect, read) timeout, so that a hung
+    connection fails (and is retried if safe) instead of blocking the deployment
+    Each request (with all of its attempts) is recorded as an "api" span.
+    The policy is implemented once, in request_steps - subclasses (e.g.
+    AsyncRequestExecutor) only replace the HTTP client specific methods.
+    """
+
+    # errors of the HTTP client raised when no response was received
+    connection_errors = (requests.exceptions.RequestException,)
+
+    def __init__(
+        self,
+        session: requests.Session,
+        rate_limiter: TokenBucket,
+        max_attempts: int = MAX_ATTEMPTS,
+        base_delay: float = 1.0,
+        max_delay: float = MAX_RETRY_DELAY,
+        timeout: tuple = (CONNECT_TIMEOUT, READ_TIMEOUT),
+    ) -> None:
+        self.session = session
+        self.rate_limiter = rate_limiter
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def send(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def was_not_sent(self, error: Exception) -> bool:
+        return was_not_sent(error)
+
+    def request_body(self, response: requests.Response):
+        return response.request.body
+
+    def request(
+        self, method: str, url: str, endpoint: str, **kwargs
+    ) -> requests.Response:
+        """
+        Send a request with retries and return the final response. Responses with
+        error status codes are returned; APIConnectionError is raised if no
+        response was received.
+        """
+        return run_steps(self.request_steps(method, url, endpoint, **kwargs))
+
+    def request_steps(self, method: str, url: str, endpoint: str, **kwargs):
+        """
+        Steps (see step_runner) of sending a request with retries.
+        """
+        idempotent = is_idempotent(method, endpoint)
+        with tracer.span(endpoint, "api", method=method) as span:
+            for attempt in range(1, self.max_attempts + 1):
+                span["retries"] = attempt - 1
+                rewind_files(kwargs)
+                wait = self.rate_limiter.try_acquire()
+                while wait:
+                    yield Sleep(wait)
+                    wait = self.rate_limiter.try_acquire()
+                try:
+                    response = yield Call(self.send, method, url, **kwargs)
+                except self.connection_errors as e:
+                    if attempt == self.max_attempts or not (
+                        idempotent or self.was_not_sent(e)
+                    ):
+                        raise APIConnectionError(endpoint, None, message=repr(e)) from e
+                    delay = self.backoff(attempt)
+                    reason = type(e).__name__
+                else:
+                    body = self.request_body(response)
+                    span["status_code"] = response.status_code
+                    span["bytes_sent"] = body_size(body)
+                    if "cluster" not in span:
+                        span["cluster"] = cluster_id_from_body(body)
+                    retryable = response.status_code in REJECTED_STATUSES or (
+                        idempotent and response.status_code in FAILED_STATUSES
+                    )
+                    if attempt == self.max_attempts or not retryable:
+                        return response
+                    delay = retry_after(response)
+                    if delay is None:
+                        delay = self.backoff(attempt)
+                    delay = min(delay, self.max_delay)
+                    if response.status_code == 429:
+                        self.rate_limiter.pause(delay)
+                    reason = f"status {response.status_code}"
+                logger.info(
+                    f"{method} {endpoint} failed ({reason}) - attempt {attempt}/"
+                    f"{self.max_attempts}, retrying in {delay:.1f} s"
+                )
+                yield Sleep(delay)
@@ -0,0 +1,172 @@
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+import request_executor
+from request_executor import (
+    APIConnectionError,
+    InvalidRequestError,
+    RateLimitError,
+    RequestExecutor,
+    ResourceNotFoundError,
+    ServiceUnavailableError,
+    TokenBucket,
+    error_from_response,
+    was_not_sent,
+)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(request_executor.time, "monotonic", clock)
+    return clock
+
+
+def make_response(status_code: int, text: str, headers: dict = None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = text.encode()
+    response.headers.update(headers or {})
+    response.request = requests.Request("POST", "https://host/api").prepare()
+    return response
+
+
+def test_token_bucket_allows_bursts_up_to_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.try_acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.try_acquire() == pytest.approx(0.5)
+
+
+def test_token_bucket_refills_at_rate_without_exceeding_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    for _ in range(3):
+        bucket.try_acquire()
+    clock.now += 0.5
+    assert bucket.try_acquire() == 0.0
+    assert bucket.try_acquire() > 0
+    clock.now += 60
+    assert [bucket.try_acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.try_acquire() > 0
+
+
+def test_token_bucket_pause_blocks_until_its_end(clock):
+    bucket = TokenBucket(rate=10, capacity=10)
+    bucket.pause(5)
+    assert bucket.try_acquire() == pytest.approx(5)
+    clock.now += 5
+    assert bucket.try_acquire() == 0.0
+
+
+def test_was_not_sent_for_failed_connections():
+    refused = NewConnectionError(None, "Connection refused")
+    assert was_not_sent(requests.exceptions.ConnectTimeout())
+    assert was_not_sent(
+        requests.exceptions.ConnectionError(MaxRetryError(None, "/", refused))
+    )
+
+
+def test_was_not_sent_is_false_once_the_request_may_have_been_sent():
+    reset = ProtocolError("Connection aborted.", ConnectionResetError())
+    assert not was_not_sent(requests.exceptions.ReadTimeout())
+    assert not was_not_sent(requests.exceptions.ConnectionError(reset))
+    assert not was_not_sent(requests.exceptions.ConnectionError())
+
+
+@pytest.mark.parametrize(
+    "status_code, text, error_class",
+    [
+        (429, '{"error_code": "REQUEST_LIMIT_EXCEEDED"}', RateLimitError),
+        (503, "<html>Service Unavailable</html>", ServiceUnavailableError),
+        (404, '{"error_code": "ENDPOINT_NOT_FOUND"}', ResourceNotFoundError),
+        (400, '{"error_code": "RESOURCE_DOES_NOT_EXIST"}', ResourceNotFoundError),
+        (403, "<html>Forbidden</html>", InvalidRequestError),
+        (400, '["not", "an", "object"]', InvalidRequestError),
+    ],
+)
+def test_error_from_response_types(status_code, text, error_class):
+    error = error_from_response("clusters/get", make_response(status_code, text))
+    assert type(error) is error_class
+    assert error.endpoint == "clusters/get"
+    assert error.status_code == status_code
+
+
+def test_error_from_response_fields():
+    error = error_from_response(
+        "dbfs/read",
+        make_response(400, '{"error_code": "INVALID_PARAMETER_VALUE", "message": "x"}'),
+    )
+    assert (error.error_code, error.message) == ("INVALID_PARAMETER_VALUE", "x")
+    error = error_from_response("dbfs/read", make_response(502, "b" * 1000))
+    assert error.error_code is None
+    assert error.message == "b" * 500
+
+
+class FakeSession:
+    def __init__(self, outcomes: list) -> None:
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        self.timeout = kwargs.get("timeout")
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def make_executor(session: FakeSession) -> RequestExecutor:
+    return RequestExecutor(
+        session, TokenBucket(rate=1000, capacity=1000), base_delay=0, max_delay=0
+    )
+
+
+def test_executor_retries_rejected_requests_of_any_endpoint():
+    session = FakeSession([make_response(429, ""), make_response(200, "{}")])
+    response = make_executor(session).request(
+        "POST", "https://host/api/2.0/dbfs/add-block", "dbfs/add-block"
+    )
+    assert (response.status_code, session.calls) == (200, 2)
+
+
+def test_executor_sends_requests_with_timeout():
+    session = FakeSession([make_response(200, "{}")])
+    make_executor(session).request(
+        "GET", "https://host/api/2.0/clusters/get", "clusters/get"
+    )
+    assert session.timeout == (
+        request_executor.CONNECT_TIMEOUT,
+        request_executor.READ_TIMEOUT,
+    )
+
+
+@pytest.mark.parametrize("endpoint", ["clusters/restart", "clusters/start"])
+def test_executor_does_not_repeat_processed_non_idempotent_requests(endpoint):
+    session = FakeSession([make_response(500, ""), make_response(200, "{}")])
+    response = make_executor(session).request(
+        "POST", f"https://host/api/2.0/{endpoint}", endpoint
+    )
+    assert (response.status_code, session.calls) == (500, 1)
+    session = FakeSession([requests.exceptions.ReadTimeout()])
+    with pytest.raises(APIConnectionError):
+        make_executor(session).request(
+            "POST", "https://host/api/2.0/clusters/restart", "clusters/restart"
+        )
+
+
+def test_executor_gives_up_after_max_attempts():
+    session = FakeSession([make_response(503, "")] * 10)
+    executor = make_executor(session)
+    response = executor.request(
+        "GET", "https://host/api/2.0/clusters/get", "clusters/get"
+    )
+    assert (response.status_code, session.calls) == (503, executor.max_attempts)
@@ -0,0 +1,268 @@
+import os
+import re
+import sys
+import json
+import shlex
+import tempfile
+import subprocess
+
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.specifiers import SpecifierSet
+from packaging.utils import canonicalize_name
+from packaging.version import InvalidVersion, Version
+
+
+COMMENT_PATTERN = re.compile(r"(^|\s)#.*$")
+INCLUDE_OPTIONS = ("-r", "--requirement")
+
+
+class RequirementsConflictError(ValueError):
+    pass
+
+
+def select_requirements_files(
+    requirements_files: list, requirements_type: str
+) -> list:
+    """
+    Select requirement files of a given type (e.g. common for common.txt, dev for
+    dev.txt).
+    """
+    return [
+        file
+        for file in requirements_files
+        if file.split("/")[-1].split(".")[-2] == requirements_type
+    ]
+
+
+def read_requirement_lines(file: str) -> list:
+    """
+    Read lines of a requirements file without comments and blank lines, joining
+    lines continued with a backslash.
+    Returns (line number, line) pairs - the number of the first line in the file.
+    """
+    lines = []
+    with open(file, "r") as f:
+        content = f.read()
+    continued, first_number = "", 1
+    # an empty line ends a continuation left open at the end of the file
+    for number, physical_line in enumerate(content.splitlines() + [""], start=1):
+        if not continued:
+            first_number = number
+        if physical_line.endswith("\\"):
+            continued += physical_line[:-1]
+            continue
+        line = COMMENT_PATTERN.sub("", continued + physical_line).strip()
+        continued = ""
+        if line:
+            lines.append((first_number, line))
+    return lines
+
+
+def is_satisfiable(specifier: SpecifierSet) -> bool:
+    """
+    Check if any version can satisfy all of the specifiers. The intersection of
+    the specifiers is an interval (minus excluded versions), so it is enough to
+    test the version 0, the versions from the specifiers and versions just above
+    them.
+    """
+    candidates = [Version("0")]
+    for spec in specifier:
+        try:
+            version = Version(spec.version.rstrip(".*"))
+        except InvalidVersion:
+            return True
+        candidates.append(version)
+        candidates.append(Version(f"{version.base_version}.0.1"))
+    return any(specifier.contains(c, prereleases=True) for c in candidates)
+
+
+class RequirementsLock:
+    """
+    Requirements from any number of requirement files, merged into a single
+    de-duplicated set:
+    - specifiers of requirements of the same project (and environment marker) are
+    intersected, e.g. pandas>=1.0 and pandas<2.0 become pandas<2.0,>=1.0
+    - extras are combined
+    - entries that are not named requirements (e.g. paths to wheel files) are kept
+    as they are, once
+    - pip options (e.g. --extra-index-url) are kept once; -r includes are followed
+    Incompatible requirements (e.g. pandas==1.0 and pandas>=2.0, or two different
+    URLs of the same project) raise RequirementsConflictError listing all of them.
+    """
+
+    def __init__(self) -> None:
+        self.sources = []
+        self.options = []
+        self.direct = []
+        # (project name, marker) -> {"requirement", "specifier", "extras", "origins"}
+        self.merged = {}
+        self.conflicts = []
+
+    def add_file(self, file: str, _included_from: tuple = ()) -> None:
+        path = os.path.abspath(file)
+        if path in _included_from:
+            return
+        self.sources.append(file)
+        for number, line in read_requirement_lines(file):
+            origin = f"{file}:{number}"
+            option, _, value = line.partition(" ")
+            if option in INCLUDE_OPTIONS:
+                included = os.path.join(os.path.dirname(file), value.strip())
+                self.add_file(included, _included_from + (path,))
+            elif line.startswith("-"):
+                if line not in self.options:
+                    self.options.append(line)
+            else:
+                self.add_requirement(line, origin)
+
+    def add_requirement(self, line: str, origin: str) -> None:
+        try:
+            requirement = Requirement(line)
+        except InvalidRequirement:
+            if line not in self.direct:
+                self.direct.append(line)
+            return
+        key = (canonicalize_name(requirement.name), str(requirement.marker or ""))
+        entry = self.merged.get(key)
+        if entry is None:
+            self.merged[key] = {
+                "requirement": requirement,
+                "specifier": requirement.specifier,
+                "extras": set(requirement.extras),
+                "origins": [origin],
+            }
+            return
+        entry["origins"].append(origin)
+        entry["extras"] |= requirement.extras
+        if requirement.url != entry["requirement"].url:
+            self.conflicts.append(
+                f"{requirement.name}: different URLs ({', '.join(entry['origins'])})"
+            )
+            return
+        entry["specifier"] &= requirement.specifier
+        if not is_satisfiable(entry["specifier"]):
+            self.conflicts.append(
+                f"{requirement.name}: no version satisfies {entry['specifier']} "
+                f"({', '.join(entry['origins'])})"
+            )
+
+    @property
+    def requirements(self) -> list:
+        """
+        Merged requirements as requirement strings (named requirements first,
+        sorted by name, followed by the other entries).
+        """
+        if self.conflicts:
+            raise RequirementsConflictError(
+                "Conflicting requirements:\n" + "\n".join(self.conflicts)
+            )
+        requirements = []
+        for key in sorted(self.merged):
+            entry = self.merged[key]
+            requirement = Requirement(str(entry["requirement"]))
+            requirement.specifier = entry["specifier"]
+            requirement.extras = entry["extras"]
+            requirements.append(str(requirement))
+        return requirements + self.direct
+
+    def to_text(self) -> str:
+        header = "# Generated by requirements_lock.py from:\n"
+        header += "".join(f"#   {source}\n" for source in self.sources)
+        lines = self.options + self.requirements
+        return header + "".join(f"{line}\n" for line in lines)
+
+
+def lock_requirements(requirements_files: list) -> RequirementsLock:
+    """
+    Parse and merge all of the requirement files (see RequirementsLock).
+    """
+    lock = RequirementsLock()
+    for file in requirements_files:
+        lock.add_file(file)
+    return lock
+
+
+def resolve_pinned_versions(lock: RequirementsLock) -> RequirementsLock:
+    """
+    Resolve the merged requirements (with their dependencies) to exact versions
+    with `pip install --dry-run --report` run against the current interpreter.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        requirements_path = os.path.join(tmp_dir, "requirements.txt")
+        report_path = os.path.join(tmp_dir, "report.json")
+        with open(requirements_path, "w") as f:
+            f.write(lock.to_text())
+        subprocess.check_call(
+            [
+                sys.executable, "-m", "pip", "install", "--dry-run", "--quiet",
+                "--ignore-installed", "--report", report_path, "-r", requirements_path,
+            ]
+        )
+        with open(report_path, "r") as f:
+            report = json.load(f)
+    resolved = RequirementsLock()
+    resolved.sources = lock.sources
+    resolved.options = lock.options
+    resolved.direct = lock.direct
+    # requirements installed from URLs (is_direct) keep their original form
+    for key, entry in lock.merged.items():
+        if entry["requirement"].url:
+            resolved.merged[key] = entry
+    for item in report["install"]:
+        if not item.get("is_direct"):
+            metadata = item["metadata"]
+            resolved.add_requirement(
+                f"{metadata['name']}=={metadata['version']}", "pip report"
+            )
+    return resolved
+
+
+def write_lock_file(
+    requirements_files: list, lock_path: str, resolve: bool = False
+) -> RequirementsLock:
+    """
+    Merge requirement files into a single lock file. If resolve is True, all of
+    the requirements (including transitive dependencies) are pinned to exact
+    versions (see resolve_pinned_versions).
+    """
+    lock = lock_requirements(requirements_files)
+    if resolve:
+        lock = resolve_pinned_versions(lock)
+    with open(lock_path, "w") as f:
+        f.write(lock.to_text())
+    print(
+        f"{lock_path}: {len(lock.requirements)} requirement(s) from "
+        f"{len(lock.sources)} file(s)"
+    )
+    return lock
+
+
+def pip_install_arguments(lock: RequirementsLock) -> str:
+    """
+    Pip options and merged requirements as shell-quoted arguments for pip install.
+    """
+    arguments = [arg for option in lock.options for arg in shlex.split(option)]
+    return " ".join(shlex.quote(arg) for arg in arguments + lock.requirements)
+
+
+def wheelhouse_requirements(lock: RequirementsLock) -> list:
+    """
+    Merged requirements as arguments of `pip install --no-index --find-links` with
+    a wheelhouse built from them (see process_requirements_locally.build_wheelhouse)
+    - requirements from URLs (name @ url, e.g. VCS) are replaced with their names,
+    as their wheels are in the wheelhouse and pip must not fetch the URLs again.
+    Entries which are not named requirements (e.g. a bare URL or a path) cannot be
+    found in the wheelhouse by name, so they raise ValueError.
+    """
+    requirements = lock.requirements
+    if lock.direct:
+        raise ValueError(
+            f"Requirements {lock.direct} cannot be installed from a wheelhouse - "
+            "specify them as named requirements, e.g. name @ git+https://..."
+        )
+    names = []
+    for line in requirements:
+        requirement = Requirement(line)
+        requirement.url = None
+        names.append(str(requirement))
+    return names
@@ -0,0 +1,114 @@
+import pytest
+
+from requirements_lock import (
+    RequirementsConflictError,
+    lock_requirements,
+    wheelhouse_requirements,
+)
+
+
+def write_requirements(directory, name: str, content: str) -> str:
+    path = directory / name
+    path.write_text(content)
+    return str(path)
+
+
+def test_lock_merges_specifiers_and_extras(tmp_path):
+    files = [
+        write_requirements(tmp_path, "a.txt", "pandas>=1.0\nrequests\n"),
+        write_requirements(
+            tmp_path, "b.txt", "# comment\n\npandas<2.0  # inline\nRequests[socks]\n"
+        ),
+    ]
+    lock = lock_requirements(files)
+    assert lock.requirements == ["pandas<2.0,>=1.0", "requests[socks]"]
+    assert lock.merged[("pandas", "")]["origins"] == [
+        f"{files[0]}:1",
+        f"{files[1]}:3",
+    ]
+
+
+def test_lock_keeps_markers_options_and_other_entries_once(tmp_path):
+    files = [
+        write_requirements(
+            tmp_path,
+            "a.txt",
+            "--extra-index-url https://example.com/simple\n"
+            "six; python_version < '3.0'\n"
+            "six\n"
+            "./wheels/package-0.1-py3-none-any.whl\n",
+        ),
+        write_requirements(
+            tmp_path,
+            "b.txt",
+            "--extra-index-url https://example.com/simple\n"
+            "./wheels/package-0.1-py3-none-any.whl\n",
+        ),
+    ]
+    lock = lock_requirements(files)
+    assert lock.options == ["--extra-index-url https://example.com/simple"]
+    assert lock.requirements == [
+        "six",
+        'six; python_version < "3.0"',
+        "./wheels/package-0.1-py3-none-any.whl",
+    ]
+
+
+def test_lock_follows_includes(tmp_path):
+    write_requirements(tmp_path, "base.txt", "numpy==1.26.0\n-r common.txt\n")
+    common = write_requirements(tmp_path, "common.txt", "-r base.txt\nscipy\n")
+    lock = lock_requirements([common])
+    assert lock.requirements == ["numpy==1.26.0", "scipy"]
+
+
+def test_lock_reports_all_conflicts(tmp_path):
+    files = [
+        write_requirements(
+            tmp_path,
+            "a.txt",
+            "pandas==1.0\nmylib @ https://example.com/mylib-1.0.tar.gz\n",
+        ),
+        write_requirements(
+            tmp_path,
+            "b.txt",
+            "pandas>=2.0\nmylib @ https://example.com/mylib-2.0.tar.gz\n",
+        ),
+    ]
+    lock = lock_requirements(files)
+    with pytest.raises(RequirementsConflictError) as error:
+        lock.requirements
+    message = str(error.value)
+    assert "pandas: no version satisfies" in message
+    assert "mylib: different URLs" in message
+    assert f"{files[0]}:1" in message and f"{files[1]}:1" in message
+
+
+def test_lock_allows_compatible_exclusions(tmp_path):
+    files = [
+        write_requirements(tmp_path, "a.txt", "pandas>=1.0,!=1.5.0\n"),
+        write_requirements(tmp_path, "b.txt", "pandas<=1.5.0\n"),
+    ]
+    assert lock_requirements(files).requirements == ["pandas!=1.5.0,<=1.5.0,>=1.0"]
+
+
+def test_wheelhouse_requirements_install_url_requirements_by_name(tmp_path):
+    file = write_requirements(
+        tmp_path,
+        "common.txt",
+        "--index-url https://example.com/simple\n"
+        "pandas>=1.0\n"
+        "mylib[extra] @ git+https://example.com/mylib.git@v1"
+        " ; python_version > '3.6'\n",
+    )
+    assert wheelhouse_requirements(lock_requirements([file])) == [
+        'mylib[extra]; python_version > "3.6"',
+        "pandas>=1.0",
+    ]
+
+
+def test_wheelhouse_requirements_reject_unnamed_entries(tmp_path):
+    file = write_requirements(
+        tmp_path, "common.txt", "pandas\ngit+https://example.com/mylib.git\n"
+    )
+    with pytest.raises(ValueError, match="git\\+https://example.com/mylib.git"):
+        wheelhouse_requirements(lock_requirements([file]))
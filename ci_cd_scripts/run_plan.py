@@ -0,0 +1,167 @@
+import os
+import re
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Union
+
+from read_config import task_variables
+from ci_cd_cli import COMMANDS, call_command_function, get_command_function
+from tracing import tracer
+
+
+# all of the CLI commands, except for run_plan itself, can be used as plan steps
+STEP_FUNCTIONS = [command for command in COMMANDS if command != "run_plan"]
+
+VARIABLE_PATTERN = re.compile(r"\$\((\w+)\)")
+
+
+def load_plan(plan_file: str) -> dict:
+    """
+    Load a deploy plan from a JSON or YAML (requires PyYAML) file.
+    An example of a deploy plan:
+
+    {
+    "max_parallel_steps": 4,
+    "steps": [
+        {"name": "find_whl", "function": "find_files_job", "args": ["artifact", "*.whl"]},
+        {
+            "name": "packages",
+            "function": "process_all_packages",
+            "args": ["$(json_files)", "$(secret_files)", "$(whl_files)"],
+            "depends_on": ["find_whl"]
+        }
+    ]
+    }
+
+    :param plan_file: path to the plan file
+    :type plan_file: str
+
+    :return: parsed plan
+    :rtype: dict
+    """
+    with open(plan_file, "r") as f:
+        if plan_file.endswith((".yml", ".yaml")):
+            import yaml
+
+            plan = yaml.safe_load(f)
+        else:
+            plan = json.load(f)
+    names = [step["name"] for step in plan["steps"]]
+    if len(names) != len(set(names)):
+        raise ValueError(f"Step names in {plan_file} must be unique: {names}")
+    for step in plan["steps"]:
+        if step["function"] not in STEP_FUNCTIONS:
+            raise ValueError(
+                f"Invalid function {step['function']} in step {step['name']}. "
+                f"Use one of {STEP_FUNCTIONS}"
+            )
+        unknown_steps = set(step.get("depends_on", [])) - set(names)
+        if unknown_steps:
+            raise ValueError(f"Step {step['name']} depends on unknown {unknown_steps}")
+    return plan
+
+
+def resolve_variables(value):
+    """
+    Replace $(variable) references with task variables exported by the previous
+    steps or, if not found there, with environment variables.
+    """
+    if isinstance(value, list):
+        return [resolve_variables(v) for v in value]
+    if isinstance(value, dict):
+        return {k: resolve_variables(v) for k, v in value.items()}
+    if not isinstance(value, str):
+        return value
+
+    def replace(match):
+        name = match.group(1)
+        for candidate in [
+            task_variables.get(name),
+            os.environ.get(name),
+            os.environ.get(name.upper()),
+        ]:
+            if candidate is not None:
+                return candidate
+        raise ValueError(f"Variable {name} is not defined")
+
+    return VARIABLE_PATTERN.sub(replace, value)
+
+
+def run_step(step: dict):
+    """
+    Import the step function (lazily) and run it with resolved arguments (async
+    functions in their own event loop in the step's thread).
+    """
+    function = get_command_function(step["function"])
+    args = resolve_variables(step.get("args", []))
+    kwargs = resolve_variables(step.get("kwargs", {}))
+    print(f"Step {step['name']}: {step['function']}{(*args,)} {kwargs}")
+    with tracer.span(step["name"], "step", function=step["function"]):
+        return call_command_function(function, *args, **kwargs)
+
+
+def run_plan(plan_file: str, max_parallel_steps: Union[int, str] = None) -> dict:
+    """
+    Run all of the steps of a deploy plan in a single interpreter, so that the
+    config, the token, the HTTP session and caches are shared between them.
+    A step is started as soon as all of the steps from its depends_on have
+    finished, so independent steps run concurrently. No new steps are started
+    after a failure; the first error is raised when the running steps finish.
+
+    :param plan_file: path to the JSON/YAML plan file (see load_plan)
+    :type plan_file: str
+    :param max_parallel_steps: maximum number of concurrently running steps,
+        overrides max_parallel_steps from the plan
+    :type max_parallel_steps: int
+
+    :return: time (in seconds) each of the steps took
+    :rtype: dict
+    """
+    plan = load_plan(plan_file)
+    if max_parallel_steps is None:
+        max_parallel_steps = plan.get("max_parallel_steps", 4)
+    steps = {step["name"]: step for step in plan["steps"]}
+    pending = dict(steps)
+    finished = set()
+    timings = {}
+    errors = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=int(max_parallel_steps)) as executor:
+
+        def timed_step(step):
+            started = time.monotonic()
+            try:
+                return run_step(step)
+            finally:
+                timings[step["name"]] = round(time.monotonic() - started, 2)
+
+        while pending or running:
+            if not errors:
+                for name, step in list(pending.items()):
+                    if set(step.get("depends_on", [])) <= finished:
+                        running[executor.submit(timed_step, step)] = name
+                        del pending[name]
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                if future.exception() is not None:
+                    errors[name] = future.exception()
+                else:
+                    finished.add(name)
+    print("Deploy plan summary:")
+    for name in steps:
+        if name in errors:
+            status = f"FAILED: {errors[name]!r}"
+        elif name in finished:
+            status = "OK"
+        else:
+            status = "NOT STARTED"
+        print(f"  {name}: {status} ({timings.get(name, '-')} s)")
+    if errors:
+        raise next(iter(errors.values()))
+    if pending:
+        raise ValueError(f"Steps {[*pending.keys()]} have circular dependencies")
+    return timings
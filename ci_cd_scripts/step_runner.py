@@ -0,0 +1,151 @@
+import time
+import asyncio
+import inspect
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Call:
+    """
+    Step calling function(*args, **kwargs) and sending back its result (or
+    throwing its exception into the generator). The function may be a coroutine
+    function (e.g. a method of AsyncDatabricksRequest) when the steps are run by
+    run_steps_async.
+    """
+
+    def __init__(self, function, *args, **kwargs) -> None:
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+
+
+class BlockingCall(Call):
+    """
+    Call of a function doing blocking I/O (e.g. DeployManifest.save) - it is run
+    in a thread by run_steps_async, so that it does not block the event loop.
+    """
+
+
+class Sleep:
+    """
+    Step waiting for a given number of seconds.
+    """
+
+    def __init__(self, seconds: float) -> None:
+        self.seconds = seconds
+
+
+class Gather:
+    """
+    Step running other steps (calls or generators of steps) concurrently, at most
+    max_parallel at a time, and sending back the list of their results in order.
+    With return_exceptions, exceptions are returned as results instead of the
+    first one being thrown.
+    """
+
+    def __init__(
+        self, steps: list, max_parallel: int = None, return_exceptions: bool = False
+    ) -> None:
+        self.steps = list(steps)
+        self.max_parallel = max(1, int(max_parallel or len(self.steps) or 1))
+        self.return_exceptions = return_exceptions
+
+
+def run_steps(steps):
+    """
+    Run a generator of steps (Call, Sleep, Gather, or another generator) with
+    blocking I/O - calls are made in the current thread and gathered steps in a
+    pool of threads. Returns the return value of the generator.
+
+    The workflows which have to be available both as regular functions and as
+    asyncio coroutines are written once as such generators - they yield the I/O
+    they need instead of doing it, so only the API objects (DatabricksRequest or
+    AsyncDatabricksRequest) and the runner (run_steps or run_steps_async) differ.
+    """
+    value, error = None, None
+    while True:
+        try:
+            step = steps.send(value) if error is None else steps.throw(error)
+        except StopIteration as e:
+            return e.value
+        value, error = None, None
+        try:
+            value = run_step(step)
+        except Exception as e:
+            error = e
+
+
+def run_step(step):
+    if inspect.isgenerator(step):
+        return run_steps(step)
+    if isinstance(step, Call):
+        return step.function(*step.args, **step.kwargs)
+    if isinstance(step, Sleep):
+        time.sleep(step.seconds)
+        return None
+    if isinstance(step, Gather):
+        if not step.steps:
+            return []
+
+        def run_gathered(gathered_step):
+            try:
+                return run_step(gathered_step)
+            except Exception as e:
+                if not step.return_exceptions:
+                    raise
+                return e
+
+        with ThreadPoolExecutor(max_workers=step.max_parallel) as executor:
+            # span attributes (e.g. cluster) are inherited by the gathered steps
+            futures = [
+                executor.submit(contextvars.copy_context().run, run_gathered, s)
+                for s in step.steps
+            ]
+            return [future.result() for future in futures]
+    raise TypeError(f"Invalid step: {step!r}")
+
+
+async def run_steps_async(steps):
+    """
+    Run a generator of steps (see run_steps) in an asyncio event loop - results
+    of coroutine functions are awaited, blocking calls are run in threads and
+    gathered steps are run as concurrent tasks.
+    """
+    value, error = None, None
+    while True:
+        try:
+            step = steps.send(value) if error is None else steps.throw(error)
+        except StopIteration as e:
+            return e.value
+        value, error = None, None
+        try:
+            value = await run_step_async(step)
+        except Exception as e:
+            error = e
+
+
+async def run_step_async(step):
+    if inspect.isgenerator(step):
+        return await run_steps_async(step)
+    if isinstance(step, BlockingCall):
+        return await asyncio.to_thread(step.function, *step.args, **step.kwargs)
+    if isinstance(step, Call):
+        result = step.function(*step.args, **step.kwargs)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+    if isinstance(step, Sleep):
+        await asyncio.sleep(step.seconds)
+        return None
+    if isinstance(step, Gather):
+        semaphore = asyncio.Semaphore(step.max_parallel)
+
+        async def run_gathered(gathered_step):
+            async with semaphore:
+                return await run_step_async(gathered_step)
+
+        return await asyncio.gather(
+            *(run_gathered(s) for s in step.steps),
+            return_exceptions=step.return_exceptions,
+        )
+    raise TypeError(f"Invalid step: {step!r}")
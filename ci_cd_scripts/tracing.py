@@ -0,0 +1,214 @@
+import os
+import sys
+import json
+import time
+import atexit
+import inspect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+
+
+# DEBUG shows verbose output (e.g. every discovered file and every API response)
+LOG_LEVEL = os.environ.get("CI_CD_LOG_LEVEL", "INFO").upper()
+# spans are exported to this file at exit - Chrome trace format (chrome://tracing,
+# Perfetto) if it ends with .json, JSON lines otherwise
+TRACE_FILE = os.environ.get("CI_CD_TRACE_FILE")
+# number of the slowest spans printed at exit
+TRACE_SUMMARY_SIZE = int(os.environ.get("CI_CD_TRACE_SUMMARY_SIZE", 10))
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Return a logger writing plain messages to stdout (as print does, so that the
+    output stays readable in pipeline logs) at CI_CD_LOG_LEVEL.
+    """
+    root = logging.getLogger("ci_cd_scripts")
+    if not root.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL)
+        root.propagate = False
+    return root.getChild(name)
+
+
+class Tracer:
+    """
+    Collector of spans - timed operations (workflow stages, API calls) with
+    attributes such as endpoint, status code, bytes sent or cluster id.
+    Spans can be nested; attributes of the enclosing spans of the current thread
+    or asyncio task (e.g. cluster) are inherited by the spans started inside them.
+    """
+
+    def __init__(self) -> None:
+        self.spans = []
+        self._lock = threading.Lock()
+        self._attributes = contextvars.ContextVar("span_attributes", default={})
+        self._origin = time.time() - time.perf_counter()
+
+    def current_attributes(self) -> dict:
+        return dict(self._attributes.get())
+
+    @contextmanager
+    def span(self, name: str, category: str = "stage", **attributes):
+        """
+        Time the enclosed block as a span. The yielded attributes dict can be
+        updated inside the block, e.g. with a status code.
+        """
+        attributes = {**self.current_attributes(), **attributes}
+        token = self._attributes.set(attributes)
+        started = time.perf_counter()
+        try:
+            yield attributes
+        except BaseException as e:
+            attributes["error"] = repr(e)
+            raise
+        finally:
+            self._attributes.reset(token)
+            self.record(name, category, started, time.perf_counter(), attributes)
+
+    def record(
+        self, name: str, category: str, started: float, ended: float, attributes: dict
+    ) -> None:
+        """
+        Record a span timed with time.perf_counter.
+        """
+        span = {
+            "name": name,
+            "category": category,
+            "start": round(self._origin + started, 6),
+            "duration_s": round(ended - started, 6),
+            "thread": threading.get_ident(),
+            **{k: v for k, v in attributes.items() if v is not None},
+        }
+        with self._lock:
+            self.spans.append(span)
+
+    def export(self, path: str) -> None:
+        """
+        Export spans to a file - as a Chrome trace if its name ends with .json,
+        as JSON lines otherwise.
+        """
+        with self._lock:
+            spans = list(self.spans)
+        with open(path, "w") as f:
+            if path.endswith(".json"):
+                json.dump({"traceEvents": [to_trace_event(s) for s in spans]}, f)
+            else:
+                for span in spans:
+                    f.write(json.dumps(span) + "\n")
+        print(f"Exported {len(spans)} span(s) to {path}")
+
+    def print_summary(self, size: int = TRACE_SUMMARY_SIZE) -> None:
+        """
+        Print totals per span category and the slowest spans.
+        """
+        with self._lock:
+            spans = list(self.spans)
+        if not spans:
+            return
+        print("Timing summary:")
+        for category in sorted({span["category"] for span in spans}):
+            durations = [s["duration_s"] for s in spans if s["category"] == category]
+            print(
+                f"  {category}: {len(durations)} span(s), "
+                f"{round(sum(durations), 2)} s in total"
+            )
+        print("Slowest steps:")
+        for span in sorted(spans, key=lambda s: s["duration_s"], reverse=True)[:size]:
+            details = ", ".join(
+                f"{k}={span[k]}"
+                for k in ["cluster", "status_code", "bytes_sent", "retries", "error"]
+                if k in span
+            )
+            print(
+                f"  {round(span['duration_s'], 2)} s {span['category']} "
+                f"{span['name']}" + (f" ({details})" if details else "")
+            )
+
+
+def to_trace_event(span: dict) -> dict:
+    """
+    Convert a span to a complete event ("ph": "X") of the Chrome trace format.
+    """
+    return {
+        "name": span["name"],
+        "cat": span["category"],
+        "ph": "X",
+        "ts": int(span["start"] * 1e6),
+        "dur": int(span["duration_s"] * 1e6),
+        "pid": os.getpid(),
+        "tid": span["thread"],
+        "args": {
+            k: v
+            for k, v in span.items()
+            if k not in ("name", "category", "start", "duration_s", "thread")
+        },
+    }
+
+
+tracer = Tracer()
+
+
+def traced(name: str = None, category: str = "stage", **attribute_getters):
+    """
+    Decorator recording each call of a function as a span.
+    attribute_getters map span attributes to the names of the function's arguments
+    or to functions of the bound arguments, e.g.
+    @traced(cluster="cluster") or @traced(cluster=lambda a: a["self"].cluster_id)
+    """
+
+    def decorator(function):
+        signature = inspect.signature(function)
+        span_name = name or function.__name__
+
+        def get_attributes(args, kwargs) -> dict:
+            attributes = {}
+            if attribute_getters:
+                arguments = signature.bind_partial(*args, **kwargs).arguments
+                for attribute, getter in attribute_getters.items():
+                    if callable(getter):
+                        attributes[attribute] = getter(arguments)
+                    else:
+                        attributes[attribute] = arguments.get(getter)
+            return attributes
+
+        if inspect.iscoroutinefunction(function):
+
+            @wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                attributes = get_attributes(args, kwargs)
+                with tracer.span(span_name, category, **attributes):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        if inspect.isgeneratorfunction(function):
+            # generators of steps (see step_runner) - the span covers the whole run
+
+            @wraps(function)
+            def generator_wrapper(*args, **kwargs):
+                attributes = get_attributes(args, kwargs)
+                with tracer.span(span_name, category, **attributes):
+                    return (yield from function(*args, **kwargs))
+
+            return generator_wrapper
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with tracer.span(span_name, category, **get_attributes(args, kwargs)):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@atexit.register
+def _report_at_exit() -> None:
+    if TRACE_FILE:
+        tracer.export(TRACE_FILE)
+    tracer.print_summary()